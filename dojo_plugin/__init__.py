@@ -39,6 +39,7 @@ from .pages.course import course
 from .pages.belts import belts
 from .pages.research import research
 from .pages.feed import feed
+from .pages.stats import stats
 from .pages.index import static_html_override
 from .pages.test_error import test_error_pages
 from .api import api
@@ -54,7 +55,7 @@ class DojoChallenge(BaseChallenge):
     @classmethod
     def solve(cls, user, team, challenge, request):
         super().solve(user, team, challenge, request)
-        update_awards(user)
+        update_awards(user, challenge.id)
 
         dojo_challenge = DojoChallenges.query.filter_by(challenge_id=challenge.id).first()
         if dojo_challenge:
@@ -226,6 +227,7 @@ def load(app):
     app.register_blueprint(belts)
     app.register_blueprint(research)
     app.register_blueprint(feed)
+    app.register_blueprint(stats)
     app.register_blueprint(test_error_pages)
     app.register_blueprint(api, url_prefix="/pwncollege_api/v1")
 
@@ -233,6 +235,7 @@ def load(app):
 
     register_admin_plugin_menu_bar("Dojos", "/admin/dojos")
     register_admin_plugin_menu_bar("Desktops", "/admin/desktops")
+    register_admin_plugin_menu_bar("Stats", "/admin/stats")
 
     before_request_funcs = app.before_request_funcs[None]
     tokens_handler = next(func for func in before_request_funcs if func.__name__ == "tokens")
@@ -1,5 +1,6 @@
 import datetime
 import hashlib
+import json
 import pathlib
 import logging
 import time
@@ -10,8 +11,9 @@ import docker
 import docker.errors
 import docker.types
 import redis
+import requests
 from .user import authed_only_cli, authed_only_ssh, CLI_AUTH_PREFIX
-from flask import abort, request, current_app
+from flask import Response, abort, request, current_app
 from itsdangerous.url_safe import URLSafeTimedSerializer
 from flask_restx import Namespace, Resource
 from CTFd.cache import cache
@@ -25,19 +27,23 @@ from ...models import DojoModules, DojoChallenges
 from ...utils import (
     container_name,
     lookup_workspace_token,
-    resolved_tar,
     serialize_user_flag,
+    reset_node_docker_client,
     user_docker_client,
     user_node,
     user_ipv4,
     get_current_container,
     is_challenge_locked,
 )
+from ...utils.active_containers import MAC_NODE, clear_active_container, get_active_container, set_active_container
+from ...utils.challenge_archive import challenge_archive
 from ...utils.dojo import dojo_accessible, get_current_dojo_challenge
 from ...utils.workspace import exec_run
+from ...utils.workspace_pool import WORKSPACE_POOL_SIZE, claim_pool_container, pool_key, pool_serves_home
 from ...utils.feed import publish_container_start
 from ...utils.background_stats import publish_stat_event
 from ...utils.request_logging import get_trace_id, log_generator_output
+from ...utils.start_jobs import FINISHED_STATUSES, active_start_job, get_start_job, publish_start_job, start_job_channel
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +64,7 @@ class WorkspaceInitializationError(RuntimeError):
 
 
 def remove_container(user):
+    clear_active_container(user.id)
     # Just in case our container is still running on the other docker container, let's make sure we try to kill both
     known_image_name = cache.get(f"user_{user.id}-running-image")
     images = [None, known_image_name]
@@ -91,30 +98,11 @@ def get_available_devices(docker_client):
     cache.set(key, devices, timeout=timeout)
     return devices
 
-def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, practice):
-    resolved_dojo_challenge = dojo_challenge.resolve()
-
-    start_time = time.time()
-    hostname = "~".join(
-        (["practice"] if practice else [])
-        + [
-            dojo_challenge.module.id,
-            re.sub(
-                r"[\s.-]+",
-                "-",
-                re.sub(r"[^a-z0-9\s.-]", "", dojo_challenge.name.lower()),
-            ),
-        ]
-    )[:64]
-
-    auth_token = URLSafeTimedSerializer(current_app.config["SECRET_KEY"]).dumps(
-        [user.id, dojo_challenge.id, "cli-auth-token"]
-    )
-    auth_token = f"{CLI_AUTH_PREFIX}{auth_token}"
-
+def workspace_attributes(docker_client, image_name, privileged, *, net_admin=False, user_mounts=()):
+    """Container create attributes shared by every workspace of an image, whoever it is started for."""
     challenge_bin_path = "/run/challenge/bin"
     dojo_bin_path = "/run/dojo/bin"
-    image = docker_client.images.get(resolved_dojo_challenge.image)
+    image = docker_client.images.get(image_name)
     image_env = image.attrs["Config"].get("Env") or []
     image_path = next((env_var[len("PATH="):].split(":") for env_var in image_env if env_var.startswith("PATH=")), [])
     env_path = ":".join([challenge_bin_path, dojo_bin_path, *image_path])
@@ -141,49 +129,33 @@ def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, p
     devices = [f"{device}:{device}:rwm" for device in allowed_devices if device in available_devices]
 
     capabilities = ["SYS_PTRACE"]
-    if resolved_dojo_challenge.privileged:
+    if privileged:
         capabilities.append("SYS_ADMIN")
-        if "workspace_net_admin" in resolved_dojo_challenge.dojo.permissions:
+        if net_admin:
             capabilities.append("NET_ADMIN")
 
-    container_create_attributes = dict(
-        image=resolved_dojo_challenge.image,
+    return dict(
+        image=image_name,
         entrypoint=[
             "/nix/var/nix/profiles/dojo-workspace/bin/dojo-init",
             f"{dojo_bin_path}/sleep",
             "6h",
         ],
-        name=container_name(user),
-        hostname=hostname,
         user="0",
         working_dir="/home/hacker",
         environment={
             "HOME": "/home/hacker",
             "PATH": env_path,
             "SHELL": f"{dojo_bin_path}/bash",
-            "DOJO_AUTH_TOKEN": auth_token,
             "DOJO_HOST": DOJO_HOST,
         },
-        labels={
-            "dojo.dojo_id": dojo_challenge.dojo.reference_id,
-            "dojo.module_id": dojo_challenge.module.id,
-            "dojo.challenge_id": dojo_challenge.id,
-            "dojo.challenge_description": dojo_challenge.description,
-            "dojo.user_id": str(user.id),
-            "dojo.as_user_id": str(as_user.id),
-            "dojo.auth_token": auth_token,
-            "dojo.mode": "privileged" if practice else "standard",
-        },
         mounts=mounts,
         devices=devices,
         network=None,
         extra_hosts={
-            hostname: "127.0.0.1",
             "vm": "127.0.0.1",
-            f"vm_{hostname}"[:64]: "127.0.0.1",
             "challenge.localhost": "127.0.0.1",
             "hacker.localhost": "127.0.0.1",
-            "dojo-user": user_ipv4(user),
             "pwn.college": "192.168.42.1",
             **USER_FIREWALL_ALLOWED,
         },
@@ -195,13 +167,85 @@ def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, p
         cpu_quota=400000,
         pids_limit=1024,
         mem_limit="4G",
-        runtime="io.containerd.run.kata.v2" if resolved_dojo_challenge.privileged else "runc",
+        runtime="io.containerd.run.kata.v2" if privileged else "runc",
         cap_add=capabilities,
         security_opt=[f"seccomp={SECCOMP}"],
         sysctls={"net.ipv4.ip_unprivileged_port_start": 1024},
     )
 
-    container = docker_client.containers.create(**container_create_attributes)
+
+def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, practice, progress=None):
+    resolved_dojo_challenge = dojo_challenge.resolve()
+    progress = progress or (lambda phase: None)
+
+    start_time = time.time()
+    hostname = "~".join(
+        (["practice"] if practice else [])
+        + [
+            dojo_challenge.module.id,
+            re.sub(
+                r"[\s.-]+",
+                "-",
+                re.sub(r"[^a-z0-9\s.-]", "", dojo_challenge.name.lower()),
+            ),
+        ]
+    )[:64]
+
+    auth_token = URLSafeTimedSerializer(current_app.config["SECRET_KEY"]).dumps(
+        [user.id, dojo_challenge.id, "cli-auth-token"]
+    )
+    auth_token = f"{CLI_AUTH_PREFIX}{auth_token}"
+
+    net_admin = "workspace_net_admin" in resolved_dojo_challenge.dojo.permissions
+    workspace_create_attributes = workspace_attributes(
+        docker_client,
+        resolved_dojo_challenge.image,
+        resolved_dojo_challenge.privileged,
+        net_admin=net_admin,
+        user_mounts=user_mounts,
+    )
+
+    labels = {
+        "dojo.dojo_id": dojo_challenge.dojo.reference_id,
+        "dojo.module_id": dojo_challenge.module.id,
+        "dojo.challenge_id": dojo_challenge.id,
+        "dojo.challenge_description": dojo_challenge.description,
+        "dojo.user_id": str(user.id),
+        "dojo.as_user_id": str(as_user.id),
+        "dojo.auth_token": auth_token,
+        "dojo.mode": "privileged" if practice else "standard",
+    }
+
+    progress("creating")
+    # Docker cannot add mounts to a running container, so a pooled workspace can only be given the user's home by
+    # binding it onto its /home/hacker; starts with any other mount always start cold.
+    container = None
+    home = next((mount for mount in user_mounts if mount["Target"] == "/home/hacker"), None)
+    if WORKSPACE_POOL_SIZE and all(mount is home for mount in user_mounts) and not (resolved_dojo_challenge.privileged and net_admin):
+        node_id = user_node(user)
+        key = pool_key(node_id if node_id is not None else -1, resolved_dojo_challenge.image, resolved_dojo_challenge.privileged)
+        if home is None or pool_serves_home(key):
+            container = claim_pool_container(docker_client, key, name=container_name(user), labels=labels, home=home)
+
+    if container is None:
+        container_create_attributes = dict(
+            workspace_create_attributes,
+            name=container_name(user),
+            hostname=hostname,
+            environment={**workspace_create_attributes["environment"], "DOJO_AUTH_TOKEN": auth_token},
+            labels=labels,
+            extra_hosts={
+                hostname: "127.0.0.1",
+                f"vm_{hostname}"[:64]: "127.0.0.1",
+                "dojo-user": user_ipv4(user),
+                **workspace_create_attributes["extra_hosts"],
+            },
+        )
+        container = docker_client.containers.create(**container_create_attributes)
+        claimed = False
+    else:
+        logger.info(f"claimed pooled workspace {container.id} after {time.time()-start_time:.1f} seconds")
+        claimed = True
 
     workspace_net = docker_client.networks.get("workspace_net")
     workspace_net.connect(
@@ -215,8 +259,13 @@ def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, p
     if not internet_access:
         default_network.disconnect(container)
 
-    container.start()
-    logger.info(f"container started after {time.time()-start_time:.1f} seconds")
+    progress("initializing")
+    if claimed:
+        # The pooled workspace is waiting in dojo-init for its user's auth token and address.
+        send_line(container, f"{auth_token} {user_ipv4(user)}")
+    else:
+        container.start()
+        logger.info(f"container started after {time.time()-start_time:.1f} seconds")
     workspace_output = bytearray()
     for message in log_generator_output(
         "workspace initialization ", container.logs(stream=True, follow=True), start_time=start_time
@@ -246,7 +295,7 @@ def insert_challenge(container, as_user, dojo_challenge):
     exec_run("/run/dojo/bin/mkdir -p /challenge", container=container)
 
     root_dir = dojo_challenge.path.parent.parent
-    challenge_tar = resolved_tar(
+    challenge_tar = challenge_archive(
         dojo_challenge.path,
         root_dir=root_dir,
         filter=lambda path: not is_option_path(path),
@@ -264,27 +313,26 @@ def insert_challenge(container, as_user, dojo_challenge):
         option = option_paths[
             int.from_bytes(option_hash[:8], "little") % len(option_paths)
         ]
-        container.put_archive("/challenge", resolved_tar(option, root_dir=root_dir))
-
-    exec_run(
-        r"/run/dojo/bin/find /challenge/ -mindepth 1 -exec /run/dojo/bin/chown root:root {} \;", container=container
-    )
-    exec_run(r"/run/dojo/bin/find /challenge/ -mindepth 1 -exec /run/dojo/bin/chmod 4755 {} \;", container=container)
+        container.put_archive("/challenge", challenge_archive(option, root_dir=root_dir))
 
 
-def insert_flag(container, flag):
-    flag = f"pwn.college{{{flag}}}"
+def send_line(container, line):
     if "localhost" in container.client.api.base_url:
         socket = container.attach_socket(params=dict(stdin=1, stream=1))
-        socket._sock.sendall(flag.encode() + b"\n")
+        socket._sock.sendall(line.encode() + b"\n")
         socket.close()
     else:
         ws = container.attach_socket(params=dict(stdin=1, stream=1), ws=True)
-        ws.send_text(f"{flag}\n")
+        ws.send_text(f"{line}\n")
         ws.close()
 
 
-def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True):
+def insert_flag(container, flag):
+    send_line(container, f"pwn.college{{{flag}}}")
+
+
+def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True, progress=None):
+    progress = progress or (lambda phase: None)
     docker_client = user_docker_client(user, image_name=dojo_challenge.image)
     node_id = user_node(user)
     if node_id is None:
@@ -292,6 +340,7 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True):
     logger.info(f"starting challenge dojo={
         dojo_challenge.dojo.reference_id
     } module={dojo_challenge.module.id} challenge={dojo_challenge.id} {practice=} {as_user=} node_id={node_id+1}")
+    progress("stopping")
     remove_container(user)
 
     user_mounts = []
@@ -333,9 +382,11 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True):
         user_mounts=user_mounts,
         dojo_challenge=dojo_challenge,
         practice=practice,
+        progress=progress,
     )
 
     if dojo_challenge.path.exists() and not dojo_challenge.resolve().image.startswith("challenges.pwn.college/"):
+        progress("inserting")
         insert_challenge(container, as_user, dojo_challenge)
 
     if practice:
@@ -346,6 +397,7 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True):
         flag = serialize_user_flag(as_user.id, dojo_challenge.challenge_id)
     insert_flag(container, flag)
 
+    progress("readying")
     workspace_output = bytearray()
     for message in log_generator_output(
         "workspace readying ", container.logs(stream=True, follow=True), start_time=start_time
@@ -373,6 +425,71 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None, home=True):
             workspace_output.decode(errors="replace"),
         )
 
+    set_active_container(user.id, container, MAC_NODE if dojo_challenge.image.startswith("mac:") else node_id)
+
+def start_challenge_with_retries(user, dojo_challenge, practice, *, as_user=None, home=True, debug=False, progress=None):
+    """Starts the challenge, retrying failed starts; progress, if given, is called with each phase and attempt."""
+    dojo = dojo_challenge.dojo
+    max_attempts = 3
+    attempt_errors = []
+    for attempt in range(1, max_attempts+1):
+        try:
+            logger.info(f"Starting challenge for user {user.id} (attempt {attempt}/{max_attempts})...")
+            start_challenge(
+                user,
+                dojo_challenge,
+                practice,
+                as_user=as_user,
+                home=home,
+                progress=(lambda phase: progress(phase, attempt)) if progress else None,
+            )
+
+            if dojo.official or dojo.data.get("type") == "public":
+                challenge_data = {
+                    "challenge_id": dojo_challenge.challenge_id,
+                    "challenge_name": dojo_challenge.name,
+                    "module_id": dojo_challenge.module.id if dojo_challenge.module else None,
+                    "module_name": dojo_challenge.module.name if dojo_challenge.module else None,
+                    "dojo_id": dojo.reference_id,
+                    "dojo_name": dojo.name
+                }
+                mode = "practice" if practice else "assessment"
+                actual_user = as_user or user
+                publish_container_start(actual_user, mode, challenge_data)
+
+            publish_stat_event("container_stats_update", {})
+
+            break
+        except Exception as e:
+            logger.warning(f"Attempt {attempt} failed for user {user.id} with error: {e}")
+            if isinstance(e, requests.exceptions.ConnectionError):
+                reset_node_docker_client(user_node(user))
+            attempt_error = {
+                "attempt": attempt,
+                "type": type(e).__name__,
+                "message": str(e),
+            }
+            if isinstance(e, WorkspaceInitializationError):
+                attempt_error["output"] = e.output
+            attempt_errors.append(attempt_error)
+            if attempt < max_attempts:
+                logger.info(f"Retrying... ({attempt}/{max_attempts})")
+                if progress:
+                    progress("retrying", attempt)
+                time.sleep(2)
+    else:
+        logger.error(f"ERROR: Docker failed for {user.id} after {max_attempts} attempts.")
+        response = {"success": False, "error": "Docker failed"}
+        if debug:
+            response["debug"] = {
+                "trace_id": get_trace_id(),
+                "attempts": attempt_errors,
+            }
+        return response
+
+    return {"success": True}
+
+
 def docker_locked(func):
     def wrapper(*args, **kwargs):
         user = get_current_user()
@@ -527,54 +644,27 @@ class RunDocker(Resource):
                     return {"success": False, "error": f"Not an official student in this dojo ({as_user_id})"}
                 as_user = student.user
 
-        max_attempts = 3
-        attempt_errors = []
-        for attempt in range(1, max_attempts+1):
-            try:
-                logger.info(f"Starting challenge for user {user.id} (attempt {attempt}/{max_attempts})...")
-                start_challenge(user, dojo_challenge, practice, as_user=as_user, home=home)
-
-                if dojo.official or dojo.data.get("type") == "public":
-                    challenge_data = {
-                        "challenge_id": dojo_challenge.challenge_id,
-                        "challenge_name": dojo_challenge.name,
-                        "module_id": dojo_challenge.module.id if dojo_challenge.module else None,
-                        "module_name": dojo_challenge.module.name if dojo_challenge.module else None,
-                        "dojo_id": dojo.reference_id,
-                        "dojo_name": dojo.name
-                    }
-                    mode = "practice" if practice else "assessment"
-                    actual_user = as_user or user
-                    publish_container_start(actual_user, mode, challenge_data)
-
-                publish_stat_event("container_stats_update", {})
-
-                break
-            except Exception as e:
-                logger.warning(f"Attempt {attempt} failed for user {user.id} with error: {e}")
-                attempt_error = {
-                    "attempt": attempt,
-                    "type": type(e).__name__,
-                    "message": str(e),
-                }
-                if isinstance(e, WorkspaceInitializationError):
-                    attempt_error["output"] = e.output
-                attempt_errors.append(attempt_error)
-                if attempt < max_attempts:
-                    logger.info(f"Retrying... ({attempt}/{max_attempts})")
-                    time.sleep(2)
-        else:
-            logger.error(f"ERROR: Docker failed for {user.id} after {max_attempts} attempts.")
-            response = {"success": False, "error": "Docker failed"}
-            resolved_dojo_challenge = dojo_challenge.resolve()
-            if resolved_dojo_challenge and resolved_dojo_challenge.dojo.is_admin(user):
-                response["debug"] = {
-                    "trace_id": get_trace_id(),
-                    "attempts": attempt_errors,
-                }
-            return response
-
-        return {"success": True}
+        resolved_dojo_challenge = dojo_challenge.resolve()
+        debug = bool(resolved_dojo_challenge and resolved_dojo_challenge.dojo.is_admin(user))
+
+        if data.get("async"):
+            if active_start_job(user.id):
+                return {"success": False, "error": "Already starting a challenge; try again in a few seconds."}
+            job = publish_start_job(user.id, {
+                "dojo_id": dojo_challenge.dojo_id,
+                "module_index": dojo_challenge.module_index,
+                "challenge_index": dojo_challenge.challenge_index,
+                "practice": bool(practice),
+                "as_user_id": as_user.id if as_user else None,
+                "home": home,
+                "debug": debug,
+                "trace_id": get_trace_id(),
+            })
+            if job:
+                return {"success": True, "job": job}
+            logger.warning(f"Could not queue a start job for user {user.id}, starting synchronously")
+
+        return start_challenge_with_retries(user, dojo_challenge, practice, as_user=as_user, home=home, debug=debug)
 
     @authed_only_cli
     @authed_only
@@ -583,12 +673,11 @@ class RunDocker(Resource):
         if not dojo_challenge:
             return {"success": False, "error": "No active challenge"}
 
-        user = get_current_user()
-        container = get_current_container(user)
-        if not container:
+        active_container = get_active_container(get_current_user())
+        if not active_container:
             return {"success": False, "error": "No challenge container"}
 
-        practice = container.labels.get("dojo.mode") == "privileged"
+        practice = active_container["mode"] == "privileged"
 
         return {
             "success": True,
@@ -613,3 +702,45 @@ class RunDocker(Resource):
         except Exception as e:
             logger.error(f"Failed to terminate container for user {user.id}: {e}")
             return {"success": False, "error": "Failed to terminate container"}
+
+
+@docker_namespace.route("/jobs/<job_id>")
+class StartJob(Resource):
+    @authed_only
+    def get(self, job_id):
+        job = get_start_job(job_id)
+        if not job or job["user_id"] != get_current_user().id:
+            return {"success": False, "error": "Invalid start job"}, 404
+        return {"success": True, "job": job}
+
+
+@docker_namespace.route("/jobs/<job_id>/stream")
+class StartJobStream(Resource):
+    @authed_only
+    def get(self, job_id):
+        job = get_start_job(job_id)
+        if not job or job["user_id"] != get_current_user().id:
+            return {"success": False, "error": "Invalid start job"}, 404
+        redis_url = current_app.config["REDIS_URL"]
+
+        def generate():
+            r = redis.from_url(redis_url, decode_responses=True)
+            pubsub = r.pubsub()
+            pubsub.subscribe(start_job_channel(job_id))
+            try:
+                # Read after subscribing, so that no update between the two is missed.
+                job = get_start_job(job_id, r)
+                while job and job["status"] not in FINISHED_STATUSES:
+                    yield f"data: {json.dumps(job)}\n\n"
+                    message = pubsub.get_message(timeout=15)
+                    if message and message["type"] == "message":
+                        job = json.loads(message["data"])
+                    else:
+                        job = get_start_job(job_id, r)
+                if job:
+                    yield f"data: {json.dumps(job)}\n\n"
+            finally:
+                pubsub.close()
+
+        return Response(generate(), mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
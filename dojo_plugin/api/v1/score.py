@@ -1,3 +1,7 @@
+import os
+import time
+from email.utils import formatdate
+
 from flask import request
 from flask_restx import Namespace, Resource
 from CTFd.cache import cache
@@ -5,9 +9,40 @@ from CTFd.models import Users, db, Solves, Challenges
 from CTFd.utils.decorators import ratelimit
 
 from ...models import Dojos, DojoChallenges
+from ...utils.scores import get_official_score
 
 score_namespace = Namespace("score")
 
+SCORE_MAX_AGE = int(os.environ.get("SCORE_CACHE_MAX_AGE", "10"))
+
+
+def official_score_from_database(user):
+    official_challenges = (
+        Challenges.query
+        .join(DojoChallenges)
+        .join(Dojos)
+        .filter(Dojos.official, DojoChallenges.visible())
+        .distinct()
+        .with_entities(Challenges.id)
+    )
+    rank = db.func.row_number().over(
+        order_by=(db.func.count(Solves.id).desc(), db.func.max(Solves.id))
+    ).label("rank")
+    scoreboard = (
+        db.session.query(rank, Solves.user_id, db.func.count(Solves.id).label("solves"))
+        .join(official_challenges.subquery())
+        .group_by(Solves.user_id)
+        .order_by(rank)
+        .all()
+    )
+
+    max_score = official_challenges.count()
+    user_ranking = next((ranking for ranking in scoreboard if ranking.user_id == user.id), None)
+    if not user_ranking:
+        return None, None, max_score, len(scoreboard)
+    return user_ranking.rank, user_ranking.solves, max_score, len(scoreboard)
+
+
 @score_namespace.route("/validate")
 class ValidateUser(Resource):
     """
@@ -40,30 +75,21 @@ class ScoreUser(Resource):
         if not user:
             return {"error": "user does not exist"}, 400
 
-        official_challenges = (
-            Challenges.query
-            .join(DojoChallenges)
-            .join(Dojos)
-            .filter(Dojos.official, DojoChallenges.visible())
-            .distinct()
-            .with_entities(Challenges.id)
-        )
-        rank = db.func.row_number().over(
-            order_by=(db.func.count(Solves.id).desc(), db.func.max(Solves.id))
-        ).label("rank")
-        scoreboard = (
-            db.session.query(rank, Solves.user_id, db.func.count(Solves.id).label("solves"))
-            .join(official_challenges.subquery())
-            .group_by(Solves.user_id)
-            .order_by(rank)
-            .all()
-        )
+        official = get_official_score(user.id)
+        if official:
+            rank, solves, max_score, user_count, updated_at = official
+            headers = {
+                "Cache-Control": f"public, max-age={SCORE_MAX_AGE}",
+                "Last-Modified": formatdate(updated_at, usegmt=True),
+                "X-Score-Age": str(max(0, int(time.time() - updated_at))),
+            }
+        else:
+            # The stats worker has not built the official ranking yet.
+            rank, solves, max_score, user_count = official_score_from_database(user)
+            headers = {"Cache-Control": "no-cache"}
 
-        max_score = official_challenges.count()
-        user_count = len(scoreboard)
-        user_ranking = next((ranking for ranking in scoreboard if ranking.user_id == user.id), None)
-        if not user_ranking:
+        if not rank:
             return {"error": "user is not ranked"}, 400
 
         # rank:score:max_score:challs_solved:chall_count:user_count
-        return f"{user_ranking.rank}:{user_ranking.solves}:{max_score}:{user_ranking.solves}:{max_score}:{user_count}"
+        return f"{rank}:{solves}:{max_score}:{solves}:{max_score}:{user_count}", 200, headers
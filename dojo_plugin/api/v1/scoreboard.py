@@ -10,6 +10,10 @@ from ...utils.dojo import dojo_route
 from ...utils.awards import get_belts, get_viewable_emojis
 from ...utils.background_stats import get_cached_stat
 from ...utils.crews import aggregate_crews, parse_crew_tag
+from ...utils.crew_store import crew_index_exists, read_crew_page, read_crew_rank
+from ...utils.scoreboard_store import (
+    zset_backend, read_scoreboard, read_scoreboard_page, read_scoreboard_entry, read_scoreboard_entries, scoreboard_size,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -38,19 +42,35 @@ def get_scoreboard_for(model, duration):
     cache_key = model_cache_key(model, "scoreboard", duration)
     if cache_key is None:
         return []
+    if zset_backend():
+        return read_scoreboard(cache_key)
     return get_cached_stat(cache_key) or []
 
 
+def scoreboard_is_empty(model, duration):
+    cache_key = model_cache_key(model, "scoreboard", duration)
+    if cache_key is not None and zset_backend():
+        return not scoreboard_size(cache_key)
+    return not get_scoreboard_for(model, duration)
+
+
 def get_crews_for(model, duration):
-    cache_key = model_cache_key(model, "crews", duration)
-    if cache_key is None:
-        return []
-    cached = get_cached_stat(cache_key)
-    if cached is not None:
-        return cached
+    # Only used until the worker has built the crew index for this board.
     return aggregate_crews(get_scoreboard_for(model, duration))
 
 
+def get_crew_members(model, duration, crews):
+    member_ids = set(user_id for crew in crews for user_id in crew["member_ids"])
+    if not member_ids:
+        return {}
+    cache_key = model_cache_key(model, "scoreboard", duration)
+    if zset_backend():
+        entries = read_scoreboard_entries(cache_key, member_ids)
+    else:
+        entries = [entry for entry in get_cached_stat(cache_key) or [] if entry["user_id"] in member_ids]
+    return {entry["user_id"]: entry for entry in entries}
+
+
 def standing_entry(item, belt_data, emojis):
     if not item:
         return None
@@ -58,6 +78,7 @@ def standing_entry(item, belt_data, emojis):
     belt_color = belt_data["users"].get(user_id, {"color": "white"})["color"]
     result = {key: item[key] for key in item.keys()}
     result.pop("challenges", None)
+    result.pop("last_solve_id", None)
     parsed = parse_crew_tag(result.get("name"))
     result.update({
         "url": url_for("pwncollege_users.view_other", user_id=user_id),
@@ -76,15 +97,22 @@ def page_numbers(total, page, per_page):
 
 def get_scoreboard_page(model, duration=None, page=1, per_page=20):
     belt_data = get_belts()
-    results = get_scoreboard_for(model, duration)
+    cache_key = model_cache_key(model, "scoreboard", duration)
+    ranked = cache_key is not None and zset_backend()
 
     start_idx = (page - 1) * per_page
     end_idx = start_idx + per_page
     user = get_current_user()
     emojis = get_viewable_emojis(user)
 
+    if ranked:
+        page_items, total = read_scoreboard_page(cache_key, start_idx, per_page)
+    else:
+        results = get_scoreboard_for(model, duration)
+        page_items, total = results[start_idx:end_idx], len(results)
+
     standings_list = []
-    for item in results[start_idx:end_idx]:
+    for item in page_items:
         entry = standing_entry(item, belt_data, emojis)
         if entry is not None:
             standings_list.append(entry)
@@ -93,14 +121,17 @@ def get_scoreboard_page(model, duration=None, page=1, per_page=20):
         "standings": standings_list,
     }
 
-    pages = page_numbers(len(results), page, per_page)
+    pages = page_numbers(total, page, per_page)
 
     if user and not user.hidden:
-        me = None
-        for item in results:
-            if item["user_id"] == user.id:
-                me = standing_entry(item, belt_data, emojis)
-                break
+        if ranked:
+            me = standing_entry(read_scoreboard_entry(cache_key, user.id), belt_data, emojis)
+        else:
+            me = None
+            for item in results:
+                if item["user_id"] == user.id:
+                    me = standing_entry(item, belt_data, emojis)
+                    break
         if me:
             pages.add((me["rank"] - 1) // per_page + 1)
             result["me"] = me
@@ -114,13 +145,34 @@ def get_crew_scoreboard_page(model, duration=None, page=1, per_page=20, mode="cu
     belt_data = get_belts()
     user = get_current_user()
     emojis = get_viewable_emojis(user)
-    crews = get_crews_for(model, duration)
+    crews_key = model_cache_key(model, "crews", duration)
+    parsed = parse_crew_tag(user.name) if user and not user.hidden else None
 
-    if mode == "unique" and all(crew.get("unique_rank") is not None for crew in crews):
-        crews = sorted(crews, key=lambda crew: crew["unique_rank"])
+    start_idx = (page - 1) * per_page
+    end_idx = start_idx + per_page
 
-    def crew_rank(crew):
-        return crew["unique_rank"] if mode == "unique" and crew.get("unique_rank") is not None else crew["rank"]
+    if crews_key is not None and crew_index_exists(crews_key):
+        page_crews, total = read_crew_page(crews_key, mode, start_idx, per_page)
+        my_crew = read_crew_rank(crews_key, mode, parsed["key"]) if parsed else None
+        shown = page_crews + ([my_crew] if my_crew else [])
+        members = get_crew_members(model, duration, shown)
+        for crew in shown:
+            crew["members"] = sorted(
+                (members[user_id] for user_id in crew["member_ids"] if user_id in members),
+                key=lambda member: member["rank"],
+            )
+
+        def crew_rank(crew):
+            return crew["rank"]
+    else:
+        crews = get_crews_for(model, duration)
+        if mode == "unique" and all(crew.get("unique_rank") is not None for crew in crews):
+            crews = sorted(crews, key=lambda crew: crew["unique_rank"])
+        page_crews, total = crews[start_idx:end_idx], len(crews)
+        my_crew = next((crew for crew in crews if crew["key"] == parsed["key"]), None) if parsed else None
+
+        def crew_rank(crew):
+            return crew["unique_rank"] if mode == "unique" and crew.get("unique_rank") is not None else crew["rank"]
 
     def crew_entry(crew):
         return {
@@ -135,27 +187,21 @@ def get_crew_scoreboard_page(model, duration=None, page=1, per_page=20, mode="cu
             ],
         }
 
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
     result = {
-        "standings": [crew_entry(crew) for crew in crews[start_idx:end_idx]],
+        "standings": [crew_entry(crew) for crew in page_crews],
         "mode": mode,
     }
 
-    pages = page_numbers(len(crews), page, per_page)
+    pages = page_numbers(total, page, per_page)
 
-    if user and not user.hidden:
-        parsed = parse_crew_tag(user.name)
-        if parsed:
-            my_crew = next((crew for crew in crews if crew["key"] == parsed["key"]), None)
-            if my_crew:
-                pages.add((crew_rank(my_crew) - 1) // per_page + 1)
-                result["me_crew"] = crew_entry(my_crew)
+    if my_crew:
+        pages.add((crew_rank(my_crew) - 1) // per_page + 1)
+        result["me_crew"] = crew_entry(my_crew)
 
     result["pages"] = sorted(pages)
 
-    if not crews:
-        result["board_empty"] = not get_scoreboard_for(model, duration)
+    if not total:
+        result["board_empty"] = scoreboard_is_empty(model, duration)
 
     return result
 
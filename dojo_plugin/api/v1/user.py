@@ -5,7 +5,7 @@ from CTFd.utils.decorators import authed_only
 from CTFd.utils.user import get_current_user
 from CTFd.models import Users
 from ...config import DOJO_SSH_SERVICE_KEY
-from ...utils import get_current_container
+from ...utils.active_containers import get_active_container
 
 user_namespace = Namespace("user", description="User management endpoints")
 CLI_AUTH_PREFIX = "sk-workspace-local-"
@@ -65,10 +65,10 @@ def authed_only_cli(func):
         except Exception:
             return {"success": False, "error": "Failed to authenticate container token."}, 401
         user = Users.query.filter_by(id=user_id).one()
-        container = get_current_container(user)
-        if container is None:
+        active_container = get_active_container(user)
+        if active_container is None:
             return {"success": False, "error": "No active challenge container."}, 403
-        if container.labels["dojo.challenge_id"] != challenge_id:
+        if active_container["challenge"] != challenge_id:
             return {"success": False, "error": "Token failed to authenticate active challenge container."}, 403
         try:
             session.update({
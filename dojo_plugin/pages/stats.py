@@ -0,0 +1,48 @@
+from flask import Blueprint, render_template, request, redirect, url_for
+from CTFd.utils.decorators import admins_only
+
+from ..utils.background_stats import (
+    DEAD_LETTER_STREAM_NAME,
+    CONSUMER_GROUP,
+    get_redis_client,
+    get_event_counters,
+    get_l1_counters,
+    stat_stream_names,
+    get_dead_letter_events,
+    replay_dead_letter_events,
+    discard_dead_letter_events,
+)
+
+
+stats = Blueprint("pwncollege_stats", __name__)
+
+
+def stream_summary():
+    r = get_redis_client()
+    summary = {"stream_length": 0, "dead_length": r.xlen(DEAD_LETTER_STREAM_NAME), "pending": 0}
+    for stream_name in stat_stream_names():
+        summary["stream_length"] += r.xlen(stream_name)
+        try:
+            summary["pending"] += r.xpending(stream_name, CONSUMER_GROUP)["pending"]
+        except Exception:
+            pass
+    summary["counters"] = get_event_counters()
+    summary["l1"] = get_l1_counters()
+    return summary
+
+
+@stats.route("/admin/stats", methods=["GET", "POST"])
+@admins_only
+def view_stats_admin():
+    if request.method == "POST":
+        dead_ids = request.form.getlist("dead_id")
+        action = request.form.get("action")
+        if action == "replay":
+            replay_dead_letter_events(dead_ids)
+        elif action == "replay_all":
+            replay_dead_letter_events()
+        elif action == "discard":
+            discard_dead_letter_events(dead_ids)
+        return redirect(url_for("pwncollege_stats.view_stats_admin"))
+
+    return render_template("admin_stats.html", summary=stream_summary(), dead_letters=get_dead_letter_events())
@@ -11,7 +11,7 @@ from CTFd.models import db, Users, Challenges, Solves
 from CTFd.cache import cache
 
 from ..models import Dojos, DojoModules, DojoChallenges
-from ..utils.scores import get_dojo_scores, get_module_scores
+from ..utils.scores import dojo_scores_cache_key, module_scores_cache_key, rank_index_key, get_rank_and_solves
 from ..utils.awards import get_belts, get_viewable_emojis
 from ..worker.handlers.awards import calculate_belts, calculate_emojis
 
@@ -25,77 +25,92 @@ def build_user_scores(user, dojos):
     dojo_scores = {
         "user_ranks": {user_id: {}},
         "user_solves": {user_id: {}},
-        "dojo_ranks": {}
+        "dojo_totals": {}
     }
     module_scores = {
         "user_ranks": {user_id: {}},
         "user_solves": {user_id: {}},
-        "module_ranks": {}
+        "module_totals": {}
     }
 
+    rank_keys = {}
     for dojo in dojos:
-        dojo_id = dojo.id
-        scores = get_dojo_scores(dojo.dojo_id)
-        ranks = scores.get("ranks", [])
-        solves = scores.get("solves", {})
-
-        dojo_scores["dojo_ranks"][dojo_id] = ranks
+        rank_keys[(dojo.id, None)] = rank_index_key(dojo_scores_cache_key(dojo.dojo_id))
+        for module in dojo.modules:
+            rank_keys[(dojo.id, module.module_index)] = rank_index_key(module_scores_cache_key(dojo.dojo_id, module.module_index))
+    standings = get_rank_and_solves(rank_keys.values(), user_id)
 
-        try:
-            rank = ranks.index(user_id) + 1
+    for dojo in dojos:
+        dojo_id = dojo.id
+        rank, solves, total = standings[rank_keys[(dojo_id, None)]]
+        dojo_scores["dojo_totals"][dojo_id] = total
+        if rank is not None:
             dojo_scores["user_ranks"][user_id][dojo_id] = rank
-            user_solve_count = solves.get(str(user_id)) or solves.get(user_id) or 0
-            dojo_scores["user_solves"][user_id][dojo_id] = user_solve_count
-        except ValueError:
-            pass
+            dojo_scores["user_solves"][user_id][dojo_id] = solves
 
-        module_scores["module_ranks"][dojo_id] = {}
+        module_scores["module_totals"][dojo_id] = {}
         module_scores["user_ranks"][user_id][dojo_id] = {}
         module_scores["user_solves"][user_id][dojo_id] = {}
 
         for module in dojo.modules:
             module_index = module.module_index
-            m_scores = get_module_scores(dojo.dojo_id, module_index)
-            m_ranks = m_scores.get("ranks", [])
-            m_solves = m_scores.get("solves", {})
-
-            module_scores["module_ranks"][dojo_id][module_index] = m_ranks
-
-            try:
-                rank = m_ranks.index(user_id) + 1
+            rank, solves, total = standings[rank_keys[(dojo_id, module_index)]]
+            module_scores["module_totals"][dojo_id][module_index] = total
+            if rank is not None:
                 module_scores["user_ranks"][user_id][dojo_id][module_index] = rank
-                user_solve_count = m_solves.get(str(user_id)) or m_solves.get(user_id) or 0
-                module_scores["user_solves"][user_id][dojo_id][module_index] = user_solve_count
-            except ValueError:
-                pass
+                module_scores["user_solves"][user_id][dojo_id][module_index] = solves
 
     return dojo_scores, module_scores
 
 
-def view_hacker(user, bypass_hidden=False):
-    if user.hidden and not bypass_hidden:
-        abort(404)
+def build_user_solves(user, dojos):
+    user_solves = {dojo.id: {} for dojo in dojos}
+    if not user or not dojos:
+        return user_solves
 
-    dojos = (Dojos
-             .viewable(user=get_current_user())
-             .options(db.undefer(Dojos.required_challenges_count))
-             .filter(Dojos.data["type"].astext != "hidden", Dojos.data["type"].astext != "course")
-             .all())
-    user_solves = {}
-    for dojo in dojos:
-        dojo_id = dojo.id
-        user_solves[dojo_id] = {}
+    module_ids = {(dojo.dojo_id, module.module_index): (dojo.id, module.id) for dojo in dojos for module in dojo.modules}
+    solves = (
+        DojoChallenges.solves(user=user, ignore_visibility=True, ignore_admins=False)
+        .filter(DojoChallenges.dojo_id.in_([dojo.dojo_id for dojo in dojos]))
+        .with_entities(DojoChallenges.dojo_id, DojoChallenges.module_index, Solves.challenge_id, Solves.date)
+    )
+    for dojo_id, module_index, challenge_id, date in solves:
+        dojo_reference_id, module_id = module_ids[(dojo_id, module_index)]
+        user_solves[dojo_reference_id].setdefault(module_id, {})[challenge_id] = date.strftime("%Y-%m-%d %H:%M:%S")
+    return user_solves
+
+
+def load_profile_data(user, dojos):
+    """
+    Loads everything the profile shows about `user` across `dojos`: their solves in one query, and their ranks from the
+    cached rankings in one Redis round-trip. The dojos should have their modules and challenges loaded (see
+    profile_dojos) so that neither step queries per dojo.
+    """
+    dojo_scores, module_scores = build_user_scores(user, dojos)
+    return {
+        "user_solves": build_user_solves(user, dojos),
+        "dojo_scores": dojo_scores,
+        "module_scores": module_scores,
+    }
 
-        for module in dojo.modules:
-            module_id = module.id
-            solves = module.solves(user=user, ignore_visibility=True, ignore_admins=False) if user else []
 
-            if solves:
-                user_solves[dojo_id][module_id] = {
-                    solve.challenge_id: solve.date.strftime("%Y-%m-%d %H:%M:%S") for solve in solves
-                }
+def profile_dojos():
+    return (Dojos
+            .viewable(user=get_current_user())
+            .options(db.undefer(Dojos.required_challenges_count),
+                     db.selectinload(Dojos._modules)
+                     .selectinload(DojoModules._challenges)
+                     .selectinload(DojoChallenges.visibility))
+            .filter(Dojos.data["type"].astext != "hidden", Dojos.data["type"].astext != "course")
+            .all())
 
-    dojo_scores, module_scores = build_user_scores(user, dojos)
+
+def view_hacker(user, bypass_hidden=False):
+    if user.hidden and not bypass_hidden:
+        abort(404)
+
+    dojos = profile_dojos()
+    profile = load_profile_data(user, dojos)
 
     if user.hidden and bypass_hidden:
         belts = calculate_belts(user)
@@ -107,9 +122,8 @@ def view_hacker(user, bypass_hidden=False):
     return render_template(
         "hacker.html",
         dojos=dojos, user=user,
-        dojo_scores=dojo_scores, module_scores=module_scores,
         belts=belts, badges=badges,
-        user_solves=user_solves
+        **profile
     )
 
 @users.route("/hacker/<int:user_id>")
@@ -0,0 +1,90 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+from CTFd.models import db, Users, Solves
+
+from ..models import Dojos
+from ..worker.handlers.activity import iter_user_activity, retention_start
+
+parser = argparse.ArgumentParser(description="Compare the memory used to initialize activity from solve timestamps and from hourly solve counts, on a synthetic year of solves. All inserted rows are rolled back and nothing is cached.")
+parser.add_argument("dojo", help="reference id of the dojo whose challenges the synthetic users solve")
+parser.add_argument("--users", type=int, default=2000, help="number of synthetic users (default: 2000)")
+parser.add_argument("--solve-rate", type=float, default=0.5, help="probability that a user solved each challenge (default: 0.5)")
+parser.add_argument("--days", type=int, default=365, help="spread solve dates over this many days (default: 365)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+dojo = Dojos.from_id(args.dojo).first()
+if not dojo:
+    print(f"Dojo {args.dojo} not found")
+    os._exit(1)
+
+now = datetime.datetime.utcnow()
+suffix = os.getpid()
+
+
+def timestamp_activity(user_ids):
+    # Initialization as it was before solves were bucketed, kept as the baseline: every solve date is loaded at once.
+    all_solves = (
+        Solves.query
+        .filter(Solves.date >= retention_start(now), Solves.user_id.in_(user_ids))
+        .with_entities(Solves.user_id, Solves.date)
+        .all()
+    )
+    user_timestamps = defaultdict(list)
+    for user_id, date in all_solves:
+        user_timestamps[user_id].append(date.isoformat() + 'Z')
+    for user_id, timestamps in user_timestamps.items():
+        yield user_id, {'solve_timestamps': timestamps, 'total_solves': len(timestamps)}
+
+
+def hourly_activity(user_ids):
+    return iter_user_activity(user_ids, now)
+
+
+def measure(func, user_ids):
+    db.session.expire_all()
+    tracemalloc.start()
+    start = time.time()
+    cached_bytes = 0
+    users = 0
+    for user_id, activity in func(user_ids):
+        cached_bytes += len(json.dumps(activity))
+        users += 1
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, cached_bytes, users
+
+
+try:
+    print(f"Inserting {args.users} synthetic users over {len(dojo.challenges)} challenges in {dojo.reference_id}...")
+    users = [Users(name=f"bench-{suffix}-{i}", email=f"bench-{suffix}-{i}@example.com", password="bench") for i in range(args.users)]
+    db.session.add_all(users)
+    db.session.flush()
+    solves = [
+        Solves(user_id=user.id, challenge_id=challenge.challenge_id, ip="127.0.0.1", provided="bench",
+               date=now - datetime.timedelta(seconds=random.uniform(0, args.days * 86400)))
+        for user in users
+        for challenge in dojo.challenges
+        if random.random() < args.solve_rate
+    ]
+    db.session.add_all(solves)
+    db.session.flush()
+    print(f"Inserted {len(solves)} synthetic solves")
+
+    user_ids = [user.id for user in users]
+    for name, func in [("timestamps", timestamp_activity), ("hourly", hourly_activity)]:
+        elapsed, peak, cached_bytes, count = measure(func, user_ids)
+        print(f"{name:>10}: {elapsed:.3f}s, peak {peak / 2**20:.1f} MiB, {cached_bytes / 2**20:.1f} MiB cached for {count} users")
+finally:
+    db.session.rollback()
+    os._exit(0)
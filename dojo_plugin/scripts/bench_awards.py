@@ -0,0 +1,86 @@
+import argparse
+import os
+import random
+import time
+
+from CTFd.models import db, Users, Solves
+from sqlalchemy import event
+
+from ..models import Dojos
+from ..utils.awards import BELT_REQUIREMENTS, award_candidate_dojos, get_user_emojis, completed_dojos
+from ..utils.completions import forget_user
+
+parser = argparse.ArgumentParser(description="Compare the award checks run after a solve before and after the completion index, for users with the most solves. Nothing is awarded.")
+parser.add_argument("--users", type=int, default=5, help="number of users to measure, taken from those with the most solves (default: 5)")
+parser.add_argument("--repeat", type=int, default=5, help="timed runs per user and approach (default: 5)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+
+def legacy_check(user, challenge_id):
+    # The checks as they were before the completion index, kept as the baseline: every dojo is counted on every solve.
+    for dojo_id in BELT_REQUIREMENTS.values():
+        dojo = Dojos.query.filter(Dojos.official, Dojos.id == dojo_id).first()
+        if not (dojo and dojo.completed(user)):
+            break
+    for dojo in Dojos.query.all():
+        if dojo.award and dojo.award.get("emoji") and dojo.challenges and dojo.completed(user):
+            pass
+
+
+def indexed_check(user, challenge_id):
+    belt_dojos = (
+        Dojos.query
+        .options(db.undefer(Dojos.challenges_count), db.undefer(Dojos.required_challenges_count))
+        .filter(Dojos.official, Dojos.id.in_(list(BELT_REQUIREMENTS.values())))
+        .all()
+    )
+    completed_dojos(user, belt_dojos)
+    get_user_emojis(user, award_candidate_dojos(challenge_id))
+
+
+statements = 0
+def count_statement(*_):
+    global statements
+    statements += 1
+
+
+def measure(func, user, challenge_id):
+    global statements
+    timings = []
+    for _ in range(args.repeat):
+        db.session.expire_all()
+        statements = 0
+        start = time.perf_counter()
+        func(user, challenge_id)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, statements
+
+
+event.listen(db.engine, "before_cursor_execute", count_statement)
+try:
+    top_users = (
+        Solves.query.with_entities(Solves.user_id)
+        .group_by(Solves.user_id)
+        .order_by(db.func.count(Solves.id).desc())
+        .limit(args.users)
+    )
+    print(f"{Dojos.query.count()} dojos")
+    for user_id, in top_users:
+        user = Users.query.get(user_id)
+        challenge_id, = random.choice(Solves.query.filter_by(user_id=user_id).with_entities(Solves.challenge_id).all())
+        forget_user(user_id)
+        results = {
+            "legacy": measure(legacy_check, user, challenge_id),
+            "index (cold)": measure(lambda user, challenge_id: (forget_user(user.id), indexed_check(user, challenge_id)), user, challenge_id),
+            "index (warm)": measure(indexed_check, user, challenge_id),
+        }
+        print(f"user {user_id} ({Solves.query.filter_by(user_id=user_id).count()} solves):")
+        for name, (milliseconds, queries) in results.items():
+            print(f"  {name:>14}: {milliseconds:8.1f} ms, {queries:4d} queries")
+finally:
+    event.remove(db.engine, "before_cursor_execute", count_statement)
+    db.session.rollback()
+    os._exit(0)
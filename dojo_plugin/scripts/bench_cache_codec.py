@@ -0,0 +1,64 @@
+import argparse
+import os
+import random
+import string
+import time
+
+import redis
+from flask import current_app
+
+from ..utils.cache_codec import CACHE_CODECS, encode_stat, decode_stat
+
+parser = argparse.ArgumentParser(description="Compare encode time, decode time and Redis memory of the cache codecs on synthetic scoreboards.")
+parser.add_argument("--redis-url", default=current_app.config.get("REDIS_URL", "redis://cache:6379"))
+parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated scoreboard sizes in entries (default: 1000,10000,100000)")
+parser.add_argument("--repeat", type=int, default=5, help="timed runs per codec and size (default: 5)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+r = redis.from_url(args.redis_url, decode_responses=False)
+bench_key = f"bench:cache_codec:{os.getpid()}"
+
+
+def synthetic_scoreboard(size):
+    # Shaped like calculate_scoreboard rows, ranked by solves.
+    solves = sorted((random.randrange(1, 500) for _ in range(size)), reverse=True)
+    return [
+        {
+            "rank": rank,
+            "solves": user_solves,
+            "last_solve_id": random.randrange(10 ** 7),
+            "user_id": random.randrange(10 ** 6),
+            "name": "".join(random.choices(string.ascii_letters + string.digits, k=random.randrange(4, 20))),
+            "email": "".join(random.choices(string.ascii_lowercase, k=random.randrange(6, 16))) + "@example.com",
+        }
+        for rank, user_solves in enumerate(solves, 1)
+    ]
+
+
+def best_of(func):
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+
+try:
+    for size in (int(size) for size in args.sizes.split(",")):
+        scoreboard = synthetic_scoreboard(size)
+        print(f"{size} entries:")
+        for codec in CACHE_CODECS:
+            encode_ms, encoded = best_of(lambda: encode_stat(scoreboard, codec))
+            decode_ms, decoded = best_of(lambda: decode_stat(encoded))
+            assert decoded == scoreboard, f"{codec} did not round trip"
+            r.set(bench_key, encoded)
+            memory = r.memory_usage(bench_key, samples=0)
+            print(f"  {codec:>13}: encode {encode_ms:8.1f} ms, decode {decode_ms:8.1f} ms, "
+                  f"{len(encoded) / 2**10:9.1f} KiB, Redis {memory / 2**10:9.1f} KiB")
+finally:
+    r.delete(bench_key)
+    os._exit(0)
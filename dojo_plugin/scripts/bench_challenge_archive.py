@@ -0,0 +1,79 @@
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+
+import docker
+
+from ..utils import node_docker_client, resolved_tar
+from ..utils.challenge_archive import build_challenge_archive, challenge_archive
+
+parser = argparse.ArgumentParser(description="Compare the time to copy a challenge with many files into a container: building the archive and fixing ownership and modes afterwards, as starts used to, against the cached archive with ownership and modes in its headers.")
+parser.add_argument("--files", default="10,100,1000,5000", help="comma-separated numbers of files in the synthetic challenge (default: 10,100,1000,5000)")
+parser.add_argument("--file-size", type=int, default=4096, help="bytes per file (default: 4096)")
+parser.add_argument("--node", type=int, default=-1, help="workspace node to run the container on (default: the local docker)")
+parser.add_argument("--repeat", type=int, default=3, help="timed runs per method and size (default: 3)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+docker_client = node_docker_client(args.node)
+container = docker_client.containers.run("busybox:uclibc", ["sleep", "1h"], detach=True, auto_remove=True)
+
+
+def run(cmd):
+    exit_code, output = container.exec_run(cmd)
+    assert exit_code == 0, output
+
+
+def synthetic_challenge(root, files):
+    challenge = root / "challenge"
+    for i in range(files):
+        path = challenge / f"dir{i // 100}" / f"file{i}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(args.file_size))
+    return challenge
+
+
+def insert_fixed_up(challenge, root):
+    container.put_archive("/challenge", resolved_tar(challenge, root_dir=root))
+    run(r"/bin/find /challenge/ -mindepth 1 -exec /bin/chown root:root {} ;")
+    run(r"/bin/find /challenge/ -mindepth 1 -exec /bin/chmod 4755 {} ;")
+
+
+def insert_built(challenge, root):
+    container.put_archive("/challenge", build_challenge_archive(challenge, root_dir=root))
+
+
+def insert_cached(challenge, root):
+    container.put_archive("/challenge", challenge_archive(challenge, root_dir=root))
+
+
+def best_of(insert, challenge, root):
+    timings = []
+    for _ in range(args.repeat):
+        run("/bin/rm -rf /challenge")
+        run("/bin/mkdir -p /challenge")
+        start = time.perf_counter()
+        insert(challenge, root)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+try:
+    for files in (int(files) for files in args.files.split(",")):
+        with tempfile.TemporaryDirectory() as root:
+            root = pathlib.Path(root)
+            challenge = synthetic_challenge(root, files)
+            challenge_archive(challenge, root_dir=root)
+            print(f"{files} files:")
+            for name, insert in [("fixed up", insert_fixed_up), ("built", insert_built), ("cached", insert_cached)]:
+                print(f"  {name:>8}: {best_of(insert, challenge, root):9.1f} ms")
+finally:
+    try:
+        container.remove(force=True)
+    except docker.errors.APIError:
+        pass
+    os._exit(0)
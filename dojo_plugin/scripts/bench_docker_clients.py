@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import docker
+
+from ..utils.docker_clients import reset_docker_client, shared_docker_client
+
+parser = argparse.ArgumentParser(description="Compare a new docker client per request with the shared client, against a local stand-in for the Docker API that counts connections and requests.")
+parser.add_argument("--requests", type=int, default=500, help="simulated web requests per method (default: 500)")
+parser.add_argument("--latency", type=float, default=0.0, help="seconds the stand-in waits before accepting each connection, to model a remote node (default: 0)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+counts = {"connections": 0, "requests": 0, "version": 0}
+counts_lock = threading.Lock()
+
+
+class StandInDocker(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        time.sleep(args.latency)
+        with counts_lock:
+            counts["connections"] += 1
+        super().setup()
+
+    def log_message(self, *_):
+        pass
+
+    def reply(self, body, content_type="application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with counts_lock:
+            counts["requests"] += 1
+            counts["version"] += self.path.endswith("/version")
+        if self.path.endswith("/_ping"):
+            self.reply(b"OK", "text/plain")
+        elif self.path.endswith("/version"):
+            self.reply(json.dumps({"ApiVersion": "1.43", "Version": "24.0.0"}).encode())
+        else:
+            # What a page render asks for: the user's container.
+            self.reply(json.dumps({"Id": "0" * 64, "Name": "/user_1", "Config": {"Labels": {}}, "State": {"Status": "running"}}).encode())
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StandInDocker)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f"tcp://127.0.0.1:{server.server_address[1]}"
+
+
+def new_client():
+    return docker.DockerClient(base_url=base_url, tls=False)
+
+
+def per_request():
+    client = new_client()
+    client.containers.get("user_1")
+
+
+def shared():
+    shared_docker_client("bench", new_client).containers.get("user_1")
+
+
+try:
+    for name, request in [("new client", per_request), ("shared", shared)]:
+        with counts_lock:
+            counts.update(connections=0, requests=0, version=0)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            request()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed / args.requests * 1000:6.2f} ms per request, "
+              f"{counts['connections']} connections, {counts['version']} version lookups, {counts['requests']} API calls")
+finally:
+    reset_docker_client("bench")
+    server.shutdown()
+    os._exit(0)
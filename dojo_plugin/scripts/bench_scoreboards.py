@@ -0,0 +1,72 @@
+import argparse
+import datetime
+import os
+import random
+import time
+
+from CTFd.models import db, Users, Solves
+
+from ..models import Dojos
+from ..worker.handlers.scoreboard import calculate_scoreboard, calculate_scoreboards, COMMON_DURATIONS
+
+parser = argparse.ArgumentParser(description="Compare per-board and single-pass scoreboard computation on synthetic solves. All inserted rows are rolled back.")
+parser.add_argument("dojo", help="reference id of the dojo whose challenges the synthetic users solve")
+parser.add_argument("--users", type=int, default=2000, help="number of synthetic users (default: 2000)")
+parser.add_argument("--solve-rate", type=float, default=0.3, help="probability that a user solved each challenge (default: 0.3)")
+parser.add_argument("--days", type=int, default=60, help="spread solve dates over this many days (default: 60)")
+parser.add_argument("--repeat", type=int, default=3, help="timed runs per approach (default: 3)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+dojo = Dojos.from_id(args.dojo).first()
+if not dojo:
+    print(f"Dojo {args.dojo} not found")
+    os._exit(1)
+
+challenges = [challenge for challenge in dojo.challenges if challenge.required]
+now = datetime.datetime.utcnow()
+suffix = os.getpid()
+
+try:
+    print(f"Inserting {args.users} synthetic users over {len(challenges)} required challenges in {dojo.reference_id}...")
+    users = [Users(name=f"bench-{suffix}-{i}", email=f"bench-{suffix}-{i}@example.com", password="bench") for i in range(args.users)]
+    db.session.add_all(users)
+    db.session.flush()
+    solves = [
+        Solves(user_id=user.id, challenge_id=challenge.challenge_id, ip="127.0.0.1", provided="bench",
+               date=now - datetime.timedelta(seconds=random.uniform(0, args.days * 86400)))
+        for user in users
+        for challenge in challenges
+        if random.random() < args.solve_rate
+    ]
+    db.session.add_all(solves)
+    db.session.flush()
+    print(f"Inserted {len(solves)} synthetic solves")
+
+    def per_board():
+        boards = {}
+        for duration in COMMON_DURATIONS:
+            boards[(None, duration)] = calculate_scoreboard(dojo, duration)
+            for module in dojo.modules:
+                boards[(module.module_index, duration)] = calculate_scoreboard(module, duration)
+        return boards
+
+    def single_pass():
+        return calculate_scoreboards(dojo, COMMON_DURATIONS)
+
+    results = {}
+    for name, func in [("per-board", per_board), ("single-pass", single_pass)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.time()
+            results[name] = func()
+            timings.append(time.time() - start)
+        print(f"{name:>12}: best {min(timings):.3f}s, mean {sum(timings) / len(timings):.3f}s over {args.repeat} run(s)")
+
+    mismatched = [board for board, scoreboard in results["per-board"].items() if results["single-pass"].get(board) != scoreboard]
+    print(f"Boards compared: {len(results['per-board'])}, mismatched: {mismatched or 'none'}")
+finally:
+    db.session.rollback()
+    os._exit(0)
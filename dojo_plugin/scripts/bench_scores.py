@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import time
+
+from ..utils.background_stats import get_redis_client
+from ..utils.scores import write_rank_index, add_rank_index_solve, get_rank_and_solves, get_top_ranked, get_ranked_around
+from ..worker.handlers.scores import update_dojo_scores
+
+parser = argparse.ArgumentParser(description="Compare list-based and sorted-set dojo score rankings on synthetic users. The sorted set is written to a temporary key.")
+parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="ranking sizes to measure (default: 10000 100000 1000000)")
+parser.add_argument("--operations", type=int, default=200, help="timed operations per measurement (default: 200)")
+parser.add_argument("--max-solves", type=int, default=100, help="synthetic solve counts are drawn from 1..max-solves (default: 100)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+
+def list_update(scores, user_id):
+    # The list update as it was before the rank index, kept as the baseline.
+    ranks = list(scores.get("ranks", []))
+    solves = dict(scores.get("solves", {}))
+    new_solve_count = solves.get(user_id, 0) + 1
+    solves[user_id] = new_solve_count
+    if user_id in ranks:
+        ranks.remove(user_id)
+    insert_pos = 0
+    for i, other_user_id in enumerate(ranks):
+        if solves.get(other_user_id, 0) >= new_solve_count:
+            insert_pos = i + 1
+        else:
+            break
+    ranks.insert(insert_pos, user_id)
+    return {"ranks": ranks, "solves": solves}
+
+
+def timed(func, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        func(sample)
+    return (time.perf_counter() - start) / len(samples) * 1_000_000
+
+
+r = get_redis_client()
+key = f"stats:ranks:bench:{os.getpid()}"
+
+try:
+    for users in args.users:
+        solves = {user_id: random.randint(1, args.max_solves) for user_id in range(1, users + 1)}
+        ranks = sorted(solves, key=lambda user_id: -solves[user_id])
+        scores = {"ranks": ranks, "solves": solves}
+        last_solve_ids = {user_id: random.randrange(2 ** 31) for user_id in solves}
+        write_rank_index(key, [(user_id, solves[user_id], last_solve_ids[user_id]) for user_id in ranks])
+        samples = [random.randint(1, users) for _ in range(args.operations)]
+        # The list updates copy the whole ranking, so they are measured on fewer samples at the larger sizes.
+        update_samples = samples[:max(5, args.operations * 10_000 // users)]
+
+        results = {
+            "list rank": timed(lambda user_id: ranks.index(user_id) + 1, samples),
+            "list update": timed(lambda user_id: list_update(scores, user_id), update_samples),
+            "bisect update": timed(lambda user_id: update_dojo_scores(scores, user_id), update_samples),
+            "zset rank": timed(lambda user_id: get_rank_and_solves([key], user_id), samples),
+            "zset top 20": timed(lambda user_id: get_top_ranked(key, 20), samples),
+            "zset around": timed(lambda user_id: get_ranked_around(key, user_id, 10), samples),
+            "zset update": timed(lambda user_id: add_rank_index_solve(key, user_id, 2 ** 31), samples),
+        }
+        print(f"{users} users:")
+        for name, microseconds in results.items():
+            print(f"  {name:>14}: {microseconds:10.1f} us/op")
+finally:
+    r.delete(key)
+    os._exit(0)
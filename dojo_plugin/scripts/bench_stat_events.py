@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import redis
+from flask import current_app
+
+from ..utils.background_stats import CONSUMER_GROUP, process_stat_messages, process_stat_messages_batched
+
+parser = argparse.ArgumentParser(description="Compare per-message and batched stat event consumption against a Redis instance.")
+parser.add_argument("--redis-url", default=current_app.config.get("REDIS_URL", "redis://cache:6379"))
+parser.add_argument("--events", type=int, default=5000, help="number of synthetic events to publish (default: 5000)")
+parser.add_argument("--batch-size", type=int, default=100, help="events read per XREADGROUP (default: 100)")
+parser.add_argument("--dojos", type=int, default=5, help="number of distinct dojos the events target (default: 5)")
+parser.add_argument("--handler-ms", type=float, default=2.0, help="simulated handler cost per call in ms (default: 2)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+r = redis.from_url(args.redis_url, decode_responses=True)
+stream_name = f"bench:stat:events:{os.getpid()}"
+
+
+def synthetic_event():
+    dojo_id = random.randrange(args.dojos)
+    event_type, payload = random.choice([
+        ("challenge_solve", {"user_id": random.randrange(10000), "challenge_id": random.randrange(500)}),
+        ("scoreboard_update", {"model_type": "dojo", "model_id": dojo_id}),
+        ("dojo_stats_update", {"dojo_id": dojo_id}),
+        ("scores_update", {"dojo_id": dojo_id}),
+    ])
+    return {"data": json.dumps({"type": event_type, "payload": payload})}
+
+
+def handler(event_type, payload, event_timestamp):
+    time.sleep(args.handler_ms / 1000)
+
+
+def run(process_messages):
+    r.delete(stream_name)
+    pipeline = r.pipeline(transaction=False)
+    for _ in range(args.events):
+        pipeline.xadd(stream_name, synthetic_event())
+    pipeline.execute()
+    r.xgroup_create(stream_name, CONSUMER_GROUP, id="0")
+
+    events = handler_calls = 0
+    start = time.time()
+    while messages := r.xreadgroup(CONSUMER_GROUP, "bench", {stream_name: ">"}, count=args.batch_size):
+        for _, stream_messages in messages:
+            processed, calls = process_messages(r, stream_messages, handler, stream_name=stream_name)
+            events += processed
+            handler_calls += calls
+    elapsed = time.time() - start
+    remaining = r.xlen(stream_name)
+    r.delete(stream_name)
+    return events / elapsed, handler_calls, remaining
+
+
+for name, process_messages in [("per-message", process_stat_messages), ("batched", process_stat_messages_batched)]:
+    rate, handler_calls, remaining = run(process_messages)
+    print(f"{name:>12}: {rate:8.1f} events/s, {handler_calls} handler calls, {remaining} left in stream")
@@ -0,0 +1,78 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+import zlib
+
+import redis
+from flask import current_app
+
+from ..utils.background_stats import CONSUMER_GROUP, process_stat_messages
+
+parser = argparse.ArgumentParser(description="Measure stat event throughput as the number of partitioned workers grows.")
+parser.add_argument("--redis-url", default=current_app.config.get("REDIS_URL", "redis://cache:6379"))
+parser.add_argument("--events", type=int, default=4000, help="number of synthetic events per run (default: 4000)")
+parser.add_argument("--dojos", type=int, default=64, help="number of distinct dojos the events target (default: 64)")
+parser.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts to measure (default: 1,2,4,8)")
+parser.add_argument("--handler-ms", type=float, default=5.0, help="simulated handler cost per event in ms (default: 5)")
+try:
+    args = parser.parse_args()
+except SystemExit as e:
+    os._exit(e.args[0])
+
+stream_prefix = f"bench:stat:events:{os.getpid()}"
+
+
+def handler(event_type, payload, event_timestamp):
+    time.sleep(args.handler_ms / 1000)
+
+
+def consume(stream_name, ready, go):
+    r = redis.from_url(args.redis_url, decode_responses=True)
+    ready.release()
+    go.wait()
+    while messages := r.xreadgroup(CONSUMER_GROUP, f"bench-{os.getpid()}", {stream_name: ">"}, count=50):
+        for _, stream_messages in messages:
+            process_stat_messages(r, stream_messages, handler, stream_name=stream_name)
+
+
+def run(shard_count):
+    r = redis.from_url(args.redis_url, decode_responses=True)
+    stream_names = [f"{stream_prefix}:{shard}" for shard in range(shard_count)]
+    r.delete(*stream_names)
+
+    pipeline = r.pipeline(transaction=False)
+    for _ in range(args.events):
+        dojo_id = random.randrange(args.dojos)
+        event = {"type": "dojo_stats_update", "payload": {"dojo_id": dojo_id}}
+        pipeline.xadd(stream_names[zlib.crc32(str(dojo_id).encode()) % shard_count], {"data": json.dumps(event)})
+    pipeline.execute()
+    for stream_name in stream_names:
+        r.xgroup_create(stream_name, CONSUMER_GROUP, id="0", mkstream=True)
+
+    ready = multiprocessing.Semaphore(0)
+    go = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=consume, args=(stream_name, ready, go)) for stream_name in stream_names]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.acquire()
+
+    start = time.time()
+    go.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    remaining = sum(r.xlen(stream_name) for stream_name in stream_names)
+    r.delete(*stream_names)
+    return (args.events - remaining) / elapsed
+
+
+baseline = None
+for shard_count in [int(shards) for shards in args.shards.split(",")]:
+    rate = run(shard_count)
+    baseline = baseline or rate
+    print(f"{shard_count:>3} shard(s): {rate:8.1f} events/s ({rate / baseline:.2f}x)")
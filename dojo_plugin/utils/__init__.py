@@ -28,6 +28,8 @@ from bleach.css_sanitizer import CSSSanitizer
 from ..config import WORKSPACE_NODES, MAC_HOSTNAME, MAC_USERNAME
 from ..models import Dojos, DojoMembers, DojoAdmins, DojoChallenges, WorkspaceTokens
 from . import mac_docker
+from .docker_clients import node_docker_client, reset_node_docker_client
+from .workspace_pool import WORKSPACE_POOL_SIZE, POOL_LABEL, with_claimed_labels
 
 ID_REGEX = "^[A-Za-z0-9_.-]+$"
 def id_regex(s):
@@ -52,7 +54,7 @@ def get_current_container(user=None):
     docker_client = user_docker_client(user)
 
     try:
-        return docker_client.containers.get(container_name(user))
+        return with_claimed_labels(docker_client.containers.get(container_name(user)))
     except docker.errors.NotFound:
         return None
 
@@ -62,11 +64,20 @@ def get_all_containers(dojo=None):
     if dojo:
         filters["label"] = f"dojo.dojo_id={dojo.reference_id}"
 
-    return [
+    containers = [
         container
         for docker_client in all_docker_clients()
         for container in docker_client.containers.list(filters=filters, ignore_removed=True)
     ]
+    if WORKSPACE_POOL_SIZE:
+        # Workspaces claimed from the pool only have their dojo labels in Redis, so they are filtered here.
+        containers.extend(
+            container
+            for docker_client in all_docker_clients()
+            for container in map(with_claimed_labels, docker_client.containers.list(filters=dict(status="running", label=POOL_LABEL), ignore_removed=True))
+            if container.labels.get("dojo.dojo_id") and (not dojo or container.labels["dojo.dojo_id"] == dojo.reference_id)
+        )
+    return containers
 
 
 def serialize_user_flag(account_id, challenge_id, *, secret=None):
@@ -88,13 +99,10 @@ def user_docker_client(user, image_name=None):
                                           username=MAC_USERNAME,
                                           key_path="/var/mac/key")
 
-    node_id = user_node(user)
-    return (docker.DockerClient(base_url=f"tcp://192.168.42.{node_id + 1}:2375", tls=False)
-            if node_id is not None else docker.from_env())
+    return node_docker_client(user_node(user))
 
 def all_docker_clients():
-    return [docker.DockerClient(base_url=f"tcp://192.168.42.{node_id + 1}:2375", tls=False)
-            for node_id in WORKSPACE_NODES] if WORKSPACE_NODES else [docker.from_env()]
+    return [node_docker_client(node_id) for node_id in WORKSPACE_NODES] if WORKSPACE_NODES else [node_docker_client(None)]
 
 
 def user_ipv4(user):
@@ -181,7 +189,7 @@ def unserialize_user_flag(user_flag, *, secret=None):
     return account_id, challenge_id
 
 
-def resolved_tar(dir, *, root_dir, filter=None):
+def resolved_tar(dir, *, root_dir, filter=None, tarinfo_filter=None):
     tar_buffer = io.BytesIO()
     tar = tarfile.open(fileobj=tar_buffer, mode='w')
     resolved_root_dir = root_dir.resolve()
@@ -192,9 +200,9 @@ def resolved_tar(dir, *, root_dir, filter=None):
         if path.is_symlink():
             resolved_path = path.resolve()
             assert resolved_path.is_relative_to(resolved_root_dir), f"The symlink {path} points outside of the root directory"
-            tar.add(resolved_path, arcname=relative_path)
+            tar.add(resolved_path, arcname=relative_path, filter=tarinfo_filter)
         else:
-            tar.add(path, arcname=relative_path, recursive=False)
+            tar.add(path, arcname=relative_path, recursive=False, filter=tarinfo_filter)
     tar_buffer.seek(0)
     return tar_buffer
 
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import time
+
+import redis
+
+from . import get_current_container, user_node
+from .background_stats import get_redis_client
+from .workspace_pool import POOL_LABEL, read_pool_claim
+
+logger = logging.getLogger(__name__)
+
+# Each user's running challenge container, so that rendering a page or authenticating the dojo cli does not ask a
+# workspace node. Starts and stops keep it current; the workspace pool worker reconciles it with the nodes every
+# ACTIVE_CONTAINERS_RECONCILE_SECONDS, for containers that exit on their own or were started before the index existed.
+ACTIVE_CONTAINER_PREFIX = "workspace:active:"
+ACTIVE_CONTAINERS_RECONCILE_SECONDS = int(os.environ.get("ACTIVE_CONTAINERS_RECONCILE_SECONDS", "30"))
+# Workspaces run for at most 6 hours.
+ACTIVE_CONTAINER_SECONDS = 7 * 60 * 60
+MAC_NODE = "mac"
+
+
+def active_container_key(user_id):
+    return f"{ACTIVE_CONTAINER_PREFIX}{user_id}"
+
+
+def active_container_entry(container_id, node, labels, started_at=None):
+    return {
+        "container_id": container_id,
+        "node": node,
+        "dojo": labels.get("dojo.dojo_id"),
+        "module": labels.get("dojo.module_id"),
+        "challenge": labels.get("dojo.challenge_id"),
+        "mode": labels.get("dojo.mode"),
+        "started_at": started_at or time.time(),
+    }
+
+
+def set_active_container(user_id, container, node, r=None):
+    r = r or get_redis_client()
+    entry = active_container_entry(container.id, node, container.labels)
+    try:
+        r.set(active_container_key(user_id), json.dumps(entry), ex=ACTIVE_CONTAINER_SECONDS)
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.error(f"Failed to index active container for user {user_id}: {e}")
+
+
+def clear_active_container(user_id, r=None):
+    r = r or get_redis_client()
+    try:
+        r.delete(active_container_key(user_id))
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.error(f"Failed to clear active container for user {user_id}: {e}")
+
+
+def get_active_container(user, r=None):
+    """The index entry of the user's running container, or None; asks the user's node only if Redis is unavailable."""
+    r = r or get_redis_client()
+    try:
+        raw = r.get(active_container_key(user.id))
+        return json.loads(raw) if raw else None
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.warning(f"Failed to read active container for user {user.id}, asking docker: {e}")
+
+    container = get_current_container(user)
+    return active_container_entry(container.id, user_node(user), container.labels) if container else None
+
+
+def running_containers(docker_client, r):
+    """Yields (user_id, container_id, labels, created) for the running dojo containers on a node."""
+    # Sparse listing avoids inspecting every container; labels are then at the top level of attrs.
+    for container in docker_client.containers.list(filters={"status": "running", "label": "dojo.user_id"}, sparse=True, ignore_removed=True):
+        labels = container.attrs.get("Labels") or {}
+        yield labels["dojo.user_id"], container.id, labels, container.attrs.get("Created")
+    for container in docker_client.containers.list(filters={"status": "running", "label": POOL_LABEL}, sparse=True, ignore_removed=True):
+        claim = read_pool_claim(container.id, r)
+        if claim and "dojo.user_id" in claim["labels"]:
+            yield claim["labels"]["dojo.user_id"], container.id, claim["labels"], claim["claimed_at"]
+
+
+def reconcile_active_containers(node_clients, r=None):
+    """Makes the index match the containers running on the given {node: docker client}; returns (added, removed)."""
+    r = r or get_redis_client()
+    listed_at = time.time()
+    running = {}
+    for node, docker_client in node_clients.items():
+        for user_id, container_id, labels, created in running_containers(docker_client, r):
+            running[str(user_id)] = active_container_entry(container_id, node, labels, created)
+
+    removed = 0
+    indexed = set()
+    for key in r.scan_iter(match=f"{ACTIVE_CONTAINER_PREFIX}*", count=1000):
+        user_id = key[len(ACTIVE_CONTAINER_PREFIX):]
+        raw = r.get(key)
+        if not raw:
+            continue
+        entry = json.loads(raw)
+        indexed.add(user_id)
+        # Mac containers are not on the nodes, and entries written after the listing may be for containers it missed.
+        if entry.get("node") == MAC_NODE or entry.get("started_at", 0) >= listed_at:
+            continue
+        if running.get(user_id, {}).get("container_id") != entry.get("container_id"):
+            r.delete(key)
+            indexed.discard(user_id)
+            removed += 1
+
+    added = 0
+    for user_id, entry in running.items():
+        if user_id not in indexed and r.set(active_container_key(user_id), json.dumps(entry), nx=True, ex=ACTIVE_CONTAINER_SECONDS):
+            added += 1
+    return added, removed
@@ -8,7 +8,8 @@ from flask import url_for, abort
 
 from .discord import get_discord_roles, get_discord_member, add_role, send_message
 from .background_stats import get_cached_stat
-from ..models import Dojos, Belts, Emojis, DiscordUsers
+from ..models import Dojos, DojoChallenges, Belts, Emojis, DiscordUsers
+from .completions import completed_dojos
 from .feed import publish_belt_earned, publish_emoji_earned
 
 
@@ -22,15 +23,22 @@ BELT_REQUIREMENTS = {
     "blue": "software-exploitation",
 }
 
-def get_user_emojis(user):
-    emojis = [ ]
-    for dojo in Dojos.query.all():
-        emoji = dojo.award and dojo.award.get('emoji', None)
-        if not emoji:
-            continue
-        if dojo.challenges and dojo.completed(user):
-            emojis.append((emoji, dojo.name or dojo.reference_id, dojo.hex_dojo_id))
-    return emojis
+def award_candidate_dojos(challenge_id=None):
+    # A solve can only complete the dojos that contain the solved challenge.
+    query = Dojos.query.options(db.undefer(Dojos.challenges_count), db.undefer(Dojos.required_challenges_count))
+    if challenge_id is not None:
+        query = query.filter(Dojos.dojo_id.in_(
+            DojoChallenges.query.filter_by(challenge_id=challenge_id).with_entities(DojoChallenges.dojo_id)
+        ))
+    return query.all()
+
+def get_user_emojis(user, dojos=None):
+    dojos = dojos if dojos is not None else award_candidate_dojos()
+    award_dojos = [dojo for dojo in dojos if dojo.award and dojo.award.get('emoji', None)]
+    return [
+        (dojo.award['emoji'], dojo.name or dojo.reference_id, dojo.hex_dojo_id)
+        for dojo in completed_dojos(user, award_dojos)
+    ]
 
 def get_belts():
     cached = get_cached_stat(CACHE_KEY_BELTS)
@@ -84,13 +92,22 @@ def get_viewable_emojis(user, emoji_data=None):
 
     return {}
 
-def update_awards(user):
+def update_awards(user, challenge_id=None):
+    """Grants the belts and emojis `user` has earned; after a solve, pass its `challenge_id` to only check its dojos."""
     current_belts = [belt.name for belt in Belts.query.filter_by(user=user)]
+    missing_belts = [belt for belt in BELT_REQUIREMENTS if belt not in current_belts]
+    belt_dojos = {
+        dojo.id: dojo for dojo in
+        Dojos.query
+        .options(db.undefer(Dojos.challenges_count), db.undefer(Dojos.required_challenges_count))
+        .filter(Dojos.official, Dojos.id.in_([BELT_REQUIREMENTS[belt] for belt in missing_belts]))
+    } if missing_belts else {}
+    completed_belt_dojos = set(completed_dojos(user, belt_dojos.values()))
     for belt, dojo_id in BELT_REQUIREMENTS.items():
         if belt in current_belts:
             continue
-        dojo = Dojos.query.filter(Dojos.official, Dojos.id == dojo_id).first()
-        if not (dojo and dojo.completed(user)):
+        dojo = belt_dojos.get(dojo_id)
+        if not (dojo and dojo in completed_belt_dojos):
             break
         db.session.add(Belts(user=user, name=belt))
         db.session.commit()
@@ -113,7 +130,7 @@ def update_awards(user):
         send_message(f"<@{discord_user.discord_id}> earned their {belt_role}! :tada:", "belting-ceremony")
         cache.delete_memoized(get_discord_member, discord_user.discord_id)
 
-    current_emojis = get_user_emojis(user)
+    current_emojis = get_user_emojis(user, award_candidate_dojos(challenge_id))
     for emoji,dojo_display_name,hex_dojo_id in current_emojis:
         emoji_award = Emojis.query.filter(Emojis.user==user, Emojis.category==hex_dojo_id, Emojis.name=="CURRENT").first()
         if emoji_award:
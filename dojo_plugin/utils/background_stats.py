@@ -2,21 +2,62 @@ import json
 import time
 import os
 import logging
-from typing import Optional, Dict, Any, Callable
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Iterable, List, Set, Tuple
 from datetime import datetime, timezone
 
 import redis
 from flask import current_app
 
+from .cache_codec import encode_stat, decode_stat
+from .metrics import (
+    STAT_DEAD_LETTERS,
+    STAT_EVENT_QUEUE_SECONDS,
+    STAT_EVENT_SECONDS,
+    STAT_EVENTS,
+    record_cache_update,
+    record_stale_skip,
+)
+
 logger = logging.getLogger(__name__)
 
 REDIS_STREAM_NAME = "stat:events"
+DEAD_LETTER_STREAM_NAME = "stat:events:dead"
 CONSUMER_GROUP = "stats-workers"
 CONSUMER_NAME = f"worker-{os.getpid()}"
 
+MAX_EVENT_ATTEMPTS = 5
+PENDING_IDLE_MS = 30_000
+PENDING_MAX_BACKOFF_MS = 600_000
+PENDING_CHECK_INTERVAL = 10
+DEAD_LETTER_MAXLEN = 10_000
+EVENT_COUNTERS_KEY = "stat:events:counters"
+
+# With STATS_SHARDS > 1, events are routed to stat:events:{shard} by their partition key (the dojo id for per-dojo
+# caches), so every dojo's events are consumed in order by the single worker that owns its shard.
+STATS_SHARDS = max(1, int(os.environ.get("STATS_SHARDS", "1")))
+
 DAILY_RESTART_HOUR_UTC = 12
 
+# Events that carry a delta rather than triggering a recompute; these are never coalesced in batch mode.
+INCREMENTAL_EVENT_TYPES = {"challenge_solve"}
+
+# Web processes keep the most recently read stats decoded in memory, and only download a stat again once its
+# {key}:updated time has moved. Objects returned from the L1 cache are shared between requests and must not be
+# modified. The stats worker modifies the stats it reads, so it disables the L1 cache.
+STATS_L1_ENTRIES = int(os.environ.get("STATS_L1_ENTRIES", "256"))
+STATS_L1_FLUSH_SECONDS = 10
+L1_COUNTERS_KEY = "stat:l1:counters"
+
 _redis_client: Optional[redis.Redis] = None
+_redis_binary_client: Optional[redis.Redis] = None
+_last_errors: Dict[str, str] = {}
+_l1_cache: "OrderedDict[str, Tuple[str, Any, int]]" = OrderedDict()
+_l1_counts: Dict[str, int] = {"hits": 0, "misses": 0, "bytes_saved": 0}
+_l1_flushed_at = time.monotonic()
+_l1_lock = threading.Lock()
 
 
 class DailyRestartException(Exception):
@@ -36,14 +77,28 @@ def get_message_timestamp(message_id: str) -> float:
     return timestamp_ms / 1000.0
 
 
-def is_event_stale(cache_key: str, event_timestamp: float) -> bool:
-    cache_updated = get_cache_updated_at(cache_key)
+def cache_updated_after(cache_key: str, cache_updated: Optional[float], event_timestamp: float) -> bool:
     if cache_updated and event_timestamp < cache_updated:
         logger.info(f"Skipping stale event for {cache_key} (event: {event_timestamp}, cache: {cache_updated})")
+        record_stale_skip(cache_key)
         return True
     return False
 
 
+def is_event_stale(cache_key: str, event_timestamp: float) -> bool:
+    return cache_updated_after(cache_key, get_cache_updated_at(cache_key), event_timestamp)
+
+
+def stale_cache_keys(cache_keys: Iterable[str], event_timestamp: float) -> Set[str]:
+    """Returns the cache keys that were updated after the event, checking all of them with one MGET."""
+    cache_keys = list(cache_keys)
+    return {
+        cache_key
+        for cache_key, cache_updated in zip(cache_keys, get_caches_updated_at(cache_keys))
+        if cache_updated_after(cache_key, cache_updated, event_timestamp)
+    }
+
+
 def get_redis_client() -> redis.Redis:
     global _redis_client
     if _redis_client is None:
@@ -51,7 +106,57 @@ def get_redis_client() -> redis.Redis:
         _redis_client = redis.from_url(redis_url, decode_responses=True)
     return _redis_client
 
-def publish_stat_event(event_type: str, payload: Dict[str, Any]) -> Optional[str]:
+
+def get_redis_binary_client() -> redis.Redis:
+    # Cached stats may be stored with a binary codec, so they are read without decoding responses.
+    global _redis_binary_client
+    if _redis_binary_client is None:
+        redis_url = current_app.config.get("REDIS_URL", "redis://cache:6379")
+        _redis_binary_client = redis.from_url(redis_url, decode_responses=False)
+    return _redis_binary_client
+
+def shard_stream_name(shard: int) -> str:
+    if STATS_SHARDS <= 1:
+        return REDIS_STREAM_NAME
+    return f"{REDIS_STREAM_NAME}:{shard}"
+
+
+def event_shard(partition_key: Any) -> int:
+    if partition_key is None or STATS_SHARDS <= 1:
+        return 0
+    return zlib.crc32(str(partition_key).encode()) % STATS_SHARDS
+
+
+def stat_stream_names(shards: Optional[List[int]] = None) -> List[str]:
+    if STATS_SHARDS <= 1:
+        return [REDIS_STREAM_NAME]
+    return [shard_stream_name(shard) for shard in (shards if shards is not None else range(STATS_SHARDS))]
+
+
+def parse_shard_list(spec: Optional[str]) -> Optional[List[int]]:
+    if not spec:
+        return None
+    shards = set()
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        shards.update(range(int(start), int(end or start) + 1))
+    invalid = [shard for shard in shards if not 0 <= shard < STATS_SHARDS]
+    if invalid:
+        raise ValueError(f"Shards {sorted(invalid)} out of range for STATS_SHARDS={STATS_SHARDS}")
+    return sorted(shards)
+
+
+def stat_event_partition_key(event_type: str, payload: Dict[str, Any]) -> Any:
+    """The partition key that the publish helpers in utils/events.py give an event with this payload."""
+    if event_type == "activity_update":
+        return f"user:{payload.get('user_id')}"
+    if event_type == "scoreboard_update":
+        model_id = payload.get("model_id")
+        return model_id.get("dojo_id") if isinstance(model_id, dict) else model_id
+    return payload.get("dojo_id")
+
+
+def publish_stat_event(event_type: str, payload: Dict[str, Any], partition_key: Any = None) -> Optional[str]:
     try:
         r = get_redis_client()
         event = {
@@ -59,65 +164,407 @@ def publish_stat_event(event_type: str, payload: Dict[str, Any]) -> Optional[str
             "payload": payload,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
-        message_id = r.xadd(REDIS_STREAM_NAME, {"data": json.dumps(event)})
-        logger.info(f"Published event {event_type} to stream: {message_id}")
+        stream_name = shard_stream_name(event_shard(partition_key))
+        message_id = r.xadd(stream_name, {"data": json.dumps(event)})
+        logger.info(f"Published event {event_type} to stream {stream_name}: {message_id}")
         return message_id
     except (redis.RedisError, redis.ConnectionError) as e:
         logger.error(f"Failed to publish event {event_type}: {e}")
         return None
 
-def consume_stat_events(handler: Callable[[str, Dict[str, Any], float], None], batch_size: int = 10, block_ms: int = 5000, start_time: Optional[float] = None):
+def decode_stat_message(message_id: str, message_data: Dict[str, str]) -> Tuple[str, Dict[str, Any], float]:
+    event_data = json.loads(message_data["data"])
+    # Replayed dead letters keep the timestamp of the original event so that stale checks still apply to them.
+    original_id = message_data.get("original_id", message_id)
+    return event_data["type"], event_data["payload"], get_message_timestamp(original_id)
+
+
+def count_collapsed_events(source: str, collapsed: int):
+    if collapsed <= 0:
+        return
+    try:
+        get_redis_client().hincrby(EVENT_COUNTERS_KEY, f"collapsed:{source}", collapsed)
+    except (redis.RedisError, redis.ConnectionError):
+        pass
+
+
+def get_event_counters() -> Dict[str, int]:
+    return {field: int(value) for field, value in get_redis_client().hgetall(EVENT_COUNTERS_KEY).items()}
+
+
+def record_event_failure(message_id: str, error: Exception):
+    _last_errors[message_id] = f"{type(error).__name__}: {error}"
+
+
+def retry_backoff_ms(times_delivered: int) -> int:
+    return min(PENDING_MAX_BACKOFF_MS, PENDING_IDLE_MS * 2 ** max(0, times_delivered - 1))
+
+
+def dead_letter_stat_event(r: redis.Redis, message_id: str, message_data: Dict[str, str], attempts: int, stream_name: str = REDIS_STREAM_NAME):
+    error = _last_errors.pop(message_id, "unknown (failed in an earlier worker process)")
+    entry = {
+        "data": message_data.get("data", ""),
+        "original_id": message_data.get("original_id", message_id),
+        "stream": stream_name,
+        "attempts": str(attempts),
+        "error": error[:4096],
+        "failed_at": str(get_redis_time(r)),
+    }
+    pipeline = r.pipeline(transaction=False)
+    pipeline.xadd(DEAD_LETTER_STREAM_NAME, entry, maxlen=DEAD_LETTER_MAXLEN, approximate=True)
+    pipeline.xackdel(stream_name, CONSUMER_GROUP, message_id)
+    pipeline.execute()
+    STAT_DEAD_LETTERS.labels(stream_name).inc()
+    logger.error(f"Moved stat event {message_id} to {DEAD_LETTER_STREAM_NAME} after {attempts} attempt(s): {error}")
+
+
+def group_stat_messages(stream_messages: List[Tuple[str, Dict[str, str]]]) -> List[Dict[str, Any]]:
+    groups = {}
+    for position, (message_id, message_data) in enumerate(stream_messages):
+        try:
+            event_type, payload, event_timestamp = decode_stat_message(message_id, message_data)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Invalid stat event {message_id}: {e}")
+            record_event_failure(message_id, e)
+            STAT_EVENTS.labels("invalid", "failure").inc()
+            continue
+
+        if event_type in INCREMENTAL_EVENT_TYPES:
+            key = (event_type, message_id)
+        else:
+            key = (event_type, json.dumps(payload, sort_keys=True))
+
+        group = groups.setdefault(key, {
+            "type": event_type,
+            "payload": payload,
+            "timestamp": event_timestamp,
+            "message_ids": [],
+        })
+        group["timestamp"] = max(group["timestamp"], event_timestamp)
+        group["message_ids"].append(message_id)
+        group["position"] = position
+
+    # A coalesced recompute runs at the position of its latest event, so that it lands after any incremental
+    # events that were interleaved with it and its stale check covers them.
+    ordered = sorted(groups.values(), key=lambda group: group["position"])
+    for group in ordered:
+        del group["position"]
+    return ordered
+
+
+class ThroughputCounter:
+    def __init__(self, name: str, interval: float = 60.0):
+        self.name = name
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.window_start = time.time()
+        self.events = 0
+        self.handler_calls = 0
+
+    def record(self, events: int, handler_calls: int):
+        self.events += events
+        self.handler_calls += handler_calls
+        elapsed = time.time() - self.window_start
+        if elapsed >= self.interval:
+            logger.info(f"{self.name} throughput: {self.events / elapsed:.1f} events/s, "
+                        f"{self.handler_calls / elapsed:.1f} handler calls/s ({self.events} events in {elapsed:.0f}s)")
+            self.reset()
+
+
+class EventDebouncer:
+    """
+    Holds recompute events until `window_ms` has passed without another event for the same (type, payload) key,
+    i.e. the same dojo or module, then handles them once. Held messages stay pending in the stream until handled.
+    """
+
+    def __init__(self, window_ms: int, max_wait_ms: Optional[int] = None):
+        self.window = window_ms / 1000
+        # A key that keeps receiving events is still flushed, well before the pending reclaimer would claim its messages.
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else min(window_ms * 5, PENDING_IDLE_MS // 2)) / 1000
+        self.held: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def hold(self, stream_name: str, stream_messages) -> List[Tuple[str, Dict[str, str]]]:
+        immediate = []
+        now = time.monotonic()
+        for message_id, message_data in stream_messages:
+            try:
+                event_type, payload, _ = decode_stat_message(message_id, message_data)
+            except (KeyError, TypeError, ValueError):
+                immediate.append((message_id, message_data))
+                continue
+            if event_type in INCREMENTAL_EVENT_TYPES:
+                immediate.append((message_id, message_data))
+                continue
+
+            key = (stream_name, event_type, json.dumps(payload, sort_keys=True))
+            entry = self.held.get(key)
+            if entry is None:
+                self.held[key] = {
+                    "type": event_type,
+                    "payload": payload,
+                    "message_ids": [message_id],
+                    "first_seen": now,
+                    "deadline": now + self.window,
+                }
+            else:
+                entry["message_ids"].append(message_id)
+                entry["deadline"] = min(now + self.window, entry["first_seen"] + self.max_wait)
+        return immediate
+
+    def next_deadline_ms(self) -> Optional[int]:
+        if not self.held:
+            return None
+        return max(0, int((min(entry["deadline"] for entry in self.held.values()) - time.monotonic()) * 1000))
+
+    def flush(self, r: redis.Redis, handler: Callable[[str, Dict[str, Any], float], None], force: bool = False) -> Tuple[int, int]:
+        now = time.monotonic()
+        events = handler_calls = collapsed = 0
+        flush_time = None
+        for key, entry in list(self.held.items()):
+            if not force and entry["deadline"] > now:
+                continue
+            del self.held[key]
+            stream_name = key[0]
+            message_ids = entry["message_ids"]
+            events += len(message_ids)
+            try:
+                if flush_time is None:
+                    flush_time = get_redis_time(r)
+                for message_id in message_ids:
+                    STAT_EVENT_QUEUE_SECONDS.labels(entry["type"]).observe(flush_time - get_message_timestamp(message_id))
+                # Handled without a timestamp: incremental events processed while this was held have moved the cache's
+                # updated time past it, which must not make the recompute look stale.
+                with STAT_EVENT_SECONDS.labels(entry["type"]).time():
+                    handler(entry["type"], entry["payload"], None)
+                handler_calls += 1
+                STAT_EVENTS.labels(entry["type"], "success").inc(len(message_ids))
+                collapsed += len(message_ids) - 1
+                r.xackdel(stream_name, CONSUMER_GROUP, *message_ids)
+                for message_id in message_ids:
+                    _last_errors.pop(message_id, None)
+                logger.info(f"Processed {len(message_ids)} debounced event(s): {entry['type']} payload={entry['payload']}")
+            except Exception as e:
+                for message_id in message_ids:
+                    record_event_failure(message_id, e)
+                STAT_EVENTS.labels(entry["type"], "failure").inc(len(message_ids))
+                logger.error(f"Error processing debounced events {message_ids}: {e}", exc_info=True)
+        count_collapsed_events("debounce", collapsed)
+        return events, handler_calls
+
+
+def process_stat_messages(r: redis.Redis, stream_messages, handler: Callable[[str, Dict[str, Any], float], None], stream_name: str = REDIS_STREAM_NAME) -> Tuple[int, int]:
+    handler_calls = 0
+    for message_id, message_data in stream_messages:
+        event_type = "invalid"
+        try:
+            event_type, payload, event_timestamp = decode_stat_message(message_id, message_data)
+            queue_time_ms = (get_redis_time(r) - event_timestamp) * 1000
+            STAT_EVENT_QUEUE_SECONDS.labels(event_type).observe(queue_time_ms / 1000)
+
+            logger.info(f"Processing event: {event_type} {queue_time_ms=:.0f} payload={payload}")
+            start = time.time()
+            handler(event_type, payload, event_timestamp)
+            handler_calls += 1
+            processing_time_ms = (time.time() - start) * 1000
+            STAT_EVENT_SECONDS.labels(event_type).observe(processing_time_ms / 1000)
+
+            r.xackdel(stream_name, CONSUMER_GROUP, message_id)
+            _last_errors.pop(message_id, None)
+            STAT_EVENTS.labels(event_type, "success").inc()
+            logger.info(f"Processed event {message_id}: {event_type} {queue_time_ms=:.0f} {processing_time_ms=:.0f}")
+        except Exception as e:
+            record_event_failure(message_id, e)
+            STAT_EVENTS.labels(event_type, "failure").inc()
+            logger.error(f"Error processing event {message_id}: {e}", exc_info=True)
+    return len(stream_messages), handler_calls
+
+
+def process_stat_messages_batched(r: redis.Redis, stream_messages, handler: Callable[[str, Dict[str, Any], float], None], stream_name: str = REDIS_STREAM_NAME) -> Tuple[int, int]:
+    groups = group_stat_messages(stream_messages)
+    ack_ids = []
+    batch_time = get_redis_time(r)
+    oldest_ms = (batch_time - min(group["timestamp"] for group in groups)) * 1000 if groups else 0
+    logger.info(f"Processing batch of {len(stream_messages)} event(s) as {len(groups)} handler call(s) oldest_queue_time_ms={oldest_ms:.0f}")
+
+    for group in groups:
+        for message_id in group["message_ids"]:
+            STAT_EVENT_QUEUE_SECONDS.labels(group["type"]).observe(batch_time - get_message_timestamp(message_id))
+        try:
+            start = time.time()
+            handler(group["type"], group["payload"], group["timestamp"])
+            processing_time_ms = (time.time() - start) * 1000
+            STAT_EVENT_SECONDS.labels(group["type"]).observe(processing_time_ms / 1000)
+            STAT_EVENTS.labels(group["type"], "success").inc(len(group["message_ids"]))
+            ack_ids.extend(group["message_ids"])
+            logger.info(f"Processed {len(group['message_ids'])} event(s): {group['type']} {processing_time_ms=:.0f} payload={group['payload']}")
+        except Exception as e:
+            for message_id in group["message_ids"]:
+                record_event_failure(message_id, e)
+            STAT_EVENTS.labels(group["type"], "failure").inc(len(group["message_ids"]))
+            logger.error(f"Error processing events {group['message_ids']}: {e}", exc_info=True)
+
+    if ack_ids:
+        pipeline = r.pipeline(transaction=False)
+        pipeline.xackdel(stream_name, CONSUMER_GROUP, *ack_ids)
+        pipeline.execute()
+        for message_id in ack_ids:
+            _last_errors.pop(message_id, None)
+    count_collapsed_events("batch", sum(len(group["message_ids"]) for group in groups) - len(groups))
+    return len(stream_messages), len(groups)
+
+
+def reclaim_pending_stat_events(r: redis.Redis, process_messages, handler: Callable[[str, Dict[str, Any], float], None], count: int = 10, stream_name: str = REDIS_STREAM_NAME) -> Tuple[int, int]:
+    # XAUTOCLAIM applies a single idle threshold to every entry, so eligibility is decided from XPENDING instead:
+    # an entry is retried once it has been idle for its exponential backoff, and dead-lettered after too many deliveries.
+    pending = r.xpending_range(stream_name, CONSUMER_GROUP, min="-", max="+", count=max(count, 100), idle=PENDING_IDLE_MS)
+    retry_ids = []
+    dead_ids = {}
+    for entry in pending:
+        message_id = entry["message_id"]
+        times_delivered = entry["times_delivered"]
+        if times_delivered >= MAX_EVENT_ATTEMPTS:
+            dead_ids[message_id] = times_delivered
+        elif entry["time_since_delivered"] >= retry_backoff_ms(times_delivered) and len(retry_ids) < count:
+            retry_ids.append(message_id)
+
+    claim_ids = retry_ids + list(dead_ids)
+    if not claim_ids:
+        return 0, 0
+
+    claimed = {
+        message_id: message_data
+        for message_id, message_data in r.xclaim(stream_name, CONSUMER_GROUP, CONSUMER_NAME, PENDING_IDLE_MS, claim_ids)
+        if message_data
+    }
+    vanished_ids = [message_id for message_id in claim_ids if message_id not in claimed]
+    if vanished_ids:
+        r.xack(stream_name, CONSUMER_GROUP, *vanished_ids)
+
+    for message_id, attempts in dead_ids.items():
+        if message_id in claimed:
+            dead_letter_stat_event(r, message_id, claimed[message_id], attempts, stream_name=stream_name)
+
+    messages = [(message_id, claimed[message_id]) for message_id in retry_ids if message_id in claimed]
+    if not messages:
+        return 0, 0
+    logger.info(f"Retrying {len(messages)} pending event(s): {[message_id for message_id, _ in messages]}")
+    return process_messages(r, messages, handler, stream_name=stream_name)
+
+
+def get_dead_letter_events(count: int = 100) -> List[Dict[str, Any]]:
+    r = get_redis_client()
+    result = []
+    for dead_id, entry in r.xrevrange(DEAD_LETTER_STREAM_NAME, count=count):
+        try:
+            event_data = json.loads(entry.get("data") or "{}")
+        except ValueError:
+            event_data = {}
+        result.append({
+            "id": dead_id,
+            "original_id": entry.get("original_id"),
+            "type": event_data.get("type"),
+            "payload": event_data.get("payload"),
+            "attempts": int(entry.get("attempts", 0)),
+            "error": entry.get("error"),
+            "failed_at": datetime.fromtimestamp(float(entry.get("failed_at", 0)), timezone.utc),
+        })
+    return result
+
+
+def replay_dead_letter_events(dead_ids: Optional[List[str]] = None) -> int:
+    r = get_redis_client()
+    if dead_ids is None:
+        entries = r.xrange(DEAD_LETTER_STREAM_NAME)
+    else:
+        entries = [entry for dead_id in dead_ids for entry in r.xrange(DEAD_LETTER_STREAM_NAME, min=dead_id, max=dead_id)]
+    stream_names = stat_stream_names()
+    for dead_id, entry in entries:
+        stream_name = entry.get("stream") if entry.get("stream") in stream_names else stream_names[0]
+        pipeline = r.pipeline()
+        pipeline.xadd(stream_name, {"data": entry["data"], "original_id": entry["original_id"]})
+        pipeline.xdel(DEAD_LETTER_STREAM_NAME, dead_id)
+        pipeline.execute()
+        logger.info(f"Replayed dead-lettered stat event {dead_id} (original {entry['original_id']})")
+    return len(entries)
+
+
+def discard_dead_letter_events(dead_ids: List[str]) -> int:
+    r = get_redis_client()
+    return r.xdel(DEAD_LETTER_STREAM_NAME, *dead_ids) if dead_ids else 0
+
+
+def consume_stat_events(handler: Callable[[str, Dict[str, Any], float], None], batch_size: int = 10, block_ms: int = 5000, start_time: Optional[float] = None, batched: bool = False, shards: Optional[List[int]] = None, on_poll: Optional[Callable[[], None]] = None, debounce_ms: int = 0):
     r = get_redis_client()
     if start_time is None:
         start_time = time.time()
+    process_messages = process_stat_messages_batched if batched else process_stat_messages
+    throughput = ThroughputCounter(f"Worker {CONSUMER_NAME}")
+    stream_names = stat_stream_names(shards)
+    debouncer = EventDebouncer(debounce_ms) if debounce_ms else None
 
     def ensure_consumer_group():
-        try:
-            r.xgroup_create(REDIS_STREAM_NAME, CONSUMER_GROUP, id="0", mkstream=True)
-            logger.info(f"Created consumer group {CONSUMER_GROUP} for stream {REDIS_STREAM_NAME}")
-        except redis.ResponseError as e:
-            if "BUSYGROUP" not in str(e):
-                raise
-            logger.info(f"Consumer group {CONSUMER_GROUP} already exists")
+        for stream_name in stream_names:
+            try:
+                r.xgroup_create(stream_name, CONSUMER_GROUP, id="0", mkstream=True)
+                logger.info(f"Created consumer group {CONSUMER_GROUP} for stream {stream_name}")
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+                logger.info(f"Consumer group {CONSUMER_GROUP} already exists for stream {stream_name}")
 
     ensure_consumer_group()
-    logger.info(f"Worker {CONSUMER_NAME} waiting for events...")
+    logger.info(f"Worker {CONSUMER_NAME} waiting for events on {stream_names} ({batched=}, {batch_size=}, {debounce_ms=})...")
 
+    last_pending_check = 0.0
     while True:
         if should_daily_restart(start_time):
             logger.info(f"Daily restart triggered at UTC hour {DAILY_RESTART_HOUR_UTC}")
             raise DailyRestartException("Scheduled daily restart for cache refresh")
         try:
+            if on_poll:
+                on_poll()
+
+            if time.time() - last_pending_check >= PENDING_CHECK_INTERVAL:
+                last_pending_check = time.time()
+                try:
+                    for stream_name in stream_names:
+                        events, handler_calls = reclaim_pending_stat_events(r, process_messages, handler, count=batch_size, stream_name=stream_name)
+                        throughput.record(events, handler_calls)
+                except redis.ResponseError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error reclaiming pending stat events: {e}", exc_info=True)
+
+            block = min(block_ms, PENDING_CHECK_INTERVAL * 1000)
+            if debouncer:
+                events, handler_calls = debouncer.flush(r, handler)
+                throughput.record(events, handler_calls)
+                next_deadline_ms = debouncer.next_deadline_ms()
+                if next_deadline_ms is not None:
+                    # A block of 0 would wait forever.
+                    block = max(1, min(block, next_deadline_ms))
+
             messages = r.xreadgroup(
                 CONSUMER_GROUP,
                 CONSUMER_NAME,
-                {REDIS_STREAM_NAME: ">"},
+                {stream_name: ">" for stream_name in stream_names},
                 count=batch_size,
-                block=block_ms
+                block=block
             )
 
             if not messages:
                 continue
 
             for stream_name, stream_messages in messages:
-                logger.info(f"Received {len(stream_messages)} event(s) from stream")
-                for message_id, message_data in stream_messages:
-                    try:
-                        event_data = json.loads(message_data["data"])
-                        event_type = event_data["type"]
-                        payload = event_data["payload"]
-                        event_timestamp = get_message_timestamp(message_id)
-                        queue_time_ms = (get_redis_time(r) - event_timestamp) * 1000
-
-                        logger.info(f"Processing event: {event_type} {queue_time_ms=:.0f} payload={payload}")
-                        start = time.time()
-                        handler(event_type, payload, event_timestamp)
-                        processing_time_ms = (time.time() - start) * 1000
-
-                        r.xackdel(REDIS_STREAM_NAME, CONSUMER_GROUP, message_id)
-                        logger.info(f"Processed event {message_id}: {event_type} {queue_time_ms=:.0f} {processing_time_ms=:.0f}")
-                    except Exception as e:
-                        logger.error(f"Error processing event {message_id}: {e}", exc_info=True)
+                logger.info(f"Received {len(stream_messages)} event(s) from stream {stream_name}")
+                if debouncer:
+                    stream_messages = debouncer.hold(stream_name, stream_messages)
+                    if not stream_messages:
+                        continue
+                events, handler_calls = process_messages(r, stream_messages, handler, stream_name=stream_name)
+                throughput.record(events, handler_calls)
         except redis.ResponseError as e:
             if "NOGROUP" in str(e):
                 logger.warning(f"Consumer group was deleted, recreating...")
@@ -132,15 +579,95 @@ def consume_stat_events(handler: Callable[[str, Dict[str, Any], float], None], b
             logger.info("Received interrupt signal, shutting down...")
             break
 
-def get_cached_stat(key: str) -> Optional[Dict[str, Any]]:
+def disable_l1_cache():
+    global STATS_L1_ENTRIES
+    STATS_L1_ENTRIES = 0
+    with _l1_lock:
+        _l1_cache.clear()
+
+
+def count_l1(r: redis.Redis, hits: int = 0, misses: int = 0, bytes_saved: int = 0):
+    global _l1_flushed_at
+    with _l1_lock:
+        _l1_counts["hits"] += hits
+        _l1_counts["misses"] += misses
+        _l1_counts["bytes_saved"] += bytes_saved
+        if time.monotonic() - _l1_flushed_at < STATS_L1_FLUSH_SECONDS:
+            return
+        counts = dict(_l1_counts)
+        _l1_counts.update(hits=0, misses=0, bytes_saved=0)
+        _l1_flushed_at = time.monotonic()
+    try:
+        pipeline = r.pipeline(transaction=False)
+        for field, value in counts.items():
+            if value:
+                pipeline.hincrby(L1_COUNTERS_KEY, field, value)
+        pipeline.execute()
+    except (redis.RedisError, redis.ConnectionError):
+        pass
+
+
+def get_l1_counters() -> Dict[str, int]:
+    counters = {field: int(value) for field, value in get_redis_client().hgetall(L1_COUNTERS_KEY).items()}
+    lookups = counters.get("hits", 0) + counters.get("misses", 0)
+    counters["hit_rate"] = counters.get("hits", 0) / lookups if lookups else 0
+    return counters
+
+
+def get_cached_stats(keys: Iterable[str]) -> Dict[str, Optional[Any]]:
+    """
+    Returns {key: stat} for the given keys, None for those that are missing. The updated times of all keys are
+    checked with one MGET, and only the stats that changed since they were last read are downloaded, with another.
+    """
+    keys = list(keys)
+    results = {key: None for key in keys}
     try:
         r = get_redis_client()
-        data = r.get(key)
-        if data:
-            return json.loads(data)
-        return None
-    except (redis.RedisError, redis.ConnectionError, json.JSONDecodeError):
-        return None
+        missing = keys
+        if STATS_L1_ENTRIES:
+            missing, hits, bytes_saved = [], 0, 0
+            updated = r.mget([f"{key}:updated" for key in keys])
+            with _l1_lock:
+                for key, updated_at in zip(keys, updated):
+                    entry = _l1_cache.get(key)
+                    if entry and updated_at is not None and entry[0] == updated_at:
+                        _l1_cache.move_to_end(key)
+                        results[key] = entry[1]
+                        hits += 1
+                        bytes_saved += entry[2]
+                    else:
+                        missing.append(key)
+            count_l1(r, hits=hits, misses=len(missing), bytes_saved=bytes_saved)
+        if not missing:
+            return results
+
+        # The value and its updated time are read in one transaction, so that a cached entry is never newer than its time.
+        pipeline = get_redis_binary_client().pipeline()
+        pipeline.mget(missing)
+        pipeline.mget([f"{key}:updated" for key in missing])
+        values, updated = pipeline.execute()
+        for key, data, updated_at in zip(missing, values, updated):
+            if not data:
+                continue
+            try:
+                results[key] = decode_stat(data)
+            except ValueError as e:
+                logger.warning(f"Failed to decode cached stat {key}: {e}")
+                continue
+            updated_at = updated_at.decode() if updated_at is not None else None
+            if STATS_L1_ENTRIES and updated_at is not None:
+                with _l1_lock:
+                    _l1_cache[key] = (updated_at, results[key], len(data))
+                    _l1_cache.move_to_end(key)
+                    while len(_l1_cache) > STATS_L1_ENTRIES:
+                        _l1_cache.popitem(last=False)
+    except (redis.RedisError, redis.ConnectionError):
+        pass
+    return results
+
+
+def get_cached_stat(key: str) -> Optional[Dict[str, Any]]:
+    return get_cached_stats([key])[key]
 
 def get_redis_time(r: redis.Redis) -> float:
     redis_time = r.time()
@@ -148,26 +675,34 @@ def get_redis_time(r: redis.Redis) -> float:
 
 
 def set_cached_stat(key: str, data: Dict[str, Any], updated_at: Optional[float] = None):
-    try:
-        r = get_redis_client()
-        r.set(key, json.dumps(data))
+    # Redis errors propagate, so that the stat event being handled is retried rather than acknowledged.
+    r = get_redis_client()
+    r.set(key, encode_stat(data))
 
-        if updated_at:
-            r.set(f"{key}:updated", str(updated_at))
-        else:
-            r.set(f"{key}:updated", str(get_redis_time(r)))
-    except (redis.RedisError, redis.ConnectionError):
-        pass
+    if updated_at:
+        r.set(f"{key}:updated", str(updated_at))
+    else:
+        r.set(f"{key}:updated", str(get_redis_time(r)))
+    record_cache_update(key)
 
 def get_cache_updated_at(key: str) -> Optional[float]:
+    return get_caches_updated_at([key])[0]
+
+
+def get_caches_updated_at(keys: List[str]) -> List[Optional[float]]:
+    if not keys:
+        return []
     try:
-        r = get_redis_client()
-        updated = r.get(f"{key}:updated")
-        if updated:
-            return float(updated)
-        return None
-    except (redis.RedisError, redis.ConnectionError, ValueError):
-        return None
+        updated = get_redis_client().mget([f"{key}:updated" for key in keys])
+    except (redis.RedisError, redis.ConnectionError):
+        return [None] * len(keys)
+    results = []
+    for updated_at in updated:
+        try:
+            results.append(float(updated_at) if updated_at else None)
+        except ValueError:
+            results.append(None)
+    return results
 
 def invalidate_cached_stat(key: str):
     try:
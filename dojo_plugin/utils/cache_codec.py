@@ -0,0 +1,65 @@
+import json
+import os
+
+import msgpack
+import zstandard
+
+# Cached stats written with a binary codec start with a NUL byte, a codec tag and a format version, which no JSON
+# document starts with; anything else is read as JSON. Readers decode every codec regardless of STATS_CACHE_CODEC, so
+# during a rollout old and new values can be mixed: deploy first, then switch the codec the stats worker writes with.
+CODEC_MARKER = b"\x00"
+CACHE_CODECS = ("json", "msgpack", "msgpack+zstd")
+STATS_CACHE_CODEC = os.environ.get("STATS_CACHE_CODEC", "json")
+# Values smaller than this are not worth compressing, so msgpack+zstd stores them as plain msgpack.
+STATS_CACHE_COMPRESS_MIN_BYTES = int(os.environ.get("STATS_CACHE_COMPRESS_MIN_BYTES", "4096"))
+STATS_CACHE_ZSTD_LEVEL = int(os.environ.get("STATS_CACHE_ZSTD_LEVEL", "3"))
+
+MSGPACK_TAG = CODEC_MARKER + b"m1"
+ZSTD_MSGPACK_TAG = CODEC_MARKER + b"z1"
+
+if STATS_CACHE_CODEC not in CACHE_CODECS:
+    raise ValueError(f"STATS_CACHE_CODEC must be one of {', '.join(CACHE_CODECS)}, not {STATS_CACHE_CODEC!r}")
+
+
+def json_key(key):
+    if isinstance(key, str):
+        return key
+    if isinstance(key, bool) or key is None:
+        return json.dumps(key)
+    return str(key)
+
+
+def json_compatible(data):
+    # Readers expect what a JSON round trip gives them: string keys and lists, whatever the codec.
+    if isinstance(data, dict):
+        return {json_key(key): json_compatible(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [json_compatible(value) for value in data]
+    return data
+
+
+def encode_stat(data, codec=None):
+    codec = codec or STATS_CACHE_CODEC
+    if codec == "json":
+        return json.dumps(data).encode()
+    packed = msgpack.packb(json_compatible(data))
+    if codec == "msgpack+zstd" and len(packed) >= STATS_CACHE_COMPRESS_MIN_BYTES:
+        return ZSTD_MSGPACK_TAG + zstandard.ZstdCompressor(level=STATS_CACHE_ZSTD_LEVEL).compress(packed)
+    return MSGPACK_TAG + packed
+
+
+def decode_stat(raw):
+    """Decodes a cached stat written with any codec; raises ValueError if it is corrupt."""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if not raw.startswith(CODEC_MARKER):
+        return json.loads(raw)
+    tag, payload = raw[:len(MSGPACK_TAG)], raw[len(MSGPACK_TAG):]
+    if tag == ZSTD_MSGPACK_TAG:
+        try:
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Corrupt compressed cache value: {e}") from e
+    elif tag != MSGPACK_TAG:
+        raise ValueError(f"Unknown cache codec tag {tag!r}")
+    return msgpack.unpackb(payload)
@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from . import resolved_tar
+
+logger = logging.getLogger(__name__)
+
+# Challenge archives are built once per version of a challenge directory (or option) and reused for every start. They
+# are kept in memory by default; set CHALLENGE_ARCHIVE_CACHE_DIR to share them on disk between the web processes.
+CHALLENGE_ARCHIVE_CACHE_BYTES = int(os.environ.get("CHALLENGE_ARCHIVE_CACHE_BYTES", str(256 * 2**20)))
+CHALLENGE_ARCHIVE_CACHE_DIR = os.environ.get("CHALLENGE_ARCHIVE_CACHE_DIR")
+# Archives larger than this are built for every start instead of being cached.
+CHALLENGE_ARCHIVE_MAX_BYTES = CHALLENGE_ARCHIVE_CACHE_BYTES // 4
+
+CHALLENGE_MODE = 0o4755
+
+
+def challenge_tarinfo(tarinfo):
+    # What insert_challenge used to do with chown and chmod after copying the challenge into the workspace.
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    if not tarinfo.issym():
+        tarinfo.mode = CHALLENGE_MODE
+    return tarinfo
+
+
+def build_challenge_archive(dir, *, root_dir, filter=None):
+    return resolved_tar(dir, root_dir=root_dir, filter=filter, tarinfo_filter=challenge_tarinfo).getvalue()
+
+
+def stat_entry(path, relative_path):
+    stat = path.stat()
+    return (str(relative_path), stat.st_mode, stat.st_size, stat.st_mtime_ns, stat.st_ino, os.readlink(path) if path.is_symlink() else None)
+
+
+def directory_signature(dir, *, root_dir, filter=None):
+    """A digest of the names and stats of everything resolved_tar would archive from dir, which changes whenever the
+    archive would; used to find the archive without reading every file."""
+    entries = [str(dir), str(root_dir)]
+    for path in sorted(dir.rglob("*")):
+        if filter is not None and not filter(path):
+            continue
+        relative_path = path.relative_to(dir)
+        entries.append(stat_entry(path, relative_path))
+        if path.is_symlink() and path.is_dir():
+            # resolved_tar archives the contents of linked directories, which rglob does not walk.
+            resolved_path = path.resolve()
+            entries.extend(stat_entry(child, relative_path / child.relative_to(resolved_path)) for child in sorted(resolved_path.rglob("*")))
+    return hashlib.sha256(repr(entries).encode()).hexdigest()
+
+
+class MemoryArchiveStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.archives = OrderedDict()
+        self.refs = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, signature):
+        with self.lock:
+            digest = self.refs.get(signature)
+            archive = self.archives.get(digest)
+            if archive is not None:
+                self.archives.move_to_end(digest)
+            return archive
+
+    def store(self, signature, digest, archive):
+        with self.lock:
+            self.refs[signature] = digest
+            if digest not in self.archives:
+                self.archives[digest] = archive
+                self.size += len(archive)
+            self.archives.move_to_end(digest)
+            while self.size > self.max_bytes and self.archives:
+                evicted_digest, evicted = self.archives.popitem(last=False)
+                self.size -= len(evicted)
+                self.refs = {signature: digest for signature, digest in self.refs.items() if digest != evicted_digest}
+
+
+class DiskArchiveStore:
+    """Archives in {dir}/{digest}.tar, found through {dir}/{signature}.ref; the least recently used are removed once
+    the directory holds more than max_bytes of archives."""
+
+    def __init__(self, dir, max_bytes):
+        self.dir = pathlib.Path(dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def write(self, path, data):
+        with tempfile.NamedTemporaryFile(dir=self.dir, delete=False) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+    def lookup(self, signature):
+        try:
+            digest = (self.dir / f"{signature}.ref").read_text()
+            archive_path = self.dir / f"{digest}.tar"
+            archive = archive_path.read_bytes()
+            os.utime(archive_path)
+            return archive
+        except FileNotFoundError:
+            return None
+
+    def store(self, signature, digest, archive):
+        archive_path = self.dir / f"{digest}.tar"
+        if archive_path.exists():
+            os.utime(archive_path)
+        else:
+            self.write(archive_path, archive)
+        self.write(self.dir / f"{signature}.ref", digest.encode())
+        self.evict()
+
+    def evict(self):
+        archives = []
+        for path in self.dir.glob("*.tar"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            archives.append((stat.st_mtime, stat.st_size, path))
+        size = sum(archive_size for _, archive_size, _ in archives)
+        for _, archive_size, path in sorted(archives, key=lambda archive: archive[0]):
+            if size <= self.max_bytes:
+                break
+            # Refs to a removed archive are left behind; looking them up finds no archive and rebuilds it.
+            path.unlink(missing_ok=True)
+            size -= archive_size
+
+
+archive_store = (DiskArchiveStore(CHALLENGE_ARCHIVE_CACHE_DIR, CHALLENGE_ARCHIVE_CACHE_BYTES)
+                 if CHALLENGE_ARCHIVE_CACHE_DIR else MemoryArchiveStore(CHALLENGE_ARCHIVE_CACHE_BYTES))
+
+
+def challenge_archive(dir, *, root_dir, filter=None):
+    """The archive of dir to extract into /challenge, owned by root with mode 4755, built at most once per version."""
+    signature = directory_signature(dir, root_dir=root_dir, filter=filter)
+    archive = archive_store.lookup(signature)
+    if archive is not None:
+        return archive
+
+    archive = build_challenge_archive(dir, root_dir=root_dir, filter=filter)
+    if len(archive) <= CHALLENGE_ARCHIVE_MAX_BYTES:
+        archive_store.store(signature, hashlib.sha256(archive).hexdigest(), archive)
+    else:
+        logger.info(f"Not caching the {len(archive)} byte challenge archive of {dir}")
+    return archive
@@ -0,0 +1,141 @@
+import functools
+import logging
+import os
+from collections import Counter
+
+import redis
+from CTFd.models import db, Solves
+
+from ..models import DojoChallenges
+from .background_stats import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Each user has a hash of how many required challenges they solved per dojo, so that award checks after a solve only
+# count solves for the dojos they are missing. Fields are tagged with the dojo's generation, which is bumped whenever
+# its challenges change; counts of older generations are ignored and expire with the hash.
+COMPLETIONS_GENERATIONS_KEY = "stats:completions:generations"
+COMPLETIONS_TTL = int(os.environ.get("COMPLETIONS_TTL", str(7 * 86400)))
+
+# Adds to the counts that are already indexed, or to the pending delta of a count that is being computed; any other
+# missing count is computed from the database when it is next read.
+INCREMENT_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local generation = redis.call("HGET", KEYS[2], ARGV[i]) or "0"
+    local field = ARGV[i] .. ":" .. generation
+    if redis.call("HEXISTS", KEYS[1], field) == 1 then
+        redis.call("HINCRBY", KEYS[1], field, ARGV[i + 1])
+    elseif redis.call("HEXISTS", KEYS[1], "pending:" .. field) == 1 then
+        redis.call("HINCRBY", KEYS[1], "pending:" .. field, ARGV[i + 1])
+    end
+end
+"""
+
+# Indexes computed counts plus the solves recorded while they were computed, unless another reader indexed them first.
+# A solve committed just before the count can be in both, which only overcounts; completed_dojos confirms completions.
+STORE_SCRIPT = """
+for i = 1, #ARGV - 1, 2 do
+    local pending = "pending:" .. ARGV[i]
+    local delta = tonumber(redis.call("HGET", KEYS[1], pending) or "0")
+    redis.call("HDEL", KEYS[1], pending)
+    redis.call("HSETNX", KEYS[1], ARGV[i], tonumber(ARGV[i + 1]) + delta)
+end
+redis.call("EXPIRE", KEYS[1], ARGV[#ARGV])
+"""
+
+
+def completions_key(user_id):
+    return f"stats:completions:{user_id}"
+
+
+def required_challenge_dojos(connection, challenge_id):
+    """Returns {dojo_id: count} of the required dojo challenges for `challenge_id`, using the flushing connection."""
+    rows = connection.execute(
+        db.select([DojoChallenges.dojo_id])
+        .where(DojoChallenges.challenge_id == challenge_id, DojoChallenges.required)
+    )
+    return Counter(dojo_id for dojo_id, in rows)
+
+
+@functools.lru_cache(maxsize=None)
+def completion_script(r, script):
+    return r.register_script(script)
+
+
+def record_solve(user_id, dojo_counts):
+    if not dojo_counts:
+        return
+    args = [value for dojo_id, count in dojo_counts.items() for value in (dojo_id, count)]
+    r = get_redis_client()
+    completion_script(r, INCREMENT_SCRIPT)(keys=[completions_key(user_id), COMPLETIONS_GENERATIONS_KEY], args=args)
+
+
+def forget_user(user_id):
+    get_redis_client().delete(completions_key(user_id))
+
+
+def invalidate_dojo(dojo_id):
+    get_redis_client().hincrby(COMPLETIONS_GENERATIONS_KEY, dojo_id, 1)
+
+
+def count_required_solves(user, dojo_ids):
+    counts = dict(
+        Solves.query
+        .join(DojoChallenges, DojoChallenges.challenge_id == Solves.challenge_id)
+        .filter(Solves.user_id == user.id, DojoChallenges.required, DojoChallenges.dojo_id.in_(dojo_ids))
+        .with_entities(DojoChallenges.dojo_id, db.func.count())
+        .group_by(DojoChallenges.dojo_id)
+    )
+    return {dojo_id: counts.get(dojo_id, 0) for dojo_id in dojo_ids}
+
+
+def get_completion_counts(user, dojo_ids):
+    """Returns {dojo_id: required solves} for `user`, computing (and indexing) any counts the index is missing."""
+    dojo_ids = list(dojo_ids)
+    if not dojo_ids:
+        return {}
+    try:
+        r = get_redis_client()
+        generations = r.hmget(COMPLETIONS_GENERATIONS_KEY, dojo_ids)
+        fields = [f"{dojo_id}:{generation or 0}" for dojo_id, generation in zip(dojo_ids, generations)]
+        cached = r.hmget(completions_key(user.id), fields)
+    except redis.RedisError as e:
+        logger.warning(f"Completion index unavailable, counting solves: {e}")
+        return count_required_solves(user, dojo_ids)
+
+    counts = {dojo_id: int(count) for dojo_id, count in zip(dojo_ids, cached) if count is not None}
+    missing = [dojo_id for dojo_id in dojo_ids if dojo_id not in counts]
+    if not missing:
+        return counts
+
+    field_of = dict(zip(dojo_ids, fields))
+    try:
+        # Solves recorded from here on, before the count is indexed, are kept as pending deltas instead of skipped.
+        pipeline = r.pipeline()
+        for dojo_id in missing:
+            pipeline.hsetnx(completions_key(user.id), f"pending:{field_of[dojo_id]}", 0)
+        pipeline.expire(completions_key(user.id), COMPLETIONS_TTL)
+        pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to index completion counts for user {user.id}: {e}")
+        return {**counts, **count_required_solves(user, missing)}
+
+    computed = count_required_solves(user, missing)
+    counts.update(computed)
+    try:
+        args = [value for dojo_id, count in computed.items() for value in (field_of[dojo_id], count)]
+        completion_script(r, STORE_SCRIPT)(keys=[completions_key(user.id)], args=[*args, COMPLETIONS_TTL])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to index completion counts for user {user.id}: {e}")
+    return counts
+
+
+def completed_dojos(user, dojos):
+    """
+    Returns the dojos in `dojos` that `user` has completed. The index rules out incomplete dojos; the few that look
+    complete are confirmed with Dojos.completed, which also applies its membership rules.
+    Load `dojos` with challenges_count and required_challenges_count undeferred.
+    """
+    dojos = [dojo for dojo in dojos if dojo.challenges_count]
+    counts = get_completion_counts(user, [dojo.dojo_id for dojo in dojos])
+    return [dojo for dojo in dojos if counts[dojo.dojo_id] >= dojo.required_challenges_count and dojo.completed(user)]
@@ -0,0 +1,206 @@
+import json
+import logging
+
+from .background_stats import get_redis_client, get_redis_time
+from .crews import parse_crew_tag
+from .metrics import record_cache_update
+
+logger = logging.getLogger(__name__)
+
+CREW_MEMBERSHIP_KEY = "stats:crews:members"
+CREW_MODES = ("cumulative", "unique")
+# Crews are ordered lexicographically by fixed-width fields, so both orders can live in sorted sets whose scores are
+# all zero and be paged with ZRANGE.
+ORDER_FIELD_LIMIT = 10 ** 10
+
+
+def crews_cache_key(scoreboard_key):
+    return scoreboard_key.replace("stats:scoreboard:", "stats:crews:", 1)
+
+
+def crew_order_key(crews_key, mode):
+    return f"{crews_key}:order:{mode}"
+
+
+def get_crew_membership(user_id, name=None):
+    """Returns the parsed crew tag of a user, parsing and caching `name` the first time the user is seen."""
+    r = get_redis_client()
+    cached = r.hget(CREW_MEMBERSHIP_KEY, user_id)
+    if cached is not None:
+        return json.loads(cached) if cached else None
+    if name is None:
+        return None
+    return set_crew_membership(user_id, name)
+
+
+def set_crew_membership(user_id, name):
+    parsed = parse_crew_tag(name)
+    membership = parsed and {"key": parsed["key"], "tag": parsed["tag"]}
+    write_crew_membership(user_id, membership)
+    return membership
+
+
+def write_crew_membership(user_id, membership):
+    get_redis_client().hset(CREW_MEMBERSHIP_KEY, user_id, json.dumps(membership) if membership else "")
+
+
+def crew_orders(crew):
+    # Matches aggregate_crews: the best member's board position is decided by their solves and then their last solve,
+    # so it can be kept up to date from the crew's own members.
+    best = max(crew["members"].values(), key=lambda member: (member["solves"], -member["last_solve_id"]), default=None)
+    best_solves, best_last_solve_id = (best["solves"], best["last_solve_id"]) if best else (0, 0)
+    tail = f"{len(crew['members']):010d}|{ORDER_FIELD_LIMIT - 1 - best_solves:010d}|{best_last_solve_id:010d}|{crew['key']}"
+    return {
+        "cumulative": f"{ORDER_FIELD_LIMIT - 1 - crew['score']:010d}|{tail}",
+        "unique": f"{ORDER_FIELD_LIMIT - 1 - len(crew['challenges']):010d}|{tail}",
+    }
+
+
+def build_crew(membership):
+    return {"key": membership["key"], "tag": membership["tag"], "score": 0, "members": {}, "challenges": {}}
+
+
+def add_crew_member(crew, user_id, solves, last_solve_id, challenges):
+    remove_crew_member(crew, user_id)
+    crew["members"][str(user_id)] = {"solves": solves, "last_solve_id": last_solve_id or 0, "challenges": sorted(challenges)}
+    crew["score"] += solves
+    for challenge_id in challenges:
+        crew["challenges"][str(challenge_id)] = crew["challenges"].get(str(challenge_id), 0) + 1
+
+
+def remove_crew_member(crew, user_id):
+    member = crew["members"].pop(str(user_id), None)
+    if member is None:
+        return
+    crew["score"] -= member["solves"]
+    for challenge_id in member["challenges"]:
+        count = crew["challenges"].get(str(challenge_id), 0) - 1
+        if count > 0:
+            crew["challenges"][str(challenge_id)] = count
+        else:
+            crew["challenges"].pop(str(challenge_id), None)
+
+
+def write_crews(r, crews_key, crews, previous_orders=None, pipeline=None):
+    """Writes the given crews, removing empty ones, and moves them from `previous_orders` to their new orders."""
+    previous_orders = previous_orders or {}
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = r.pipeline()
+    for crew_key, crew in crews.items():
+        for mode, order in previous_orders.get(crew_key, {}).items():
+            pipeline.zrem(crew_order_key(crews_key, mode), order)
+        if crew["members"]:
+            pipeline.hset(crews_key, crew_key, json.dumps(crew))
+            for mode, order in crew_orders(crew).items():
+                pipeline.zadd(crew_order_key(crews_key, mode), {order: 0})
+        else:
+            pipeline.hdel(crews_key, crew_key)
+    pipeline.set(f"{crews_key}:updated", str(get_redis_time(r)))
+    if own_pipeline:
+        pipeline.execute()
+    record_cache_update(crews_key)
+
+
+def rebuild_crew_index(crews_key, scoreboard, member_challenges):
+    r = get_redis_client()
+    crews = {}
+    memberships = {}
+    for entry in scoreboard or []:
+        membership = parse_crew_tag(entry.get("name"))
+        memberships[entry["user_id"]] = json.dumps({"key": membership["key"], "tag": membership["tag"]}) if membership else ""
+        if not membership:
+            continue
+        crew = crews.setdefault(membership["key"], build_crew(membership))
+        add_crew_member(crew, entry["user_id"], entry["solves"], entry.get("last_solve_id"), member_challenges.get(entry["user_id"], ()))
+
+    pipeline = r.pipeline()
+    # The crews key is a hash of crew key to crew, which replaces the list cached by earlier versions.
+    pipeline.delete(crews_key, *(crew_order_key(crews_key, mode) for mode in CREW_MODES))
+    if memberships:
+        pipeline.hset(CREW_MEMBERSHIP_KEY, mapping=memberships)
+    write_crews(r, crews_key, crews, pipeline=pipeline)
+    pipeline.execute()
+
+
+def get_crews(crews_key, crew_keys):
+    crew_keys = list(crew_keys)
+    if not crew_keys:
+        return {}
+    docs = get_redis_client().hmget(crews_key, crew_keys)
+    return {crew_key: json.loads(doc) for crew_key, doc in zip(crew_keys, docs) if doc}
+
+
+def add_crew_solve(crews_key, user_id, solves, solve_id, challenge_id, membership, load_challenges):
+    """
+    Applies one solve by a crew member: their solves and last solve come from the scoreboard entry, and the challenge
+    joins the crew's unique set. `load_challenges` is only called for a user who is not yet in the crew on this board.
+    """
+    r = get_redis_client()
+    crew = get_crews(crews_key, [membership["key"]]).get(membership["key"])
+    previous_orders = {membership["key"]: crew_orders(crew)} if crew else {}
+    crew = crew or build_crew(membership)
+    member = crew["members"].get(str(user_id))
+    if member is None:
+        challenges = set(load_challenges())
+    else:
+        challenges = set(member["challenges"]) | {challenge_id}
+    add_crew_member(crew, user_id, solves, solve_id, challenges)
+    write_crews(r, crews_key, {membership["key"]: crew}, previous_orders)
+
+
+def crew_member_ids(crews_key):
+    return [
+        int(user_id)
+        for doc in get_redis_client().hvals(crews_key)
+        for user_id in json.loads(doc)["members"]
+    ]
+
+
+def crew_member_challenges(crews_key):
+    return {
+        int(user_id): set(member["challenges"])
+        for doc in get_redis_client().hvals(crews_key)
+        for user_id, member in json.loads(doc)["members"].items()
+    }
+
+
+def crew_index_exists(crews_key):
+    r = get_redis_client()
+    key_type = r.type(crews_key)
+    if key_type != "none":
+        # Earlier versions cached the crews as a list, which still needs a rebuild.
+        return key_type == "hash"
+    # An index built without any crews leaves no hash behind, only its updated time.
+    return bool(r.exists(f"{crews_key}:updated")) and not r.exists(crew_order_key(crews_key, CREW_MODES[0]))
+
+
+def ranked_crew(crew, rank):
+    return {
+        "key": crew["key"],
+        "tag": crew["tag"],
+        "score": crew["score"],
+        "unique": len(crew["challenges"]),
+        "rank": rank,
+        "member_ids": sorted(int(user_id) for user_id in crew["members"]),
+    }
+
+
+def read_crew_page(crews_key, mode, start, count):
+    r = get_redis_client()
+    pipeline = r.pipeline(transaction=False)
+    pipeline.zrange(crew_order_key(crews_key, mode), start, start + count - 1)
+    pipeline.zcard(crew_order_key(crews_key, mode))
+    orders, total = pipeline.execute()
+    # Crew keys may contain "|", but the fields before them never do.
+    crew_keys = [order.split("|", 4)[4] for order in orders]
+    crews = get_crews(crews_key, crew_keys)
+    return [ranked_crew(crews[crew_key], rank) for rank, crew_key in enumerate(crew_keys, start + 1) if crew_key in crews], total
+
+
+def read_crew_rank(crews_key, mode, crew_key):
+    crew = get_crews(crews_key, [crew_key]).get(crew_key)
+    if crew is None:
+        return None
+    rank = get_redis_client().zrank(crew_order_key(crews_key, mode), crew_orders(crew)[mode])
+    return ranked_crew(crew, rank + 1) if rank is not None else None
@@ -66,10 +66,3 @@ def aggregate_crews(standings, member_challenges=None):
 
     return ranked
 
-
-def member_challenges_from_crews(crews):
-    return {
-        member["user_id"]: set(member.get("challenges", []))
-        for crew in (crews or [])
-        for member in crew.get("members", [])
-    }
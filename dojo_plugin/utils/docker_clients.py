@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+
+import docker
+import docker.errors
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Docker clients are shared by everything in a process that talks to the same daemon, so that their HTTP connections
+# (and the API version lookup a new client makes) are reused between requests instead of set up for every call.
+DOCKER_CLIENT_POOL_SIZE = int(os.environ.get("DOCKER_CLIENT_POOL_SIZE", "32"))
+# A shared client that has not been used for this long is pinged before it is handed out, and replaced if that fails.
+DOCKER_CLIENT_HEALTH_SECONDS = int(os.environ.get("DOCKER_CLIENT_HEALTH_SECONDS", "30"))
+LOCAL_NODE = -1
+
+_docker_clients = {}
+_docker_clients_lock = threading.Lock()
+
+
+def new_node_docker_client(node_id):
+    if node_id == LOCAL_NODE:
+        return docker.from_env(max_pool_size=DOCKER_CLIENT_POOL_SIZE)
+    return docker.DockerClient(base_url=f"tcp://192.168.42.{node_id + 1}:2375", tls=False, max_pool_size=DOCKER_CLIENT_POOL_SIZE)
+
+
+def close_docker_client(client):
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+def shared_docker_client(key, connect):
+    """Returns this process's client for key, calling connect to make one if there is none or it stopped answering."""
+    with _docker_clients_lock:
+        entry = _docker_clients.get(key)
+    # Clients are not shared with forked children, which get their own connections.
+    if entry and entry["pid"] == os.getpid():
+        if time.monotonic() - entry["used_at"] < DOCKER_CLIENT_HEALTH_SECONDS:
+            entry["used_at"] = time.monotonic()
+            return entry["client"]
+        try:
+            entry["client"].ping()
+            entry["used_at"] = time.monotonic()
+            return entry["client"]
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+            logger.warning(f"Docker client for {key} failed its health check, reconnecting: {e}")
+            reset_docker_client(key, entry["client"])
+
+    client = connect()
+    with _docker_clients_lock:
+        _docker_clients[key] = {"pid": os.getpid(), "client": client, "used_at": time.monotonic()}
+    return client
+
+
+def reset_docker_client(key, client=None):
+    """Drops the shared client for key (only if it is still client, when given), so the next use reconnects."""
+    with _docker_clients_lock:
+        entry = _docker_clients.get(key)
+        if not entry or (client is not None and entry["client"] is not client):
+            return
+        del _docker_clients[key]
+    if entry["pid"] == os.getpid():
+        close_docker_client(entry["client"])
+
+
+def node_key(node_id):
+    return LOCAL_NODE if node_id is None or node_id < 0 else node_id
+
+
+def node_docker_client(node_id):
+    node_id = node_key(node_id)
+    return shared_docker_client(node_id, lambda: new_node_docker_client(node_id))
+
+
+def reset_node_docker_client(node_id):
+    reset_docker_client(node_key(node_id))
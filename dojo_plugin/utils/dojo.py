@@ -25,7 +25,8 @@ from CTFd.utils.user import get_current_user, is_admin
 
 from ..models import DojoAdmins, Dojos, DojoModules, DojoChallenges, DojoResources, DojoChallengeVisibilities, DojoResourceVisibilities, DojoModuleVisibilities
 from ..config import DOJOS_DIR
-from ..utils import get_current_container, sanitize_survey
+from ..utils import sanitize_survey
+from ..utils.active_containers import get_active_container
 
 
 DOJOS_TMP_DIR = DOJOS_DIR/"tmp"
@@ -763,14 +764,15 @@ def dojo_route(func):
 
 
 def get_current_dojo_challenge(user=None):
-    container = get_current_container(user)
-    if not container:
+    user = user or get_current_user()
+    active_container = get_active_container(user) if user else None
+    if not active_container:
         return None
 
     return (
         DojoChallenges.query
-        .filter(DojoChallenges.id == container.labels.get("dojo.challenge_id"),
-                DojoChallenges.module == DojoModules.from_id(container.labels.get("dojo.dojo_id"), container.labels.get("dojo.module_id")).first(),
-                DojoChallenges.dojo == Dojos.from_id(container.labels.get("dojo.dojo_id")).first())
+        .filter(DojoChallenges.id == active_container["challenge"],
+                DojoChallenges.module == DojoModules.from_id(active_container["dojo"], active_container["module"]).first(),
+                DojoChallenges.dojo == Dojos.from_id(active_container["dojo"]).first())
         .first()
     )
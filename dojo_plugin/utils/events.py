@@ -1,55 +1,107 @@
+import json
 import logging
 
 from flask import g
+from sqlalchemy import or_
+from CTFd.models import Solves
 
-from .background_stats import publish_stat_event
+from ..models import DojoChallenges, Dojos
+
+from .background_stats import publish_stat_event, count_collapsed_events, STATS_SHARDS
 
 logger = logging.getLogger(__name__)
 
 
 def publish_dojo_stats_event(dojo_id_int):
-    publish_stat_event("dojo_stats_update", {"dojo_id": dojo_id_int})
+    publish_stat_event("dojo_stats_update", {"dojo_id": dojo_id_int}, partition_key=dojo_id_int)
 
 
 def publish_scoreboard_event(model_type, model_id):
-    publish_stat_event("scoreboard_update", {"model_type": model_type, "model_id": model_id})
+    dojo_id = model_id.get("dojo_id") if isinstance(model_id, dict) else model_id
+    publish_stat_event("scoreboard_update", {"model_type": model_type, "model_id": model_id}, partition_key=dojo_id)
 
 
 def publish_scores_event(dojo_id=None):
-    payload = {"dojo_id": dojo_id} if dojo_id is not None else {}
-    publish_stat_event("scores_update", payload)
+    if dojo_id is not None:
+        publish_stat_event("scores_update", {"dojo_id": dojo_id}, partition_key=dojo_id)
+        return
+    if STATS_SHARDS <= 1:
+        publish_stat_event("scores_update", {})
+        return
+
+    # Each dojo's scores are owned by its dojo's shard, so a recompute of all of them is published once per dojo.
+    dojo_ids = Dojos.query.filter(or_(Dojos.data["type"].astext == "public", Dojos.official)).with_entities(Dojos.dojo_id)
+    for dojo_id, in dojo_ids:
+        publish_stat_event("scores_update", {"dojo_id": dojo_id}, partition_key=dojo_id)
 
 
-def publish_belts_event():
-    publish_stat_event("belts_update", {})
+def publish_belts_event(user_id=None):
+    publish_stat_event("belts_update", {"user_id": user_id} if user_id is not None else {})
 
 
-def publish_emojis_event():
-    publish_stat_event("emojis_update", {})
+def publish_emojis_event(user_id=None):
+    publish_stat_event("emojis_update", {"user_id": user_id} if user_id is not None else {})
 
 
 def publish_activity_event(user_id):
-    publish_stat_event("activity_update", {"user_id": user_id})
+    publish_stat_event("activity_update", {"user_id": user_id}, partition_key=f"user:{user_id}")
 
 
-def publish_challenge_solve_event(user_id, challenge_id, solve_date=None):
+def publish_challenge_solve_event(user_id, challenge_id, solve_date=None, solve_id=None):
     payload = {"user_id": user_id, "challenge_id": challenge_id}
+    if solve_id is not None:
+        payload["solve_id"] = solve_id
     if solve_date:
         payload["solve_date"] = solve_date.isoformat() + 'Z'
-    publish_stat_event("challenge_solve", payload)
-
-
-def queue_stat_event(event_func):
+    if STATS_SHARDS <= 1:
+        publish_stat_event("challenge_solve", payload)
+        return
+
+    # A challenge can be imported into several dojos, which may live on different shards: publish one solve per dojo,
+    # and let the user's shard recompute their (cross-dojo) activity.
+    dojo_ids = DojoChallenges.query.filter_by(challenge_id=challenge_id).with_entities(DojoChallenges.dojo_id).distinct()
+    for dojo_id, in dojo_ids:
+        publish_stat_event("challenge_solve", {**payload, "dojo_id": dojo_id}, partition_key=dojo_id)
+    publish_activity_event(user_id)
+
+
+def publish_user_update_event(user_id):
+    if STATS_SHARDS <= 1:
+        publish_stat_event("user_update", {"user_id": user_id})
+        return
+
+    # The user's name is shown on the boards of every dojo they have solved in, each owned by its dojo's shard.
+    dojo_ids = (
+        DojoChallenges.query
+        .join(Solves, Solves.challenge_id == DojoChallenges.challenge_id)
+        .filter(Solves.user_id == user_id)
+        .with_entities(DojoChallenges.dojo_id)
+        .distinct()
+    )
+    for dojo_id, in dojo_ids:
+        publish_stat_event("user_update", {"user_id": user_id, "dojo_id": dojo_id}, partition_key=dojo_id)
+
+
+def queue_stat_event(publish_func, *args):
+    # A single request (e.g. a dojo reload) can touch many rows that each queue the same recompute; publish it once.
     if not hasattr(g, '_pending_stat_events'):
-        g._pending_stat_events = []
-    g._pending_stat_events.append(event_func)
+        g._pending_stat_events = {}
+        g._collapsed_stat_events = 0
+    key = (publish_func.__name__, json.dumps(args, sort_keys=True, default=str))
+    if key in g._pending_stat_events:
+        g._collapsed_stat_events += 1
+        return
+    g._pending_stat_events[key] = (publish_func, args)
 
 
 def publish_queued_events():
     if hasattr(g, '_pending_stat_events'):
         count = len(g._pending_stat_events)
+        collapsed = g._collapsed_stat_events
         if count > 0:
-            logger.info(f"Publishing {count} queued stat events after request")
-        for event_func in g._pending_stat_events:
-            event_func()
-        g._pending_stat_events = []
+            logger.info(f"Publishing {count} queued stat events after request ({collapsed} duplicates collapsed)")
+        for publish_func, args in g._pending_stat_events.values():
+            publish_func(*args)
+        count_collapsed_events("request", collapsed)
+        g._pending_stat_events = {}
+        g._collapsed_stat_events = 0
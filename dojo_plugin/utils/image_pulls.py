@@ -7,7 +7,8 @@ from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
 
 import redis
 
-from .background_stats import get_redis_client
+from .background_stats import get_redis_client, get_message_timestamp
+from .metrics import IMAGE_PULLS, IMAGE_PULL_QUEUE_SECONDS, IMAGE_PULL_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +82,7 @@ def consume_image_pull_events(handler: Callable[[Dict[str, Any]], HandlerResult]
             event_data = json.loads(raw)
         except Exception as e:
             logger.error(f"Invalid image pull event {message_id}: {e}", exc_info=True)
+            IMAGE_PULLS.labels("invalid").inc()
             try:
                 r.xackdel(IMAGE_PULL_STREAM_NAME, CONSUMER_GROUP, message_id)
             except Exception:
@@ -90,19 +92,23 @@ def consume_image_pull_events(handler: Callable[[Dict[str, Any]], HandlerResult]
         attempt = int(event_data.get("attempt", 0))
         max_attempts = int(event_data.get("max_attempts", MAX_PULL_ATTEMPTS))
 
+        IMAGE_PULL_QUEUE_SECONDS.observe(max(0.0, time.time() - get_message_timestamp(message_id)))
         try:
-            success, retry = _parse_handler_result(handler(event_data))
+            with IMAGE_PULL_SECONDS.time():
+                success, retry = _parse_handler_result(handler(event_data))
         except Exception as e:
             logger.error(f"Error handling image pull event {message_id}: {e}", exc_info=True)
             success, retry = False, True
 
         if success:
             r.xackdel(IMAGE_PULL_STREAM_NAME, CONSUMER_GROUP, message_id)
+            IMAGE_PULLS.labels("success").inc()
             logger.info(f"Processed image pull event {message_id}")
             return
 
         image = event_data.get("image")
         if retry and attempt + 1 < max_attempts:
+            IMAGE_PULLS.labels("retry").inc()
             delay = min(60.0, (2 ** attempt) + random.random())
             logger.warning(f"Retrying image pull for {image} in {delay:.1f}s (next attempt {attempt + 2}/{max_attempts})")
             time.sleep(delay)
@@ -118,6 +124,7 @@ def consume_image_pull_events(handler: Callable[[Dict[str, Any]], HandlerResult]
                 logger.error(f"Failed to re-enqueue image pull for {image}; leaving message pending")
             return
 
+        IMAGE_PULLS.labels("dropped").inc()
         logger.error(f"Dropping image pull for {image} after {attempt + 1}/{max_attempts} attempts")
         r.xackdel(IMAGE_PULL_STREAM_NAME, CONSUMER_GROUP, message_id)
 
@@ -1,6 +1,6 @@
 import logging
 
-from sqlalchemy import event
+from sqlalchemy import event, inspect
 from sqlalchemy.orm.session import Session
 from CTFd.cache import cache
 from CTFd.models import Users, Solves, Awards
@@ -18,7 +18,9 @@ from .events import (
     publish_emojis_event,
     publish_activity_event,
     publish_challenge_solve_event,
+    publish_user_update_event,
 )
+from .completions import required_challenge_dojos, record_solve, forget_user, invalidate_dojo
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +29,6 @@ def invalidate_scoreboard_cache():
     pass
 
 
-# TODO: Consider deduplicating events when a single action triggers
-# multiple updates (e.g., solve affecting multiple dojos). Currently
-# acceptable but may need optimization at scale.
-
-
 @event.listens_for(Dojos, 'after_insert', propagate=True)
 @event.listens_for(Dojos, 'after_delete', propagate=True)
 @event.listens_for(Solves, 'after_insert', propagate=True)
@@ -47,16 +44,17 @@ def hook_object_creation(mapper, connection, target):
 
     if isinstance(target, Solves):
         logger.info(f"Solve listener fired: challenge_id={target.challenge_id}, user_id={target.user_id}")
-        queue_stat_event(lambda u_id=target.user_id, c_id=target.challenge_id, s_date=target.date: publish_challenge_solve_event(u_id, c_id, s_date))
+        queue_stat_event(publish_challenge_solve_event, target.user_id, target.challenge_id, target.date, target.id)
     elif isinstance(target, Dojos):
         dojo_id = target.dojo_id
-        queue_stat_event(lambda d_id=dojo_id: publish_dojo_stats_event(d_id))
-        queue_stat_event(lambda d_id=dojo_id: publish_scoreboard_event("dojo", d_id))
-        queue_stat_event(lambda d_id=dojo_id: publish_scores_event(d_id))
+        queue_stat_event(publish_dojo_stats_event, dojo_id)
+        queue_stat_event(publish_scoreboard_event, "dojo", dojo_id)
+        queue_stat_event(publish_scores_event, dojo_id)
+        queue_stat_event(publish_emojis_event)
     elif isinstance(target, Belts):
-        queue_stat_event(publish_belts_event)
+        queue_stat_event(publish_belts_event, target.user_id)
     elif isinstance(target, Emojis):
-        queue_stat_event(publish_emojis_event)
+        queue_stat_event(publish_emojis_event, target.user_id)
 
 
 @event.listens_for(Users, 'after_update', propagate=True)
@@ -76,21 +74,70 @@ def hook_object_update(mapper, connection, target):
 
         if isinstance(target, Dojos):
             dojo_id = target.dojo_id
-            queue_stat_event(lambda d_id=dojo_id: publish_dojo_stats_event(d_id))
-            queue_stat_event(lambda d_id=dojo_id: publish_scoreboard_event("dojo", d_id))
-            queue_stat_event(lambda d_id=dojo_id: publish_scores_event(d_id))
+            queue_stat_event(publish_dojo_stats_event, dojo_id)
+            queue_stat_event(publish_scoreboard_event, "dojo", dojo_id)
+            queue_stat_event(publish_scores_event, dojo_id)
+            # The cached emojis carry each award dojo's emoji, reference id and type.
+            if any(inspect(target).attrs[name].history.has_changes() for name in ("id", "official", "data")):
+                queue_stat_event(publish_emojis_event)
         elif isinstance(target, DojoChallenges):
             dojo_id = target.dojo.dojo_id
             module_id = {"dojo_id": target.dojo.dojo_id, "module_index": target.module.module_index}
-            queue_stat_event(lambda d_id=dojo_id: publish_dojo_stats_event(d_id))
-            queue_stat_event(lambda d_id=dojo_id: publish_scoreboard_event("dojo", d_id))
-            queue_stat_event(lambda m_id=module_id: publish_scoreboard_event("module", m_id))
+            queue_stat_event(publish_dojo_stats_event, dojo_id)
+            queue_stat_event(publish_scoreboard_event, "dojo", dojo_id)
+            queue_stat_event(publish_scoreboard_event, "module", module_id)
         elif isinstance(target, DojoModules):
             dojo_id = target.dojo.dojo_id
             module_id = {"dojo_id": target.dojo.dojo_id, "module_index": target.module_index}
-            queue_stat_event(lambda d_id=dojo_id: publish_dojo_stats_event(d_id))
-            queue_stat_event(lambda m_id=module_id: publish_scoreboard_event("module", m_id))
+            queue_stat_event(publish_dojo_stats_event, dojo_id)
+            queue_stat_event(publish_scoreboard_event, "module", module_id)
         elif isinstance(target, Belts):
-            queue_stat_event(publish_belts_event)
+            queue_stat_event(publish_belts_event, target.user_id)
         elif isinstance(target, Emojis):
-            queue_stat_event(publish_emojis_event)
+            queue_stat_event(publish_emojis_event, target.user_id)
+        elif isinstance(target, Users):
+            attrs = inspect(target).attrs
+            if attrs.name.history.has_changes():
+                queue_stat_event(publish_user_update_event, target.id)
+            # Belts show the user's name and website, and hidden users have no belts or emojis.
+            if any(attrs[name].history.has_changes() for name in ("name", "website", "hidden")):
+                queue_stat_event(publish_belts_event, target.id)
+                queue_stat_event(publish_emojis_event, target.id)
+
+
+# The completion index is only touched once the change is committed, so a rolled back solve is never counted.
+def queue_completion_change(target, func, *args):
+    # A dojo reload touches every challenge of the dojo, which needs a single invalidation.
+    session = Session.object_session(target)
+    session.info.setdefault("completion_changes", {}).setdefault((func, repr(args)), (func, args))
+
+
+@event.listens_for(Solves, 'after_insert', propagate=True)
+def hook_solve_completion(mapper, connection, target):
+    queue_completion_change(target, record_solve, target.user_id, required_challenge_dojos(connection, target.challenge_id))
+
+
+@event.listens_for(Solves, 'after_delete', propagate=True)
+def hook_solve_deletion_completion(mapper, connection, target):
+    queue_completion_change(target, forget_user, target.user_id)
+
+
+@event.listens_for(DojoChallenges, 'after_insert', propagate=True)
+@event.listens_for(DojoChallenges, 'after_update', propagate=True)
+@event.listens_for(DojoChallenges, 'after_delete', propagate=True)
+def hook_dojo_challenge_completion(mapper, connection, target):
+    queue_completion_change(target, invalidate_dojo, target.dojo_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_completion_changes(session):
+    for func, args in session.info.pop("completion_changes", {}).values():
+        try:
+            func(*args)
+        except Exception as e:
+            logger.warning(f"Failed to update completion index ({func.__name__}{args}): {e}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_completion_changes(session, previous_transaction):
+    session.info.pop("completion_changes", None)
@@ -0,0 +1,178 @@
+import logging
+import time
+from typing import Dict, List, Optional
+
+import redis
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+QUEUE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Caches with one key per dojo (or a single global key) are reported per key; caches with one key per user or module
+# are reported per family, e.g. stats:activity:*, to keep the number of series bounded.
+PER_KEY_CACHE_PREFIXES = (
+    "stats:dojo:",
+    "stats:scoreboard:dojo:",
+    "stats:scores:dojo:",
+    "stats:belts",
+    "stats:emojis",
+    "stats:containers",
+)
+
+STAT_EVENTS = Counter("dojo_stat_events_total", "Stat events handled, by event type and outcome", ["type", "outcome"])
+STAT_EVENT_SECONDS = Histogram("dojo_stat_event_processing_seconds", "Time spent in the stat event handler per handler call", ["type"], buckets=LATENCY_BUCKETS)
+STAT_EVENT_QUEUE_SECONDS = Histogram("dojo_stat_event_queue_seconds", "Time from publishing a stat event to handling it", ["type"], buckets=QUEUE_BUCKETS)
+STAT_STALE_SKIPS = Counter("dojo_stat_stale_skips_total", "Stat events skipped because the cache was updated after them", ["cache"])
+AWARD_CACHE_DRIFT = Counter("dojo_award_cache_drift_total", "Full award recomputes that found the incrementally updated cache out of date", ["cache"])
+STAT_DEAD_LETTERS = Counter("dojo_stat_dead_letters_total", "Stat events moved to the dead-letter stream", ["stream"])
+
+IMAGE_PULLS = Counter("dojo_image_pulls_total", "Image pull events handled, by outcome", ["outcome"])
+IMAGE_PULL_SECONDS = Histogram("dojo_image_pull_seconds", "Time spent pulling an image", buckets=LATENCY_BUCKETS)
+IMAGE_PULL_QUEUE_SECONDS = Histogram("dojo_image_pull_queue_seconds", "Time from publishing an image pull to handling it", buckets=QUEUE_BUCKETS)
+
+START_JOBS = Counter("dojo_start_jobs_total", "Challenge start jobs handled by the start worker, by outcome", ["outcome"])
+START_JOB_SECONDS = Histogram("dojo_start_job_seconds", "Time spent running a challenge start job, including its retries", buckets=LATENCY_BUCKETS)
+START_JOB_QUEUE_SECONDS = Histogram("dojo_start_job_queue_seconds", "Time from queueing a challenge start job to a worker taking it", buckets=QUEUE_BUCKETS)
+
+WORKSPACE_POOL_IDLE = Gauge("dojo_workspace_pool_idle", "Idle workspaces in the pool after the last fill", ["pool"])
+
+_cache_updated_at: Dict[str, float] = {}
+
+
+def cache_metric_label(key: str) -> str:
+    if key.startswith(PER_KEY_CACHE_PREFIXES):
+        return key
+    return ":".join(key.split(":")[:3]) + ":*"
+
+
+def record_cache_update(key: str, updated_at: Optional[float] = None):
+    _cache_updated_at[cache_metric_label(key)] = updated_at or time.time()
+
+
+def record_stale_skip(key: str):
+    STAT_STALE_SKIPS.labels(cache_metric_label(key)).inc()
+
+
+def message_age_seconds(message_id: str, now: float) -> float:
+    return max(0.0, now - int(message_id.split("-")[0]) / 1000)
+
+
+class CacheAgeCollector:
+    """Age of the last successful write this process made to each cache."""
+
+    def collect(self):
+        ages = GaugeMetricFamily("dojo_stat_cache_age_seconds", "Seconds since this worker last updated the cache", labels=["cache"])
+        now = time.time()
+        for label, updated_at in list(_cache_updated_at.items()):
+            ages.add_metric([label], now - updated_at)
+        yield ages
+
+
+class L1CacheCollector:
+    """Lookups and downloaded bytes saved by the L1 stats cache of the web processes, which they count in Redis."""
+
+    def __init__(self, r: redis.Redis, counters_key: str):
+        self.r = r
+        self.counters_key = counters_key
+
+    def collect(self):
+        lookups = CounterMetricFamily("dojo_stat_l1_lookups", "Cached stat reads by the web processes, by whether the L1 cache had them", labels=["result"])
+        bytes_saved = CounterMetricFamily("dojo_stat_l1_bytes_saved", "Bytes of cached stats the L1 cache did not need to download")
+        try:
+            counters = self.r.hgetall(self.counters_key)
+        except (redis.RedisError, redis.ConnectionError) as e:
+            logger.error(f"Failed to collect L1 cache counters: {e}")
+            return
+        lookups.add_metric(["hit"], int(counters.get("hits", 0)))
+        lookups.add_metric(["miss"], int(counters.get("misses", 0)))
+        bytes_saved.add_metric([], int(counters.get("bytes_saved", 0)))
+        yield from (lookups, bytes_saved)
+
+
+class WorkspacePoolCollector:
+    """Claims from the workspace pool by the web processes, and expired pooled workspaces, which are counted in Redis."""
+
+    def __init__(self, r: redis.Redis, counters_key: str):
+        self.r = r
+        self.counters_key = counters_key
+
+    def collect(self):
+        claims = CounterMetricFamily("dojo_workspace_pool_claims", "Workspace starts that could use the pool, by whether it had an idle workspace", labels=["result"])
+        expired = CounterMetricFamily("dojo_workspace_pool_expired", "Idle pooled workspaces removed for exceeding their TTL")
+        try:
+            counters = self.r.hgetall(self.counters_key)
+        except (redis.RedisError, redis.ConnectionError) as e:
+            logger.error(f"Failed to collect workspace pool counters: {e}")
+            return
+        claims.add_metric(["hit"], int(counters.get("hit", 0)))
+        claims.add_metric(["miss"], int(counters.get("miss", 0)))
+        expired.add_metric([], int(counters.get("expired", 0)))
+        yield from (claims, expired)
+
+
+class StreamCollector:
+    """Length, pending entries and consumer lag of Redis streams, read from Redis on every scrape."""
+
+    def __init__(self, r: redis.Redis, group: str, stream_names: List[str], extra_streams: List[str] = (), counters_key: Optional[str] = None):
+        self.r = r
+        self.group = group
+        self.stream_names = list(stream_names)
+        self.extra_streams = list(extra_streams)
+        self.counters_key = counters_key
+
+    def collect(self):
+        length = GaugeMetricFamily("dojo_stream_length", "Entries in the stream", labels=["stream"])
+        pending = GaugeMetricFamily("dojo_stream_pending", "Entries delivered to the consumer group but not yet acknowledged", labels=["stream", "group"])
+        lag = GaugeMetricFamily("dojo_stream_lag", "Entries not yet delivered to the consumer group", labels=["stream", "group"])
+        lag_seconds = GaugeMetricFamily("dojo_stream_lag_seconds", "Age of the oldest entry not yet delivered to the consumer group", labels=["stream", "group"])
+        pending_seconds = GaugeMetricFamily("dojo_stream_oldest_pending_seconds", "Age of the oldest delivered but unacknowledged entry", labels=["stream", "group"])
+        up = GaugeMetricFamily("dojo_stream_metrics_up", "Whether stream metrics could be read from Redis")
+
+        try:
+            redis_time = self.r.time()
+            now = float(redis_time[0]) + float(redis_time[1]) / 1_000_000
+            for stream_name in self.stream_names + self.extra_streams:
+                length.add_metric([stream_name], self.r.xlen(stream_name))
+
+            for stream_name in self.stream_names:
+                group = next((group for group in self.r.xinfo_groups(stream_name) if group["name"] == self.group), None)
+                if group is None:
+                    continue
+                labels = [stream_name, self.group]
+                pending.add_metric(labels, group["pending"])
+                if group.get("lag") is not None:
+                    lag.add_metric(labels, group["lag"])
+
+                undelivered = self.r.xrange(stream_name, min=f"({group['last-delivered-id']}", max="+", count=1)
+                lag_seconds.add_metric(labels, message_age_seconds(undelivered[0][0], now) if undelivered else 0)
+
+                summary = self.r.xpending(stream_name, self.group)
+                oldest = summary.get("min") if summary and summary.get("pending") else None
+                pending_seconds.add_metric(labels, message_age_seconds(oldest, now) if oldest else 0)
+            up.add_metric([], 1)
+        except (redis.RedisError, redis.ConnectionError) as e:
+            logger.error(f"Failed to collect stream metrics: {e}")
+            up.add_metric([], 0)
+
+        yield from (length, pending, lag, lag_seconds, pending_seconds, up)
+
+        if self.counters_key:
+            collapsed = CounterMetricFamily("dojo_stat_events_collapsed", "Stat events merged into another event before handling, by where they were merged", labels=["source"])
+            try:
+                for field, value in self.r.hgetall(self.counters_key).items():
+                    source = field.partition("collapsed:")[2]
+                    if source:
+                        collapsed.add_metric([source], int(value))
+            except (redis.RedisError, redis.ConnectionError) as e:
+                logger.error(f"Failed to collect event counters: {e}")
+            yield collapsed
+
+
+def serve_metrics(port: int, *collectors):
+    for collector in collectors:
+        REGISTRY.register(collector)
+    start_http_server(port)
+    logger.info(f"Serving Prometheus metrics on port {port}")
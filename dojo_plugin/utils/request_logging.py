@@ -52,6 +52,11 @@ def get_tracked_attr(attr, default="NONE"):
 def get_trace_id():
     return get_tracked_attr("trace_id", default="NONE")
 
+def set_trace_id(trace_id, user_id=None):
+    """Tracks work done outside a request, such as a worker job, under the trace id of the request that queued it."""
+    _trace_id_storage.trace_id = trace_id
+    _trace_id_storage.user_id = user_id
+
 def get_user_id():
     try:
         user = get_current_user()
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+
+from .background_stats import get_redis_client, get_redis_time
+from .metrics import record_cache_update
+
+logger = logging.getLogger(__name__)
+
+# "json" caches each board as a single list; "zset" keeps a sorted set per board so that a solve is a single ZADD.
+SCOREBOARD_BACKEND = os.environ.get("STATS_SCOREBOARD_BACKEND", "json")
+SCOREBOARD_USERS_KEY = "stats:scoreboard:users"
+# Scores pack the solve count above a tie-break that favors the earlier last solve, matching calculate_scoreboard.
+# Both parts stay exact in a double for solve ids below 2**32 and solve counts below 2**20.
+TIE_BREAK_SPAN = 2 ** 32
+
+
+def zset_backend():
+    return SCOREBOARD_BACKEND == "zset"
+
+
+def ranking_key(cache_key):
+    return f"{cache_key}:ranking"
+
+
+def encode_score(solves, last_solve_id):
+    return solves * TIE_BREAK_SPAN + (TIE_BREAK_SPAN - 1 - last_solve_id)
+
+
+def decode_solves(score):
+    return int(score) // TIE_BREAK_SPAN
+
+
+def decode_last_solve_id(score):
+    return TIE_BREAK_SPAN - 1 - int(score) % TIE_BREAK_SPAN
+
+
+def user_data(entry):
+    return json.dumps({"name": entry["name"], "email": entry["email"]})
+
+
+def write_scoreboard(cache_key, scoreboard):
+    r = get_redis_client()
+    key = ranking_key(cache_key)
+    pipeline = r.pipeline()
+    pipeline.delete(key)
+    if scoreboard:
+        pipeline.zadd(key, {entry["user_id"]: encode_score(entry["solves"], entry["last_solve_id"]) for entry in scoreboard})
+        pipeline.hset(SCOREBOARD_USERS_KEY, mapping={entry["user_id"]: user_data(entry) for entry in scoreboard})
+    pipeline.set(f"{cache_key}:updated", str(get_redis_time(r)))
+    pipeline.execute()
+    record_cache_update(cache_key)
+
+
+def set_scoreboard_user(user_id, user):
+    get_redis_client().hset(SCOREBOARD_USERS_KEY, user_id, user_data(user))
+
+
+def get_scoreboard_user(user_id):
+    data = get_redis_client().hget(SCOREBOARD_USERS_KEY, user_id)
+    return json.loads(data) if data else None
+
+
+def add_scoreboard_solve(cache_key, user_id, user, last_solve_id, solve_delta=1):
+    r = get_redis_client()
+    key = ranking_key(cache_key)
+    score = r.zscore(key, user_id)
+    solves = (decode_solves(score) if score is not None else 0) + solve_delta
+    pipeline = r.pipeline()
+    pipeline.zadd(key, {user_id: encode_score(solves, last_solve_id)})
+    pipeline.hset(SCOREBOARD_USERS_KEY, user_id, user_data(user))
+    pipeline.set(f"{cache_key}:updated", str(get_redis_time(r)))
+    pipeline.zrevrank(key, user_id)
+    rank = pipeline.execute()[-1]
+    record_cache_update(cache_key)
+    return {"rank": rank + 1, "solves": solves, "user_id": user_id, "name": user["name"], "email": user["email"]}
+
+
+def ranked_entries(r, ranked, ranks):
+    users = r.hmget(SCOREBOARD_USERS_KEY, [user_id for user_id, _ in ranked]) if ranked else []
+    entries = []
+    for (user_id, score), rank, data in zip(ranked, ranks, users):
+        user = json.loads(data) if data else {"name": None, "email": ""}
+        entries.append({"rank": rank, "solves": decode_solves(score), "last_solve_id": decode_last_solve_id(score), "user_id": int(user_id), **user})
+    return entries
+
+
+def read_scoreboard_page(cache_key, start, count):
+    r = get_redis_client()
+    pipeline = r.pipeline(transaction=False)
+    pipeline.zrevrange(ranking_key(cache_key), start, start + count - 1, withscores=True)
+    pipeline.zcard(ranking_key(cache_key))
+    ranked, total = pipeline.execute()
+    return ranked_entries(r, ranked, range(start + 1, start + 1 + len(ranked))), total
+
+
+def read_scoreboard(cache_key):
+    # A count of 0 makes the stop index -1, which reads to the end of the board.
+    entries, _ = read_scoreboard_page(cache_key, 0, 0)
+    return entries
+
+
+def read_scoreboard_entries(cache_key, user_ids):
+    r = get_redis_client()
+    key = ranking_key(cache_key)
+    user_ids = list(user_ids)
+    pipeline = r.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.zrevrank(key, user_id)
+        pipeline.zscore(key, user_id)
+    results = pipeline.execute()
+    found = sorted(
+        (rank, user_id, score)
+        for user_id, rank, score in zip(user_ids, results[::2], results[1::2])
+        if rank is not None
+    )
+    return ranked_entries(r, [(user_id, score) for _, user_id, score in found], [rank + 1 for rank, _, _ in found])
+
+
+def read_scoreboard_entry(cache_key, user_id):
+    entries = read_scoreboard_entries(cache_key, [user_id])
+    return entries[0] if entries else None
+
+
+def scoreboard_size(cache_key):
+    return get_redis_client().zcard(ranking_key(cache_key))
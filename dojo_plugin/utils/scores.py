@@ -1,4 +1,23 @@
-from .background_stats import get_cached_stat
+import functools
+
+from .background_stats import get_cached_stat, get_redis_client, get_redis_binary_client
+from .cache_codec import decode_stat
+from .scoreboard_store import encode_score, decode_solves, TIE_BREAK_SPAN
+
+# Solve counts over the distinct visible challenges of all official dojos, as reported by /api/v1/score.
+OFFICIAL_SCORES_KEY = "stats:scores:official"
+
+# Applied as one script so that workers on different shards can add solves of the same user to a shared ranking.
+RANK_INDEX_SOLVE_SCRIPT = """
+local span = tonumber(ARGV[2])
+local score = redis.call("ZSCORE", KEYS[1], ARGV[1])
+local solves = 1
+if score then
+    solves = math.floor(tonumber(score) / span) + 1
+end
+redis.call("ZADD", KEYS[1], solves * span + (span - 1 - tonumber(ARGV[3])), ARGV[1])
+return solves
+"""
 
 
 def dojo_scores_cache_key(dojo_id):
@@ -9,6 +28,83 @@ def module_scores_cache_key(dojo_id, module_index):
     return f"stats:scores:module:{dojo_id}:{module_index}"
 
 
+def rank_index_key(scores_cache_key):
+    # Each scores cache has a sorted set alongside it that answers rank lookups without reading the whole ranking.
+    return scores_cache_key.replace("stats:scores:", "stats:ranks:", 1)
+
+
+def write_rank_index(key, entries):
+    r = get_redis_client()
+    pipeline = r.pipeline()
+    pipeline.delete(key)
+    if entries:
+        pipeline.zadd(key, {user_id: encode_score(solves, last_solve_id) for user_id, solves, last_solve_id in entries})
+    pipeline.execute()
+
+
+@functools.lru_cache(maxsize=None)
+def rank_index_solve_script(r):
+    return r.register_script(RANK_INDEX_SOLVE_SCRIPT)
+
+
+def add_rank_index_solve(key, user_id, solve_id):
+    return rank_index_solve_script(get_redis_client())(keys=[key], args=[user_id, TIE_BREAK_SPAN, solve_id])
+
+
+def get_rank_and_solves(keys, user_id):
+    """Returns {key: (rank, solves, ranked_users)} for every key, with rank and solves None if the user is unranked."""
+    keys = list(keys)
+    pipeline = get_redis_client().pipeline(transaction=False)
+    for key in keys:
+        pipeline.zrevrank(key, user_id)
+        pipeline.zscore(key, user_id)
+        pipeline.zcard(key)
+    results = pipeline.execute()
+    return {
+        key: (rank + 1 if rank is not None else None, decode_solves(score) if score is not None else None, total)
+        for key, rank, score, total in zip(keys, results[::3], results[1::3], results[2::3])
+    }
+
+
+def get_official_score(user_id):
+    """
+    Returns (rank, solves, max_score, ranked_users, updated_at) from the official ranking, with rank and solves None if
+    the user is unranked, or None if the ranking has not been built yet.
+    """
+    key = rank_index_key(OFFICIAL_SCORES_KEY)
+    pipeline = get_redis_binary_client().pipeline(transaction=False)
+    pipeline.get(OFFICIAL_SCORES_KEY)
+    pipeline.get(f"{OFFICIAL_SCORES_KEY}:updated")
+    pipeline.zrevrank(key, user_id)
+    pipeline.zscore(key, user_id)
+    pipeline.zcard(key)
+    official, updated_at, rank, score, total = pipeline.execute()
+    if not official or not updated_at:
+        return None
+    return (
+        rank + 1 if rank is not None else None,
+        decode_solves(score) if score is not None else None,
+        decode_stat(official)["max_score"],
+        total,
+        float(updated_at),
+    )
+
+
+def get_top_ranked(key, count):
+    ranked = get_redis_client().zrevrange(key, 0, count - 1, withscores=True)
+    return [{"rank": rank, "user_id": int(user_id), "solves": decode_solves(score)} for rank, (user_id, score) in enumerate(ranked, 1)]
+
+
+def get_ranked_around(key, user_id, radius):
+    r = get_redis_client()
+    rank = r.zrevrank(key, user_id)
+    if rank is None:
+        return []
+    start = max(0, rank - radius)
+    ranked = r.zrevrange(key, start, rank + radius, withscores=True)
+    return [{"rank": rank, "user_id": int(user_id), "solves": decode_solves(score)} for rank, (user_id, score) in enumerate(ranked, start + 1)]
+
+
 def get_dojo_scores(dojo_id):
     cached = get_cached_stat(dojo_scores_cache_key(dojo_id))
     if cached:
@@ -24,30 +120,24 @@ def get_module_scores(dojo_id, module_index):
 
 
 def get_user_dojo_rank(dojo_id, user_id):
-    scores = get_dojo_scores(dojo_id)
-    ranks = scores.get("ranks", [])
-    try:
-        return ranks.index(user_id) + 1
-    except ValueError:
-        return None
+    key = rank_index_key(dojo_scores_cache_key(dojo_id))
+    rank, _, _ = get_rank_and_solves([key], user_id)[key]
+    return rank
 
 
 def get_user_module_rank(dojo_id, module_index, user_id):
-    scores = get_module_scores(dojo_id, module_index)
-    ranks = scores.get("ranks", [])
-    try:
-        return ranks.index(user_id) + 1
-    except ValueError:
-        return None
+    key = rank_index_key(module_scores_cache_key(dojo_id, module_index))
+    rank, _, _ = get_rank_and_solves([key], user_id)[key]
+    return rank
 
 
 def get_user_dojo_solves(dojo_id, user_id):
-    scores = get_dojo_scores(dojo_id)
-    solves = scores.get("solves", {})
-    return solves.get(str(user_id)) or solves.get(user_id) or 0
+    key = rank_index_key(dojo_scores_cache_key(dojo_id))
+    _, solves, _ = get_rank_and_solves([key], user_id)[key]
+    return solves or 0
 
 
 def get_user_module_solves(dojo_id, module_index, user_id):
-    scores = get_module_scores(dojo_id, module_index)
-    solves = scores.get("solves", {})
-    return solves.get(str(user_id)) or solves.get(user_id) or 0
+    key = rank_index_key(module_scores_cache_key(dojo_id, module_index))
+    _, solves, _ = get_rank_and_solves([key], user_id)[key]
+    return solves or 0
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+import redis
+
+from .background_stats import get_redis_client, get_message_timestamp
+from .metrics import START_JOBS, START_JOB_QUEUE_SECONDS, START_JOB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Challenge starts requested with "async" are queued here and run by the start worker, so that a burst of starts does
+# not hold the web workers; the client follows the job's phases at /docker/jobs/<id> or its stream.
+START_JOB_STREAM_NAME = "docker:start:jobs"
+CONSUMER_GROUP = "start-workers"
+START_JOB_PREFIX = "docker:start:job:"
+START_JOB_USER_PREFIX = "docker:start:user:"
+START_JOB_CHANNEL_PREFIX = "docker:start:updates:"
+START_JOB_TTL = 60 * 60
+# Jobs that wait longer than this for a worker fail instead of starting a challenge the user has given up on.
+START_JOB_QUEUE_TIMEOUT = int(os.environ.get("START_JOB_QUEUE_TIMEOUT", "120"))
+START_WORKER_CONCURRENCY = int(os.environ.get("START_WORKER_CONCURRENCY", "8"))
+# Longer than any start, so that only jobs of a worker that died are claimed by another.
+PENDING_IDLE_MS = 600_000
+# A running job's worker refreshes its heartbeat while it runs; a job whose heartbeat expired lost its worker.
+START_JOB_HEARTBEAT_SECONDS = 10
+START_JOB_STALE_SECONDS = 30
+
+START_PHASES = {
+    "queued": "Waiting for a start worker...",
+    "stopping": "Stopping the previous container...",
+    "creating": "Creating the workspace...",
+    "initializing": "Initializing the workspace...",
+    "inserting": "Copying the challenge...",
+    "readying": "Waiting for the workspace to be ready...",
+    "retrying": "Retrying...",
+    "done": "Challenge started!",
+    "failed": "Failed to start challenge.",
+}
+FINISHED_STATUSES = ("succeeded", "failed")
+
+_running_jobs = set()
+_running_jobs_lock = threading.Lock()
+
+
+def start_job_key(job_id: str) -> str:
+    return f"{START_JOB_PREFIX}{job_id}"
+
+
+def start_job_channel(job_id: str) -> str:
+    return f"{START_JOB_CHANNEL_PREFIX}{job_id}"
+
+
+def start_job_heartbeat_key(job_id: str) -> str:
+    return f"{START_JOB_PREFIX}{job_id}:heartbeat"
+
+
+def get_start_job(job_id: str, r: Optional[redis.Redis] = None) -> Optional[Dict[str, Any]]:
+    r = r or get_redis_client()
+    raw = r.get(start_job_key(job_id))
+    if not raw:
+        return None
+    job = json.loads(raw)
+    if job["status"] == "queued" and time.time() - job["created_at"] > START_JOB_QUEUE_TIMEOUT + 30:
+        # No worker took it; the worker fails such jobs itself when it gets to them.
+        job.update(status="failed", phase="failed", message=START_PHASES["failed"], error="Timed out waiting to start the challenge")
+    elif job["status"] == "running" and not r.exists(start_job_heartbeat_key(job_id)):
+        # Its worker died or was restarted mid-start; another worker acknowledges the job when it claims it.
+        job.update(status="failed", phase="failed", message=START_PHASES["failed"], error="The challenge start was interrupted; try again")
+    return job
+
+
+def active_start_job(user_id: int, r: Optional[redis.Redis] = None) -> Optional[Dict[str, Any]]:
+    r = r or get_redis_client()
+    try:
+        job_id = r.get(f"{START_JOB_USER_PREFIX}{user_id}")
+        job = get_start_job(job_id, r) if job_id else None
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.error(f"Failed to read the start job of user {user_id}: {e}")
+        return None
+    return job if job and job["status"] not in FINISHED_STATUSES else None
+
+
+def publish_start_job(user_id: int, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    now = time.time()
+    job = {
+        "id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "status": "queued",
+        "phase": "queued",
+        "message": START_PHASES["queued"],
+        "attempt": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    try:
+        r = get_redis_client()
+        pipeline = r.pipeline()
+        pipeline.set(start_job_key(job["id"]), json.dumps(job), ex=START_JOB_TTL)
+        pipeline.set(f"{START_JOB_USER_PREFIX}{user_id}", job["id"], ex=START_JOB_TTL)
+        pipeline.xadd(START_JOB_STREAM_NAME, {"data": json.dumps({**request, "job_id": job["id"], "user_id": user_id})})
+        pipeline.execute()
+        logger.info(f"Published start job {job['id']} for user {user_id}")
+        return job
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.error(f"Failed to publish start job for user {user_id}: {e}")
+        return None
+
+
+def update_start_job(job_id: str, r: Optional[redis.Redis] = None, **fields) -> Optional[Dict[str, Any]]:
+    """Updates the job's state (only its start worker writes it) and notifies anyone streaming it."""
+    r = r or get_redis_client()
+    raw = r.get(start_job_key(job_id))
+    if not raw:
+        return None
+    job = json.loads(raw)
+    if "phase" in fields:
+        fields.setdefault("message", START_PHASES.get(fields["phase"], fields["phase"]))
+    job.update(fields, updated_at=time.time())
+    r.set(start_job_key(job_id), json.dumps(job), ex=START_JOB_TTL)
+    r.publish(start_job_channel(job_id), json.dumps(job))
+    if job["status"] in FINISHED_STATUSES:
+        user_key = f"{START_JOB_USER_PREFIX}{job['user_id']}"
+        if r.get(user_key) == job_id:
+            r.delete(user_key)
+    return job
+
+
+def fail_running_start_jobs(error: str) -> None:
+    """Fails the jobs this process is running, for a worker that is shutting down."""
+    with _running_jobs_lock:
+        job_ids = list(_running_jobs)
+    for job_id in job_ids:
+        try:
+            update_start_job(job_id, status="failed", phase="failed", error=error)
+        except (redis.RedisError, redis.ConnectionError) as e:
+            logger.error(f"Failed to fail start job {job_id}: {e}")
+
+
+def consume_start_jobs(handler: Callable[[Dict[str, Any]], bool], consumer_name: str, block_ms: int = 5000) -> None:
+    """Runs queued start jobs one at a time; the start worker runs START_WORKER_CONCURRENCY of these in threads."""
+    r = get_redis_client()
+
+    def ensure_consumer_group():
+        try:
+            r.xgroup_create(START_JOB_STREAM_NAME, CONSUMER_GROUP, id="0", mkstream=True)
+            logger.info(f"Created consumer group {CONSUMER_GROUP} for stream {START_JOB_STREAM_NAME}")
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    ensure_consumer_group()
+    logger.info(f"Start worker {consumer_name} waiting for jobs...")
+
+    def process_message(message_id, message_data):
+        try:
+            request = json.loads(message_data["data"])
+            job_id = request["job_id"]
+        except Exception as e:
+            logger.error(f"Invalid start job {message_id}: {e}", exc_info=True)
+            START_JOBS.labels("invalid").inc()
+            r.xackdel(START_JOB_STREAM_NAME, CONSUMER_GROUP, message_id)
+            return
+
+        job = get_start_job(job_id, r)
+        queue_seconds = max(0.0, time.time() - get_message_timestamp(message_id))
+        if not job or job["status"] in FINISHED_STATUSES:
+            # Claimed from a worker that finished it but died before acknowledging, or expired from Redis.
+            r.xackdel(START_JOB_STREAM_NAME, CONSUMER_GROUP, message_id)
+            return
+        if queue_seconds > START_JOB_QUEUE_TIMEOUT:
+            logger.warning(f"Start job {job_id} waited {queue_seconds:.1f}s for a worker, failing it")
+            update_start_job(job_id, r, status="failed", phase="failed", error="Timed out waiting to start the challenge")
+            START_JOBS.labels("expired").inc()
+            r.xackdel(START_JOB_STREAM_NAME, CONSUMER_GROUP, message_id)
+            return
+
+        START_JOB_QUEUE_SECONDS.observe(queue_seconds)
+        heartbeat_key = start_job_heartbeat_key(job_id)
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(START_JOB_HEARTBEAT_SECONDS):
+                try:
+                    r.set(heartbeat_key, consumer_name, ex=START_JOB_STALE_SECONDS)
+                except (redis.RedisError, redis.ConnectionError) as e:
+                    logger.warning(f"Failed to refresh the heartbeat of start job {job_id}: {e}")
+
+        r.set(heartbeat_key, consumer_name, ex=START_JOB_STALE_SECONDS)
+        threading.Thread(target=heartbeat, name=f"{consumer_name}-heartbeat", daemon=True).start()
+        with _running_jobs_lock:
+            _running_jobs.add(job_id)
+        update_start_job(job_id, r, status="running")
+        try:
+            with START_JOB_SECONDS.time():
+                success = handler(request)
+        except Exception as e:
+            logger.error(f"Error handling start job {job_id}: {e}", exc_info=True)
+            update_start_job(job_id, r, status="failed", phase="failed", error="Docker failed")
+            success = False
+        finally:
+            finished.set()
+            with _running_jobs_lock:
+                _running_jobs.discard(job_id)
+            r.delete(heartbeat_key)
+        START_JOBS.labels("success" if success else "failure").inc()
+        r.xackdel(START_JOB_STREAM_NAME, CONSUMER_GROUP, message_id)
+
+    while True:
+        try:
+            try:
+                result = r.xautoclaim(
+                    START_JOB_STREAM_NAME,
+                    CONSUMER_GROUP,
+                    consumer_name,
+                    min_idle_time=PENDING_IDLE_MS,
+                    start_id="0-0",
+                    count=1,
+                )
+                claimed = result[1] if isinstance(result, (list, tuple)) and len(result) >= 2 else []
+                for message_id, message_data in claimed:
+                    process_message(message_id, message_data)
+            except Exception as e:
+                logger.error(f"Error autoclaiming start jobs: {e}", exc_info=True)
+                time.sleep(1)
+
+            messages = r.xreadgroup(
+                CONSUMER_GROUP,
+                consumer_name,
+                {START_JOB_STREAM_NAME: ">"},
+                count=1,
+                block=block_ms,
+            )
+            for _, stream_messages in messages or []:
+                for message_id, message_data in stream_messages:
+                    process_message(message_id, message_data)
+        except redis.ResponseError as e:
+            if "NOGROUP" in str(e):
+                logger.warning("Start job consumer group missing, recreating...")
+                ensure_consumer_group()
+            else:
+                logger.error(f"Redis error in start worker: {e}")
+                time.sleep(1)
+        except redis.ConnectionError as e:
+            logger.error(f"Redis connection error in start worker: {e}")
+            time.sleep(1)
@@ -1,11 +1,16 @@
 from CTFd.models import Solves
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, or_
 
 from . import get_all_containers, DojoChallenges
 from .background_stats import get_cached_stat
 
 CACHE_KEY_CONTAINERS = "stats:containers"
+# The chart shows these days, counted back from today (UTC). Stats keep daily counts for the whole window, so the chart
+# rolls over to a new day without going back to the database.
+DOJO_STATS_CHART_DAYS = [0, 7, 30, 60]
+DOJO_STATS_CHART_LABELS = ['Today', '1w ago', '1mo ago', '2mo ago']
+DOJO_STATS_RECENT_SOLVES = 5
 
 def calculate_container_stats():
     containers = get_all_containers()
@@ -19,98 +24,139 @@ def get_container_stats():
         return cached
     return []
 
-def calculate_dojo_stats(dojo):
-    now = datetime.now()
-    solves_query = dojo.solves()
 
-    total_challenges = len(dojo.challenges)
-    visible_challenges = sum(1 for c in dojo.challenges if c.visible())
+def utc_today():
+    return datetime.utcnow().date()
 
-    total_stats = solves_query.with_entities(
-        func.count(Solves.id).label('total_solves'),
-        func.count(func.distinct(Solves.user_id)).label('total_users')
-    ).first()
 
-    total_solves = total_stats.total_solves or 0
-    total_users = total_stats.total_users or 0
+def trend_calc(current, previous):
+    if previous == 0:
+        return 100 if current > 0 else 0
+    change = ((current - previous) / previous) * 100
+    return max(-99, min(999, round(change)))
 
-    snapshot_days = [1, 7, 30, 60]
-    chart_labels = ['Today', '1w ago', '1mo ago', '2mo ago']
-    chart_solves = []
-    chart_users = []
 
-    for days_ago in snapshot_days:
-        snapshot_date = now - timedelta(days=days_ago)
-        day_start = snapshot_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
+def recent_solve(challenge_name, date):
+    return {
+        'challenge_name': f'{challenge_name}',
+        'date': date.isoformat() if date else None,
+        'date_display': date.strftime('%m/%d/%y %I:%M %p') if date else 'Unknown time'
+    }
 
-        day_stats = solves_query.filter(
-            Solves.date >= day_start,
-            Solves.date < day_end
-        ).with_entities(
-            func.count(Solves.id).label('day_solves'),
-            func.count(func.distinct(Solves.user_id)).label('day_users')
-        ).first()
 
-        chart_solves.append(day_stats.day_solves or 0)
-        chart_users.append(day_stats.day_users or 0)
+def chart_window_start(today):
+    return today - timedelta(days=max(DOJO_STATS_CHART_DAYS))
 
-    basic_query = (
+
+def roll_dojo_stats(stats, today=None):
+    """Drops daily counts that left the chart window and recomputes the chart and trends for `today`."""
+    today = today or utc_today()
+    oldest_day = chart_window_start(today).isoformat()
+    daily = {day: counts for day, counts in stats.get('daily', {}).items() if day >= oldest_day}
+    chart_days = [(today - timedelta(days=days_ago)).isoformat() for days_ago in DOJO_STATS_CHART_DAYS]
+    chart_solves = [daily.get(day, [0, 0])[0] for day in chart_days]
+    chart_users = [daily.get(day, [0, 0])[1] for day in chart_days]
+    return {
+        **stats,
+        'day': today.isoformat(),
+        'daily': daily,
+        'trends': {
+            'solves': trend_calc(chart_solves[0], chart_solves[1]),
+            'users': trend_calc(chart_users[0], chart_users[1]),
+            'active': 0,
+            'challenges': 0,
+        },
+        'chart_data': {
+            'labels': DOJO_STATS_CHART_LABELS,
+            'solves': chart_solves,
+            'users': chart_users
+        }
+    }
+
+
+def calculate_dojo_stats(dojo, today=None):
+    today = today or utc_today()
+    window_start = datetime.combine(chart_window_start(today), datetime.min.time())
+    solves_query = dojo.solves()
+
+    # ROLLUP(day) adds the grand total row to the per-day rows, so distinct users are counted both per day and overall
+    # in one pass; days before the chart window are only aggregated into the total.
+    day = func.date_trunc('day', Solves.date)
+    rows = (
+        solves_query
+        .with_entities(
+            func.grouping(day).label('is_total'),
+            day.label('day'),
+            func.count(Solves.id).label('solves'),
+            func.count(func.distinct(Solves.user_id)).label('users')
+        )
+        .group_by(func.rollup(day))
+        .having(or_(func.grouping(day) == 1, day >= window_start))
+        .all()
+    )
+
+    total_solves = total_users = 0
+    daily = {}
+    for row in rows:
+        if row.is_total:
+            total_solves, total_users = row.solves, row.users
+        elif row.day is not None:
+            daily[row.day.date().isoformat()] = [row.solves, row.users]
+
+    recent = (
         solves_query
         .with_entities(
             Solves.date.label('date'),
             DojoChallenges.name.label('challenge_name')
         )
-        .filter(Solves.date >= now - timedelta(days=7))
+        .filter(Solves.date >= datetime.utcnow() - timedelta(days=7))
         .order_by(desc(Solves.date))
-        .limit(5)
+        .limit(DOJO_STATS_RECENT_SOLVES)
         .all()
     )
 
-    recent_solves = [
-        {
-            'challenge_name': f'{solve.challenge_name}',
-            'date': solve.date,
-            'date_display': solve.date.strftime('%m/%d/%y %I:%M %p') if solve.date else 'Unknown time'
-        }
-        for solve in basic_query
-    ]
-
-    def trend_calc(current, previous):
-        if previous == 0:
-            return 100 if current > 0 else 0
-        change = ((current - previous) / previous) * 100
-        return max(-99, min(999, round(change)))
-
-    trends = {
-        'solves': trend_calc(chart_solves[0], chart_solves[1]),
-        'users': trend_calc(chart_users[0], chart_users[1]),
-        'active': 0,
-        'challenges': 0,
-    }
-
-    return {
+    return roll_dojo_stats({
         'users': total_users,
-        'challenges': total_challenges,
-        'visible_challenges': visible_challenges,
+        'challenges': len(dojo.challenges),
+        'visible_challenges': sum(1 for c in dojo.challenges if c.visible()),
         'solves': total_solves,
-        'recent_solves': recent_solves,
-        'trends': trends,
-        'chart_data': {
-            'labels': chart_labels,
-            'solves': chart_solves,
-            'users': chart_users
-        }
-    }
+        'recent_solves': [recent_solve(solve.challenge_name, solve.date) for solve in recent],
+        'daily': daily,
+    }, today)
+
+
+def update_dojo_stats(stats, challenge_name, solve_date=None, new_user=False, new_day_user=False):
+    """
+    Applies one solve to cached dojo stats. `new_user` and `new_day_user` say whether it is the solver's first counted
+    solve in the dojo, and on the solve's day.
+    """
+    solve_date = solve_date or datetime.utcnow()
+    today = max(utc_today(), solve_date.date())
+    daily = dict(stats.get('daily', {}))
+    if solve_date.date() >= chart_window_start(today):
+        solves, users = daily.get(solve_date.date().isoformat(), [0, 0])
+        daily[solve_date.date().isoformat()] = [solves + 1, users + int(new_day_user)]
+
+    return roll_dojo_stats({
+        **stats,
+        'solves': stats.get('solves', 0) + 1,
+        'users': stats.get('users', 0) + int(new_user),
+        'recent_solves': [recent_solve(challenge_name, solve_date), *stats.get('recent_solves', [])][:DOJO_STATS_RECENT_SOLVES],
+        'daily': daily,
+    }, today)
+
 
 def get_dojo_stats(dojo):
     cache_key = f"stats:dojo:{dojo.reference_id}"
     cached = get_cached_stat(cache_key)
     if cached:
-        for solve in cached.get('recent_solves', []):
-            if solve.get('date') and isinstance(solve['date'], str):
-                solve['date'] = datetime.fromisoformat(solve['date'])
-        return cached
+        # The cached stats may be shared with other requests, so the page gets its own copy.
+        stats = roll_dojo_stats(cached) if 'daily' in cached else dict(cached)
+        stats['recent_solves'] = [
+            {**solve, 'date': datetime.fromisoformat(solve['date']) if isinstance(solve.get('date'), str) else solve.get('date')}
+            for solve in cached.get('recent_solves', [])
+        ]
+        return stats
 
     return {
         'users': 0,
@@ -0,0 +1,248 @@
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+
+import docker.errors
+import docker.types
+import redis
+
+from .background_stats import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Idle workspaces kept running per (node, image, privileged) pool; 0 disables the pool. Pools are only filled for keys
+# that were asked for in the last WORKSPACE_POOL_DEMAND_SECONDS, so unused images do not hold containers.
+WORKSPACE_POOL_SIZE = int(os.environ.get("WORKSPACE_POOL_SIZE", "0"))
+WORKSPACE_POOL_TTL = int(os.environ.get("WORKSPACE_POOL_TTL", "3600"))
+WORKSPACE_POOL_DEMAND_SECONDS = int(os.environ.get("WORKSPACE_POOL_DEMAND_SECONDS", "86400"))
+WORKSPACE_POOL_INTERVAL = int(os.environ.get("WORKSPACE_POOL_INTERVAL", "10"))
+# How often the homes of pooled workspaces that are gone, including claimed ones that exited, are unmounted.
+WORKSPACE_POOL_SWEEP_SECONDS = int(os.environ.get("WORKSPACE_POOL_SWEEP_SECONDS", "300"))
+
+POOL_LABEL = "dojo.pool"
+POOL_CREATED_LABEL = "dojo.pool_created"
+POOL_HOME_LABEL = "dojo.pool_home"
+POOL_NAME_PREFIX = "pool_"
+POOL_HOSTNAME = "workspace"
+POOL_DEMAND_KEY = "workspace:pool:demand"
+POOL_COUNTERS_KEY = "workspace:pool:counters"
+POOL_CLAIM_PREFIX = "workspace:pool:claim:"
+# Claimed workspaces run for at most 6 hours; their labels are kept a little longer.
+POOL_CLAIM_SECONDS = 7 * 60 * 60
+# Each pooled workspace's /home/hacker is a slave of its own directory here, on a shared mount of the node. Claiming
+# the workspace binds the user's home onto that directory, which propagates into the running workspace.
+POOL_HOMES_PATH = "/run/dojo/pool"
+POOL_HELPER_IMAGE = "busybox:uclibc"
+
+
+def pool_key(node_id, image, privileged):
+    return f"{node_id}:{'privileged' if privileged else 'standard'}:{image}"
+
+
+def parse_pool_key(key):
+    node_id, mode, image = key.split(":", 2)
+    return int(node_id), image, mode == "privileged"
+
+
+def count_pool(result, r=None):
+    r = r or get_redis_client()
+    try:
+        r.hincrby(POOL_COUNTERS_KEY, result, 1)
+    except (redis.RedisError, redis.ConnectionError) as e:
+        logger.warning(f"Failed to count workspace pool {result}: {e}")
+
+
+def record_pool_demand(key, r=None, now=None):
+    r = r or get_redis_client()
+    r.zadd(POOL_DEMAND_KEY, {key: now or time.time()})
+
+
+def demanded_pool_keys(r=None, now=None):
+    r = r or get_redis_client()
+    r.zremrangebyscore(POOL_DEMAND_KEY, "-inf", (now or time.time()) - WORKSPACE_POOL_DEMAND_SECONDS)
+    return r.zrange(POOL_DEMAND_KEY, 0, -1)
+
+
+def pool_container_age(container, now=None):
+    return (now or time.time()) - int(container.labels.get(POOL_CREATED_LABEL, 0))
+
+
+def idle_pool_containers(docker_client, key=None):
+    # Claimed workspaces are renamed to their user's container name, so only unclaimed ones still have a pool name.
+    label = f"{POOL_LABEL}={key}" if key else POOL_LABEL
+    containers = docker_client.containers.list(filters={"label": label}, ignore_removed=True)
+    return sorted(
+        (container for container in containers if container.name.startswith(POOL_NAME_PREFIX)),
+        key=lambda container: int(container.labels.get(POOL_CREATED_LABEL, 0)),
+    )
+
+
+def pool_home_path(name):
+    return f"{POOL_HOMES_PATH}/{name}"
+
+
+def pool_serves_home(key):
+    # Privileged workspaces run in a VM, which mounts made on the node after it starts do not reach.
+    return not parse_pool_key(key)[2]
+
+
+def run_pool_helper(docker_client, command, mounts):
+    """Runs command in a privileged helper container on the node, for mounts the workspaces cannot make themselves."""
+    container = docker_client.containers.run(POOL_HELPER_IMAGE, command, mounts=mounts, privileged=True, detach=True)
+    try:
+        status = container.wait()
+    finally:
+        container.remove(force=True)
+    if status["StatusCode"] != 0:
+        raise RuntimeError(f"Workspace pool helper {command[0]} exited with status {status['StatusCode']}")
+
+
+def pool_container_attributes(attributes, key, now=None):
+    """Turns the create attributes of a user's workspace into those of an idle workspace in the pool for key."""
+    name = f"{POOL_NAME_PREFIX}{uuid.uuid4().hex}"
+    environment = {name: value for name, value in attributes["environment"].items() if name != "DOJO_AUTH_TOKEN"}
+    labels = {POOL_LABEL: key, POOL_CREATED_LABEL: str(int(now or time.time()))}
+    mounts = list(attributes["mounts"])
+    if pool_serves_home(key):
+        labels[POOL_HOME_LABEL] = name
+        mounts.append(docker.types.Mount("/home/hacker", pool_home_path(name), "bind", propagation="rslave"))
+    return {
+        **attributes,
+        "name": name,
+        "hostname": POOL_HOSTNAME,
+        "environment": {**environment, "DOJO_INIT_POOLED": "1"},
+        "labels": labels,
+        "mounts": mounts,
+        "network": None,
+    }
+
+
+def expire_pool(docker_client, r=None, now=None):
+    """Removes idle workspaces older than WORKSPACE_POOL_TTL from every pool on the node."""
+    r = r or get_redis_client()
+    expired = 0
+    for container in idle_pool_containers(docker_client):
+        if pool_container_age(container, now) < WORKSPACE_POOL_TTL:
+            continue
+        # Taking the claim first keeps a start from claiming the workspace while it is removed.
+        if not r.set(f"{POOL_CLAIM_PREFIX}{container.id}", "{}", nx=True, ex=WORKSPACE_POOL_TTL):
+            continue
+        logger.info(f"Removing expired pooled workspace {container.name} ({container.labels.get(POOL_LABEL)})")
+        count_pool("expired", r)
+        expired += 1
+        try:
+            container.remove(force=True)
+        except (docker.errors.NotFound, docker.errors.APIError):
+            pass
+    return expired
+
+
+def fill_pool(docker_client, key, create_attributes, now=None):
+    """Starts idle workspaces for key until its pool has WORKSPACE_POOL_SIZE; returns how many are idle."""
+    idle = [container for container in idle_pool_containers(docker_client, key) if pool_container_age(container, now) < WORKSPACE_POOL_TTL]
+    missing = [pool_container_attributes(create_attributes, key, now) for _ in range(WORKSPACE_POOL_SIZE - len(idle))]
+    if missing and pool_serves_home(key):
+        homes = [pool_home_path(attributes["name"]) for attributes in missing]
+        run_pool_helper(docker_client, ["mkdir", "-p", *homes], [docker.types.Mount("/run/dojo", "/run/dojo", "bind")])
+    for attributes in missing:
+        container = docker_client.containers.create(**attributes)
+        container.start()
+    return max(len(idle), WORKSPACE_POOL_SIZE)
+
+
+def sweep_pool_homes(docker_client):
+    """Unmounts and removes the home directories of pooled workspaces that no longer exist on the node."""
+    containers = docker_client.containers.list(all=True, filters={"label": POOL_LABEL}, ignore_removed=True)
+    live = [container.labels[POOL_HOME_LABEL] for container in containers if POOL_HOME_LABEL in container.labels]
+    script = (
+        'for path in "$0"/*; do '
+        '[ -d "$path" ] || continue; '
+        'case " $* " in *" ${path##*/} "*) continue;; esac; '
+        'while umount -l "$path" 2>/dev/null; do :; done; rmdir "$path" || exit 1; '
+        'done'
+    )
+    # The unmounts are made on a shared mount, so that they propagate back to the node.
+    run_pool_helper(
+        docker_client,
+        ["sh", "-c", script, POOL_HOMES_PATH, *live],
+        [docker.types.Mount("/run/dojo", "/run/dojo", "bind", propagation="rshared")],
+    )
+
+
+def mount_pool_home(docker_client, container, home):
+    """Binds the volume of the user's home mount onto the /home/hacker of a pooled workspace."""
+    run_pool_helper(
+        docker_client,
+        ["mount", "--bind", "/mnt/home", "/mnt/pool"],
+        [
+            {**home, "Target": "/mnt/home"},
+            docker.types.Mount("/mnt/pool", pool_home_path(container.labels[POOL_HOME_LABEL]), "bind", propagation="rshared"),
+        ],
+    )
+
+
+def docker_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def claimed_pool_container(container, claim):
+    container.attrs["Config"]["Labels"] = {**container.labels, **claim["labels"]}
+    # The workspace's session starts at its claim, not when the pool started it.
+    container.attrs["Created"] = docker_timestamp(claim["claimed_at"])
+    return container
+
+
+def read_pool_claim(container_id, r=None):
+    """The labels and claim time of a claimed pooled workspace, or None if it is idle or being removed."""
+    r = r or get_redis_client()
+    claimed = r.get(f"{POOL_CLAIM_PREFIX}{container_id}")
+    claim = json.loads(claimed) if claimed else None
+    return claim if claim and "labels" in claim else None
+
+
+def claim_pool_container(docker_client, key, *, name, labels, home=None, r=None, now=None):
+    """Claims an idle workspace from the pool for key, renaming it to name; returns None if the pool is empty.
+
+    home is the user's /home/hacker mount, if any, which is bound into the workspace before it is returned; only
+    pools that pool_serves_home can be given one. A claimed workspace keeps its pool labels, which Docker cannot
+    change; labels are recorded in Redis instead and read back by with_claimed_labels.
+    """
+    r = r or get_redis_client()
+    record_pool_demand(key, r, now)
+    claim = {"labels": labels, "claimed_at": now or time.time()}
+    for container in idle_pool_containers(docker_client, key):
+        if pool_container_age(container, now) >= WORKSPACE_POOL_TTL:
+            continue
+        if not r.set(f"{POOL_CLAIM_PREFIX}{container.id}", json.dumps(claim), nx=True, ex=POOL_CLAIM_SECONDS):
+            continue
+        try:
+            container.rename(name)
+        except (docker.errors.NotFound, docker.errors.APIError) as e:
+            logger.warning(f"Failed to claim pooled workspace {container.name} ({key}): {e}")
+            r.delete(f"{POOL_CLAIM_PREFIX}{container.id}")
+            continue
+        if home is not None:
+            try:
+                mount_pool_home(docker_client, container, home)
+            except (docker.errors.DockerException, RuntimeError) as e:
+                # The workspace already has the user's name, so it is removed rather than returned to the pool.
+                logger.warning(f"Failed to mount home into pooled workspace {container.id} ({key}): {e}")
+                try:
+                    container.remove(force=True)
+                except (docker.errors.NotFound, docker.errors.APIError):
+                    pass
+                break
+        count_pool("hit", r)
+        return claimed_pool_container(container, claim)
+    count_pool("miss", r)
+    return None
+
+
+def with_claimed_labels(container, r=None):
+    if container is None or POOL_LABEL not in container.labels:
+        return container
+    claim = read_pool_claim(container.id, r)
+    return claimed_pool_container(container, claim) if claim else container
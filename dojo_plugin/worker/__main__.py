@@ -21,63 +21,69 @@ signal.signal(signal.SIGINT, signal_handler)
 
 logger.info("Starting stats background worker...")
 
-if os.environ.get("SKIP_COLD_START"):
-    logger.info("SKIP_COLD_START set, skipping cache initialization")
-else:
-    from ..worker.handlers.dojo_stats import initialize_all_dojo_stats
-    from ..worker.handlers.scoreboard import initialize_all_scoreboards
-    from ..worker.handlers.scores import initialize_all_scores
-    from ..worker.handlers.awards import initialize_all_belts, initialize_all_emojis
-    from ..worker.handlers.containers import initialize_all_container_stats
-    from ..worker.handlers.activity import initialize_all_activity
+from ..utils.background_stats import (
+    consume_stat_events, parse_shard_list, get_redis_client, stat_stream_names, disable_l1_cache, DailyRestartException,
+    CONSUMER_GROUP, DEAD_LETTER_STREAM_NAME, EVENT_COUNTERS_KEY, L1_COUNTERS_KEY,
+)
+from ..utils.metrics import serve_metrics, CacheAgeCollector, L1CacheCollector, StreamCollector
+from ..worker.handlers import handle_stat_event
+from ..worker.cold_start import start_cold_start
+from ..worker.handlers.scoreboard import roll_due_scoreboard_windows
+from ..worker.handlers.awards import verify_due_awards
 
-    logger.info("Performing cold start cache initialization...")
+disable_l1_cache()
+shards = parse_shard_list(os.environ.get("STATS_WORKER_SHARDS"))
 
+metrics_port = int(os.environ.get("STATS_METRICS_PORT", "9200"))
+if metrics_port:
     try:
-        cold_start_begin = time.time()
-
-        step_start = time.time()
-        initialize_all_dojo_stats()
-        logger.info(f"Dojo stats initialization complete ({time.time() - step_start:.2f}s)")
-
-        step_start = time.time()
-        initialize_all_scoreboards()
-        logger.info(f"Scoreboard initialization complete ({time.time() - step_start:.2f}s)")
-
-        step_start = time.time()
-        initialize_all_scores()
-        logger.info(f"Scores initialization complete ({time.time() - step_start:.2f}s)")
-
-        step_start = time.time()
-        initialize_all_belts()
-        logger.info(f"Belts initialization complete ({time.time() - step_start:.2f}s)")
+        serve_metrics(
+            metrics_port,
+            StreamCollector(get_redis_client(), CONSUMER_GROUP, stat_stream_names(shards),
+                            extra_streams=[DEAD_LETTER_STREAM_NAME], counters_key=EVENT_COUNTERS_KEY),
+            CacheAgeCollector(),
+            L1CacheCollector(get_redis_client(), L1_COUNTERS_KEY),
+        )
+    except Exception as e:
+        logger.error(f"Error starting metrics server: {e}", exc_info=True)
 
-        step_start = time.time()
-        initialize_all_emojis()
-        logger.info(f"Emojis initialization complete ({time.time() - step_start:.2f}s)")
+warmup = None
+if os.environ.get("SKIP_COLD_START"):
+    logger.info("SKIP_COLD_START set, skipping cache initialization")
+else:
+    try:
+        # Cold start steps run in the background; events for caches that are already warm are served meanwhile.
+        warmup = start_cold_start(handle_stat_event, force_full=os.environ.get("STATS_FULL_COLD_START", "").lower() in ("1", "true", "yes"))
+    except Exception as e:
+        logger.error(f"Error during cold start: {e}", exc_info=True)
 
-        step_start = time.time()
-        initialize_all_container_stats()
-        logger.info(f"Container stats initialization complete ({time.time() - step_start:.2f}s)")
 
-        step_start = time.time()
-        initialize_all_activity()
-        logger.info(f"Activity initialization complete ({time.time() - step_start:.2f}s)")
+def on_poll():
+    if warmup:
+        warmup.drain()
+    if not warmup or warmup.is_warm("scoreboard_update"):
+        try:
+            roll_due_scoreboard_windows(shards)
+        except Exception as e:
+            logger.error(f"Error rolling scoreboard windows: {e}", exc_info=True)
+    if not warmup or (warmup.is_warm("belts_update") and warmup.is_warm("emojis_update")):
+        try:
+            verify_due_awards(shards)
+        except Exception as e:
+            logger.error(f"Error verifying award caches: {e}", exc_info=True)
 
-        logger.info(f"Cold start complete - all stats initialized ({time.time() - cold_start_begin:.2f}s total)")
-    except Exception as e:
-        logger.error(f"Error during cold start: {e}", exc_info=True)
 
 logger.info("Starting event consumption loop...")
 
-from ..utils.background_stats import consume_stat_events, DailyRestartException
-from ..worker.handlers import handle_stat_event
-
 try:
     consume_stat_events(
-        handler=handle_stat_event,
-        batch_size=10,
-        block_ms=5000
+        handler=warmup.handle if warmup else handle_stat_event,
+        batch_size=int(os.environ.get("STATS_WORKER_BATCH_SIZE", "10")),
+        block_ms=5000,
+        batched=os.environ.get("STATS_WORKER_BATCHED", "").lower() in ("1", "true", "yes"),
+        shards=shards,
+        on_poll=on_poll,
+        debounce_ms=int(os.environ.get("STATS_WORKER_DEBOUNCE_MS", "1000")),
     )
 except KeyboardInterrupt:
     logger.info("Worker interrupted by user")
@@ -0,0 +1,345 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from flask import current_app
+from CTFd.models import db, Solves, Awards
+from ..models import Dojos, DojoChallenges
+from ..utils.background_stats import get_cached_stat, set_cached_stat, get_redis_client, publish_stat_event, stat_event_partition_key
+from ..utils.scoreboard_store import SCOREBOARD_BACKEND
+from ..utils.scores import OFFICIAL_SCORES_KEY
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = "stats:checkpoint"
+# Bump whenever the layout of any cached stat changes, so that the next boot rebuilds everything.
+STATS_SCHEMA_VERSION = 7
+FULL_REBUILD_DAYS = int(os.environ.get("STATS_FULL_REBUILD_DAYS", "7"))
+GLOBAL_CACHE_KEYS = ["stats:belts", "stats:emojis", OFFICIAL_SCORES_KEY]
+# Each step holds its own database session, so this bounds the number of concurrent cold start queries.
+COLD_START_CONCURRENCY = max(1, int(os.environ.get("STATS_COLD_START_CONCURRENCY", "3")))
+# Failed steps stay cold and are retried, backing off up to the maximum.
+COLD_START_RETRY_SECONDS = 30
+COLD_START_MAX_RETRY_SECONDS = 600
+
+# Cold start steps whose caches an event type reads or writes; events wait until all of them are warm.
+EVENT_STEPS = {
+    "dojo_stats_update": {"dojo_stats"},
+    "scoreboard_update": {"scoreboards", "windowed_scoreboards"},
+    "scores_update": {"scores"},
+    "belts_update": {"belts"},
+    "emojis_update": {"emojis"},
+    "container_stats_update": {"containers"},
+    "activity_update": {"activity"},
+    "challenge_solve": {"dojo_stats", "scoreboards", "windowed_scoreboards", "scores", "activity"},
+    "user_update": {"scoreboards", "windowed_scoreboards"},
+}
+
+
+def high_water_marks():
+    solve_id = db.session.query(db.func.max(Solves.id)).scalar() or 0
+    award_id = db.session.query(db.func.max(Awards.id)).scalar() or 0
+    return solve_id, award_id
+
+
+def write_checkpoint(solve_id, award_id, full_rebuild_at):
+    now = datetime.now(timezone.utc)
+    set_cached_stat(CHECKPOINT_KEY, {
+        "schema_version": STATS_SCHEMA_VERSION,
+        "scoreboard_backend": SCOREBOARD_BACKEND,
+        "solve_id": solve_id,
+        "award_id": award_id,
+        "full_rebuild_at": full_rebuild_at,
+        "day": now.date().isoformat(),
+    })
+    logger.info(f"Recorded stats checkpoint solve_id={solve_id} award_id={award_id}")
+
+
+def checkpoint_rejection(checkpoint):
+    if not checkpoint:
+        return "no checkpoint"
+    if checkpoint.get("schema_version") != STATS_SCHEMA_VERSION:
+        return f"schema version {checkpoint.get('schema_version')} != {STATS_SCHEMA_VERSION}"
+    if checkpoint.get("scoreboard_backend", "json") != SCOREBOARD_BACKEND:
+        return f"scoreboard backend changed to {SCOREBOARD_BACKEND}"
+    if time.time() - checkpoint.get("full_rebuild_at", 0) > FULL_REBUILD_DAYS * 86400:
+        return f"last full rebuild is older than {FULL_REBUILD_DAYS} days"
+    r = get_redis_client()
+    missing = [key for key in GLOBAL_CACHE_KEYS if not r.exists(key)]
+    if missing:
+        return f"missing cache keys {missing}"
+    return None
+
+
+def run_steps(app, steps, concurrency=COLD_START_CONCURRENCY, on_done=None):
+    """
+    Run `steps`, a dict of name -> (func, deps), as soon as each step's dependencies have succeeded.
+    Steps whose dependencies failed are skipped and reported as failed.
+    Returns (timings, failed).
+    """
+    for name, (func, deps) in steps.items():
+        unknown = set(deps) - set(steps)
+        if unknown:
+            raise ValueError(f"Cold start step {name} depends on unknown step(s) {sorted(unknown)}")
+
+    def run(name, func):
+        with app.app_context():
+            step_start = time.time()
+            try:
+                func()
+                return None, time.time() - step_start
+            except Exception as e:
+                logger.error(f"Cold start step {name} failed: {e}", exc_info=True)
+                return e, time.time() - step_start
+            finally:
+                db.session.remove()
+
+    def finish(name, ok):
+        if on_done:
+            on_done(name, ok)
+
+    timings = {}
+    failed = set()
+    pending = dict(steps)
+    running = {}
+    run_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="cold-start") as executor:
+        while pending or running:
+            for name, (func, deps) in list(pending.items()):
+                if any(dep in failed for dep in deps):
+                    logger.error(f"Skipping cold start step {name}: dependency failed")
+                    del pending[name]
+                    failed.add(name)
+                    finish(name, False)
+                elif all(dep in timings for dep in deps):
+                    del pending[name]
+                    running[executor.submit(run, name, func)] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Cold start steps {sorted(pending)} have cyclic dependencies")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error, elapsed = future.result()
+                if error:
+                    failed.add(name)
+                else:
+                    timings[name] = elapsed
+                    logger.info(f"Cold start step {name} complete ({elapsed:.2f}s)")
+                finish(name, error is None)
+
+    wall_time = time.time() - run_start
+    step_summary = ", ".join(f"{name}={elapsed:.2f}s" for name, elapsed in sorted(timings.items(), key=lambda item: -item[1]))
+    logger.info(f"Cold start complete ({wall_time:.2f}s wall, {sum(timings.values()):.2f}s summed "
+                f"({concurrency=}): {step_summary}" + (f"; failed: {sorted(failed)}" if failed else ""))
+    return timings, failed
+
+
+def full_cold_start_steps():
+    from .handlers.dojo_stats import initialize_all_dojo_stats
+    from .handlers.scoreboard import initialize_all_scoreboards
+    from .handlers.scores import initialize_all_scores
+    from .handlers.awards import initialize_all_belts, initialize_all_emojis
+    from .handlers.containers import initialize_all_container_stats
+    from .handlers.activity import initialize_all_activity
+
+    solve_id, award_id = high_water_marks()
+    full_rebuild_at = time.time()
+
+    steps = {
+        "dojo_stats": (initialize_all_dojo_stats, ()),
+        "scoreboards": (initialize_all_scoreboards, ()),
+        "scores": (initialize_all_scores, ()),
+        "belts": (initialize_all_belts, ()),
+        "emojis": (initialize_all_emojis, ()),
+        "containers": (initialize_all_container_stats, ()),
+        "activity": (initialize_all_activity, ()),
+    }
+    steps["checkpoint"] = (lambda: write_checkpoint(solve_id, award_id, full_rebuild_at), tuple(steps))
+    return steps
+
+
+def dojos_missing_cache(dojos):
+    pipeline = get_redis_client().pipeline(transaction=False)
+    for dojo in dojos:
+        pipeline.exists(f"stats:scoreboard:dojo:{dojo.dojo_id}:0:updated", f"stats:dojo:{dojo.reference_id}")
+    return {dojo.dojo_id for dojo, exists in zip(dojos, pipeline.execute()) if exists < 2}
+
+
+def incremental_cold_start_steps(checkpoint):
+    from .handlers.dojo_stats import initialize_all_dojo_stats
+    from .handlers.scoreboard import handle_scoreboard_update, roll_all_scoreboard_windows
+    from .handlers.scores import handle_scores_update, update_official_scores
+    from .handlers.awards import initialize_all_belts, initialize_all_emojis
+    from .handlers.containers import initialize_all_container_stats
+    from .handlers.activity import initialize_all_activity
+
+    solve_id, award_id = high_water_marks()
+    new_solves = Solves.query.filter(Solves.id > checkpoint["solve_id"])
+    changed_user_ids = {user_id for user_id, in new_solves.with_entities(Solves.user_id).distinct()}
+    changed_dojo_ids = {
+        dojo_id for dojo_id, in
+        new_solves.join(DojoChallenges, DojoChallenges.challenge_id == Solves.challenge_id)
+        .with_entities(DojoChallenges.dojo_id).distinct()
+    }
+
+    dojos = Dojos.query.all()
+    changed_dojo_ids |= dojos_missing_cache(dojos)
+    # Windowed boards shift with the calendar, so a checkpoint from an earlier day rolls them. Dojo stats roll their
+    # daily chart themselves.
+    new_day = checkpoint.get("day") != datetime.now(timezone.utc).date().isoformat()
+    logger.info(f"Replaying {solve_id - checkpoint['solve_id']} solve id(s) and {award_id - checkpoint['award_id']} award id(s) "
+                f"since checkpoint: {len(changed_dojo_ids)} dojo(s), {len(changed_user_ids)} user(s), {new_day=}")
+
+    # Steps run on their own threads and sessions, so they look dojos up again rather than sharing these instances.
+    def refresh_scoreboards():
+        for dojo in Dojos.query.filter(Dojos.dojo_id.in_(changed_dojo_ids)):
+            handle_scoreboard_update({"model_type": "dojo", "model_id": dojo.dojo_id})
+            for module in dojo.modules:
+                handle_scoreboard_update({"model_type": "module", "model_id": {"dojo_id": dojo.dojo_id, "module_index": module.module_index}})
+
+    def refresh_scores():
+        for dojo_id in sorted(changed_dojo_ids):
+            handle_scores_update({"dojo_id": dojo_id})
+        # Challenge visibility windows open and close with the calendar, which changes the official challenges.
+        if new_day:
+            update_official_scores()
+
+    steps = {
+        "containers": (initialize_all_container_stats, ()),
+    }
+    if changed_dojo_ids:
+        steps["dojo_stats"] = (lambda: initialize_all_dojo_stats(changed_dojo_ids), ())
+        steps["scoreboards"] = (refresh_scoreboards, ())
+    if changed_dojo_ids or new_day:
+        steps["scores"] = (refresh_scores, ())
+    if new_day:
+        # Both steps write the windowed boards of changed dojos, so they must not interleave.
+        steps["windowed_scoreboards"] = (roll_all_scoreboard_windows, ("scoreboards",) if changed_dojo_ids else ())
+    if award_id != checkpoint["award_id"]:
+        steps["belts"] = (initialize_all_belts, ())
+        steps["emojis"] = (initialize_all_emojis, ())
+    if changed_user_ids:
+        steps["activity"] = (lambda: initialize_all_activity(changed_user_ids), ())
+    steps["checkpoint"] = (lambda: write_checkpoint(solve_id, award_id, checkpoint["full_rebuild_at"]), tuple(steps))
+    return steps
+
+
+def cold_start_steps(force_full=False):
+    checkpoint = get_cached_stat(CHECKPOINT_KEY)
+    rejection = "full rebuild requested" if force_full else checkpoint_rejection(checkpoint)
+    if rejection:
+        logger.info(f"Performing full cold start cache initialization ({rejection})...")
+        return full_cold_start_steps()
+    logger.info(f"Performing incremental cold start from checkpoint solve_id={checkpoint['solve_id']} award_id={checkpoint['award_id']}...")
+    return incremental_cold_start_steps(checkpoint)
+
+
+def cold_start(force_full=False, concurrency=COLD_START_CONCURRENCY):
+    return run_steps(current_app._get_current_object(), cold_start_steps(force_full), concurrency=concurrency)
+
+
+def recompute_events(event_type, payload):
+    """
+    Translate an event into recompute events that rebuild its caches from the database.
+    Incremental solve updates cannot be applied safely to a cache whose initial computation may or may not include them.
+    """
+    if event_type != "challenge_solve":
+        return [(event_type, payload)]
+    events = []
+    dojo_challenges = DojoChallenges.query.filter_by(challenge_id=payload.get("challenge_id"))
+    if payload.get("dojo_id") is not None:
+        dojo_challenges = dojo_challenges.filter_by(dojo_id=payload["dojo_id"])
+    for dojo_challenge in dojo_challenges:
+        dojo_id = dojo_challenge.dojo_id
+        events.append(("dojo_stats_update", {"dojo_id": dojo_id}))
+        events.append(("scoreboard_update", {"model_type": "dojo", "model_id": dojo_id}))
+        events.append(("scoreboard_update", {"model_type": "module", "model_id": {"dojo_id": dojo_id, "module_index": dojo_challenge.module_index}}))
+        events.append(("scores_update", {"dojo_id": dojo_id}))
+    if payload.get("dojo_id") is None and payload.get("user_id") is not None:
+        events.append(("activity_update", {"user_id": payload["user_id"]}))
+    return events
+
+
+class WarmupGate:
+    """
+    Wraps the stat event handler while cold start steps run in the background.
+    Events whose caches are warm are handled immediately; the rest are deferred as recomputes until their steps succeed.
+    """
+
+    def __init__(self, handler, steps):
+        self.handler = handler
+        self.pending_steps = set(steps)
+        self.deferred = {}
+        self.lock = threading.Lock()
+
+    def step_done(self, name, ok):
+        if not ok:
+            # Its caches may never have been built, so events for them stay deferred until a retry succeeds.
+            logger.warning(f"Cold start step {name} failed; its events stay deferred until it is retried")
+            return
+        with self.lock:
+            self.pending_steps.discard(name)
+            remaining = len(self.pending_steps)
+        if not remaining:
+            logger.info(f"All cold start steps finished, {len(self.deferred)} deferred event(s) to recompute")
+
+    def warm(self, app, steps, concurrency=COLD_START_CONCURRENCY):
+        """Runs the steps, then reruns the failed ones (and the steps skipped because of them) until all succeed."""
+        delay = COLD_START_RETRY_SECONDS
+        while steps:
+            _, failed = run_steps(app, steps, concurrency=concurrency, on_done=self.step_done)
+            if not failed:
+                return
+            logger.warning(f"Retrying failed cold start steps {sorted(failed)} in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, COLD_START_MAX_RETRY_SECONDS)
+            steps = {name: (func, tuple(dep for dep in deps if dep in failed)) for name, (func, deps) in steps.items() if name in failed}
+
+    def is_warm(self, event_type):
+        with self.lock:
+            return not (EVENT_STEPS.get(event_type, set()) & self.pending_steps)
+
+    def handle(self, event_type, payload, event_timestamp):
+        self.drain()
+        if self.is_warm(event_type):
+            self.handler(event_type, payload, event_timestamp)
+            return
+        for deferred_type, deferred_payload in recompute_events(event_type, payload):
+            self.deferred[(deferred_type, json.dumps(deferred_payload, sort_keys=True))] = (deferred_type, deferred_payload)
+        logger.info(f"Deferred {event_type} until its caches are warm ({len(self.deferred)} deferred)")
+
+    def drain(self):
+        for key, (event_type, payload) in list(self.deferred.items()):
+            if not self.is_warm(event_type):
+                continue
+            del self.deferred[key]
+            try:
+                self.handler(event_type, payload, None)
+            except Exception as e:
+                # The events it stands for were already acknowledged, so it goes back on the stream, whose retries and
+                # dead letters take over; it stays deferred if that fails too.
+                logger.error(f"Error recomputing deferred {event_type} {payload}, republishing it: {e}", exc_info=True)
+                if not publish_stat_event(event_type, payload, partition_key=stat_event_partition_key(event_type, payload)):
+                    self.deferred[key] = (event_type, payload)
+
+
+def start_cold_start(handler, force_full=False, concurrency=COLD_START_CONCURRENCY):
+    steps = cold_start_steps(force_full)
+    gate = WarmupGate(handler, steps)
+    thread = threading.Thread(
+        target=gate.warm,
+        args=(current_app._get_current_object(), steps),
+        kwargs={"concurrency": concurrency},
+        name="stats-cold-start",
+        daemon=True,
+    )
+    thread.start()
+    return gate
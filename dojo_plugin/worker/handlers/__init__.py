@@ -22,9 +22,7 @@ def handle_stat_event(event_type: str, payload: Dict[str, Any], event_timestamp:
     _load_handlers()
     handler = EVENT_HANDLERS.get(event_type)
     if handler:
-        try:
-            handler(payload, event_timestamp)
-        except Exception as e:
-            logger.error(f"Error handling event {event_type}: {e}", exc_info=True)
+        # Failures propagate so that the consumer leaves the event pending for retry or dead-lettering.
+        handler(payload, event_timestamp)
     else:
         logger.warning(f"No handler registered for event type: {event_type}")
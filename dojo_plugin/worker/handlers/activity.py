@@ -1,6 +1,7 @@
+import itertools
 import logging
+import os
 from datetime import datetime, timedelta
-from collections import defaultdict
 from sqlalchemy import func
 
 from CTFd.models import db, Solves, Users
@@ -9,25 +10,53 @@ from . import register_handler
 
 logger = logging.getLogger(__name__)
 
-def calculate_activity(user_id):
-    now = datetime.utcnow()
-    one_year_ago = now - timedelta(days=365)
-
-    solves = (
-        Solves.query
-        .filter(Solves.user_id == user_id)
-        .filter(Solves.date >= one_year_ago)
-        .with_entities(Solves.date)
-        .all()
-    )
+ACTIVITY_RETENTION_DAYS = int(os.environ.get("STATS_ACTIVITY_RETENTION_DAYS", "365"))
+# Solves are counted per UTC hour rather than per day, so that the activity graph can still place them on the viewer's
+# local days. Bucket names sort chronologically.
+ACTIVITY_BUCKET_FORMAT = "%Y-%m-%dT%H"
+ACTIVITY_BATCH_SIZE = 10000
+
+
+def activity_bucket(date):
+    return date.strftime(ACTIVITY_BUCKET_FORMAT)
+
 
-    timestamps = [solve.date.isoformat() + 'Z' for solve in solves if solve.date]
+def retention_start(now=None):
+    return (now or datetime.utcnow()) - timedelta(days=ACTIVITY_RETENTION_DAYS)
 
+
+def build_activity(solve_counts, now=None):
+    oldest_bucket = activity_bucket(retention_start(now))
+    solve_counts = {bucket: count for bucket, count in solve_counts.items() if bucket >= oldest_bucket}
     return {
-        'solve_timestamps': timestamps,
-        'total_solves': len(timestamps),
+        'solve_counts': solve_counts,
+        'total_solves': sum(solve_counts.values()),
     }
 
+
+def activity_solve_counts(activity):
+    if 'solve_timestamps' in activity:
+        # Cached before activity was bucketed.
+        timestamps = (datetime.fromisoformat(timestamp.rstrip('Z')) for timestamp in activity['solve_timestamps'])
+        return {bucket: len(list(group)) for bucket, group in itertools.groupby(sorted(map(activity_bucket, timestamps)))}
+    return dict(activity.get('solve_counts', {}))
+
+
+def hourly_solves_query(since):
+    hour = func.date_trunc('hour', Solves.date).label("hour")
+    return (
+        db.session.query(Solves.user_id, hour, func.count().label("solves"))
+        .filter(Solves.date >= since)
+        .group_by(Solves.user_id, hour)
+    )
+
+
+def calculate_activity(user_id):
+    now = datetime.utcnow()
+    solves = hourly_solves_query(retention_start(now)).filter(Solves.user_id == user_id)
+    return build_activity({activity_bucket(hour): count for _, hour, count in solves}, now)
+
+
 @register_handler("activity_update")
 def handle_activity_update(payload, event_timestamp=None):
     user_id = payload.get("user_id")
@@ -49,23 +78,17 @@ def handle_activity_update(payload, event_timestamp=None):
         logger.info(f"User not found for user_id {user_id} (may have been deleted)")
         return
 
-    try:
-        logger.info(f"Calculating activity for user {user_id}...")
-        activity = calculate_activity(user_id)
-        set_cached_stat(cache_key, activity)
-        logger.info(f"Successfully updated and cached activity for user {user_id} (total_solves: {activity['total_solves']})")
-    except Exception as e:
-        logger.error(f"Error calculating activity for user_id {user_id}: {e}", exc_info=True)
+    logger.info(f"Calculating activity for user {user_id}...")
+    activity = calculate_activity(user_id)
+    set_cached_stat(cache_key, activity)
+    logger.info(f"Successfully updated and cached activity for user {user_id} (total_solves: {activity['total_solves']})")
 
 
 def update_activity(activity, solve_date=None):
-    timestamps = list(activity.get('solve_timestamps', []))
-    timestamp = (solve_date or datetime.utcnow()).isoformat() + 'Z'
-    timestamps.append(timestamp)
-    return {
-        'solve_timestamps': timestamps,
-        'total_solves': len(timestamps),
-    }
+    solve_counts = activity_solve_counts(activity)
+    bucket = activity_bucket(solve_date or datetime.utcnow())
+    solve_counts[bucket] = solve_counts.get(bucket, 0) + 1
+    return build_activity(solve_counts)
 
 
 def initialize_activity_for_user(user_id):
@@ -78,29 +101,26 @@ def initialize_activity_for_user(user_id):
         logger.error(f"Error initializing activity for user {user_id}: {e}", exc_info=True)
         return False
 
-def initialize_all_activity():
-    one_year_ago = datetime.utcnow() - timedelta(days=365)
 
-    all_solves = (
-        Solves.query
-        .filter(Solves.date >= one_year_ago)
-        .with_entities(Solves.user_id, Solves.date)
-        .all()
-    )
+def iter_user_activity(user_ids=None, now=None):
+    """Yields (user_id, activity) for every user with solves in the retention window, from one grouped query."""
+    now = now or datetime.utcnow()
+    solves_query = hourly_solves_query(retention_start(now))
+    if user_ids is not None:
+        solves_query = solves_query.filter(Solves.user_id.in_(list(user_ids)))
+    # Rows arrive grouped by user, so only one user's buckets are held in memory at a time.
+    rows = solves_query.order_by(Solves.user_id).yield_per(ACTIVITY_BATCH_SIZE)
+    for user_id, user_rows in itertools.groupby(rows, key=lambda row: row.user_id):
+        yield user_id, build_activity({activity_bucket(hour): count for _, hour, count in user_rows}, now)
 
-    user_timestamps = defaultdict(list)
-    for user_id, date in all_solves:
-        if date:
-            user_timestamps[user_id].append(date.isoformat() + 'Z')
 
-    logger.info(f"Initializing activity for {len(user_timestamps)} active users (batch mode)...")
+def initialize_all_activity(user_ids=None):
+    logger.info("Initializing activity for active users (batch mode)...")
 
-    for user_id, timestamps in user_timestamps.items():
-        activity = {
-            'solve_timestamps': timestamps,
-            'total_solves': len(timestamps),
-        }
+    user_count = 0
+    for user_id, activity in iter_user_activity(user_ids):
         cache_key = f"stats:activity:{user_id}"
         set_cached_stat(cache_key, activity)
+        user_count += 1
 
-    logger.info(f"Activity initialization complete for {len(user_timestamps)} users")
+    logger.info(f"Activity initialization complete for {user_count} users")
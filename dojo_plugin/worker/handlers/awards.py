@@ -1,15 +1,26 @@
+import bisect
+import json
 import logging
+import os
+import time
 from flask import url_for
 from CTFd.models import db, Users
 from ...models import Dojos, Belts, Emojis
 from ...utils.awards import BELT_ORDER
-from ...utils.background_stats import set_cached_stat, is_event_stale
+from ...utils.background_stats import get_cached_stat, set_cached_stat, event_shard
+from ...utils.metrics import AWARD_CACHE_DRIFT
 from . import register_handler
 
 logger = logging.getLogger(__name__)
 
 CACHE_KEY_BELTS = "stats:belts"
 CACHE_KEY_EMOJIS = "stats:emojis"
+# Award events for a single user are applied to the cached maps; a full recompute every so often repairs any drift.
+AWARDS_VERIFY_INTERVAL = int(os.environ.get("STATS_AWARDS_VERIFY_SECONDS", "3600"))
+# Diff every incremental update against a full recompute, for testing the incremental path.
+AWARDS_VERIFY_EACH = os.environ.get("STATS_AWARDS_VERIFY_EACH", "").lower() in ("1", "true", "yes")
+
+_awards_verified_at = None
 
 def calculate_belts(user=None):
     result = dict(dates={}, users={}, ranks={})
@@ -47,8 +58,8 @@ def calculate_belts(user=None):
 
     return result
 
-def calculate_emojis(user=None):
-    dojos_by_hex = {
+def calculate_emoji_dojos():
+    return {
         dojo.hex_dojo_id: {
             "reference_id": dojo.reference_id,
             "emoji": dojo.award.get("emoji") if dojo.award else None,
@@ -59,6 +70,10 @@ def calculate_emojis(user=None):
         if dojo.award and dojo.award.get("emoji")
     }
 
+def calculate_emojis(user=None, dojos_by_hex=None):
+    if dojos_by_hex is None:
+        dojos_by_hex = calculate_emoji_dojos()
+
     emojis = (
         Emojis.query
         .join(Users)
@@ -103,56 +118,156 @@ def calculate_emojis(user=None):
 
     return {"emojis": result, "dojos": dojos_by_hex}
 
-@register_handler("belts_update")
-def handle_belts_update(payload, event_timestamp=None):
-    if event_timestamp and is_event_stale(CACHE_KEY_BELTS, event_timestamp):
+def as_cached(data):
+    # Cached maps come back from JSON with string keys.
+    return json.loads(json.dumps(data))
+
+def apply_user_belts(belt_data, user_id, user_belts):
+    """Replaces the belts of `user_id` in the cached `belt_data` with `user_belts`, as calculated by calculate_belts(user)."""
+    key = str(user_id)
+    for color in BELT_ORDER:
+        belt_data["dates"].setdefault(color, {}).pop(key, None)
+        ranks = belt_data["ranks"].setdefault(color, [])
+        if user_id in ranks:
+            ranks.remove(user_id)
+    belt_data["users"].pop(key, None)
+
+    user_belts = as_cached(user_belts)
+    for color, dates in user_belts["dates"].items():
+        belt_data["dates"][color].update(dates)
+    if key in user_belts["users"]:
+        user = user_belts["users"][key]
+        belt_data["users"][key] = user
+        # Users holding the same top belt are ranked by when they earned it.
+        ranks = belt_data["ranks"][user["color"]]
+        position = bisect.bisect_right(ranks, user["date"], key=lambda other_user_id: belt_data["users"][str(other_user_id)]["date"])
+        ranks.insert(position, user_id)
+    return belt_data
+
+def apply_user_emojis(emoji_data, user_id, user_emojis):
+    """Replaces the emojis of `user_id` in the cached `emoji_data` with `user_emojis`, as calculated by calculate_emojis(user)."""
+    entries = as_cached(user_emojis["emojis"]).get(str(user_id))
+    if entries:
+        emoji_data["emojis"][str(user_id)] = entries
+    else:
+        emoji_data["emojis"].pop(str(user_id), None)
+    return emoji_data
+
+def diff_awards(name, cached, full):
+    """Logs and counts the users whose cached awards differ from a full recompute; returns whether any did."""
+    cached, full = as_cached(cached), as_cached(full)
+    if cached == full:
+        return False
+    users_key = "users" if name == "belts" else "emojis"
+    user_ids = set(cached.get(users_key, {})) | set(full.get(users_key, {}))
+    drifted = sorted(user_id for user_id in user_ids if cached.get(users_key, {}).get(user_id) != full.get(users_key, {}).get(user_id))
+    if name == "belts":
+        drifted += [f"ranks:{color}" for color in BELT_ORDER if cached["ranks"].get(color) != full["ranks"].get(color)]
+    elif cached.get("dojos") != full.get("dojos"):
+        drifted.append("dojos")
+    drifted = drifted or ["dates"]
+    AWARD_CACHE_DRIFT.labels(name).inc()
+    logger.warning(f"Cached {name} differ from a full recompute for {len(drifted)} entries: {drifted[:20]}")
+    return True
+
+def update_user_belts(user_id):
+    belt_data = get_cached_stat(CACHE_KEY_BELTS)
+    if belt_data is None:
+        logger.info("No cached belts, recomputing all belts")
+        set_cached_stat(CACHE_KEY_BELTS, calculate_belts())
+        return
+    user = Users.query.filter_by(id=user_id).first()
+    user_belts = calculate_belts(user) if user and not user.hidden else {"dates": {}, "users": {}}
+    apply_user_belts(belt_data, user_id, user_belts)
+    set_cached_stat(CACHE_KEY_BELTS, belt_data)
+    if AWARDS_VERIFY_EACH:
+        diff_awards("belts", belt_data, calculate_belts())
+
+def update_user_emojis(user_id):
+    emoji_data = get_cached_stat(CACHE_KEY_EMOJIS)
+    if emoji_data is None:
+        logger.info("No cached emojis, recomputing all emojis")
+        set_cached_stat(CACHE_KEY_EMOJIS, calculate_emojis())
         return
+    user = Users.query.filter_by(id=user_id).first()
+    user_emojis = calculate_emojis(user, emoji_data["dojos"]) if user and not user.hidden else {"emojis": {}}
+    apply_user_emojis(emoji_data, user_id, user_emojis)
+    set_cached_stat(CACHE_KEY_EMOJIS, emoji_data)
+    if AWARDS_VERIFY_EACH:
+        diff_awards("emojis", emoji_data, calculate_emojis())
 
+def verify_awards():
+    """Recomputes belts and emojis in full, replacing (and reporting) cached maps that drifted from the database."""
     db.session.expire_all()
     db.session.commit()
+    for name, cache_key, calculate in (("belts", CACHE_KEY_BELTS, calculate_belts), ("emojis", CACHE_KEY_EMOJIS, calculate_emojis)):
+        try:
+            full = calculate()
+            cached = get_cached_stat(cache_key)
+            if cached is None or diff_awards(name, cached, full):
+                set_cached_stat(cache_key, full)
+        except Exception as e:
+            logger.error(f"Error verifying {name}: {e}", exc_info=True)
 
-    try:
-        logger.info("Calculating belts...")
-        belt_data = calculate_belts()
-        set_cached_stat(CACHE_KEY_BELTS, belt_data)
-        user_count = len(belt_data["users"])
-        logger.info(f"Successfully updated belts cache ({user_count} users with belts)")
-    except Exception as e:
-        logger.error(f"Error calculating belts: {e}", exc_info=True)
+def verify_due_awards(shards=None):
+    global _awards_verified_at
+    # The award caches are global, so only the worker consuming their (unpartitioned) events checks them.
+    if shards is not None and event_shard(None) not in shards:
+        return
+    now = time.monotonic()
+    if _awards_verified_at is None:
+        _awards_verified_at = now
+    if now - _awards_verified_at < AWARDS_VERIFY_INTERVAL:
+        return
+    verify_awards()
+    _awards_verified_at = now
 
-@register_handler("emojis_update")
-def handle_emojis_update(payload, event_timestamp=None):
-    if event_timestamp and is_event_stale(CACHE_KEY_EMOJIS, event_timestamp):
+@register_handler("belts_update")
+def handle_belts_update(payload, event_timestamp=None):
+    user_id = payload.get("user_id")
+    db.session.expire_all()
+    db.session.commit()
+
+    if user_id is not None:
+        # Recomputing one user from the database is always current, so it is never stale. This also means that the
+        # cache's updated time no longer tells whether a full recompute already covers an event, so those always run.
+        update_user_belts(user_id)
+        logger.info(f"Updated belts of user {user_id}")
         return
 
+    logger.info("Calculating belts...")
+    belt_data = calculate_belts()
+    set_cached_stat(CACHE_KEY_BELTS, belt_data)
+    user_count = len(belt_data["users"])
+    logger.info(f"Successfully updated belts cache ({user_count} users with belts)")
+
+@register_handler("emojis_update")
+def handle_emojis_update(payload, event_timestamp=None):
+    user_id = payload.get("user_id")
     db.session.expire_all()
     db.session.commit()
 
-    try:
-        logger.info("Calculating emojis...")
-        emoji_data = calculate_emojis()
-        set_cached_stat(CACHE_KEY_EMOJIS, emoji_data)
-        user_count = len(emoji_data["emojis"])
-        logger.info(f"Successfully updated emojis cache ({user_count} users with emojis)")
-    except Exception as e:
-        logger.error(f"Error calculating emojis: {e}", exc_info=True)
+    if user_id is not None:
+        update_user_emojis(user_id)
+        logger.info(f"Updated emojis of user {user_id}")
+        return
+
+    logger.info("Calculating emojis...")
+    emoji_data = calculate_emojis()
+    set_cached_stat(CACHE_KEY_EMOJIS, emoji_data)
+    user_count = len(emoji_data["emojis"])
+    logger.info(f"Successfully updated emojis cache ({user_count} users with emojis)")
 
 def initialize_all_belts():
     logger.info("Initializing belts...")
-    try:
-        belt_data = calculate_belts()
-        set_cached_stat(CACHE_KEY_BELTS, belt_data)
-        user_count = len(belt_data["users"])
-        logger.info(f"Initialized belts ({user_count} users with belts)")
-    except Exception as e:
-        logger.error(f"Error initializing belts: {e}", exc_info=True)
+    belt_data = calculate_belts()
+    set_cached_stat(CACHE_KEY_BELTS, belt_data)
+    user_count = len(belt_data["users"])
+    logger.info(f"Initialized belts ({user_count} users with belts)")
 
 def initialize_all_emojis():
     logger.info("Initializing emojis...")
-    try:
-        emoji_data = calculate_emojis()
-        set_cached_stat(CACHE_KEY_EMOJIS, emoji_data)
-        user_count = len(emoji_data["emojis"])
-        logger.info(f"Initialized emojis ({user_count} users with emojis)")
-    except Exception as e:
-        logger.error(f"Error initializing emojis: {e}", exc_info=True)
+    emoji_data = calculate_emojis()
+    set_cached_stat(CACHE_KEY_EMOJIS, emoji_data)
+    user_count = len(emoji_data["emojis"])
+    logger.info(f"Initialized emojis ({user_count} users with emojis)")
@@ -18,21 +18,15 @@ def handle_container_stats_update(payload, event_timestamp=None):
     if event_timestamp and is_event_stale(CACHE_KEY_CONTAINERS, event_timestamp):
         return
 
-    try:
-        logger.info("Calculating container stats...")
-        container_data = calculate_container_stats()
-        set_cached_stat(CACHE_KEY_CONTAINERS, container_data)
-        container_count = len(container_data)
-        logger.info(f"Successfully updated container stats cache ({container_count} containers)")
-    except Exception as e:
-        logger.error(f"Error calculating container stats: {e}", exc_info=True)
+    logger.info("Calculating container stats...")
+    container_data = calculate_container_stats()
+    set_cached_stat(CACHE_KEY_CONTAINERS, container_data)
+    container_count = len(container_data)
+    logger.info(f"Successfully updated container stats cache ({container_count} containers)")
 
 def initialize_all_container_stats():
     logger.info("Initializing container stats...")
-    try:
-        container_data = calculate_container_stats()
-        set_cached_stat(CACHE_KEY_CONTAINERS, container_data)
-        container_count = len(container_data)
-        logger.info(f"Initialized container stats ({container_count} containers)")
-    except Exception as e:
-        logger.error(f"Error initializing container stats: {e}", exc_info=True)
+    container_data = calculate_container_stats()
+    set_cached_stat(CACHE_KEY_CONTAINERS, container_data)
+    container_count = len(container_data)
+    logger.info(f"Initialized container stats ({container_count} containers)")
@@ -1,22 +1,50 @@
 import logging
 import datetime
-from sqlalchemy import func
+
+import redis
+from sqlalchemy import func, or_
 
 from CTFd.models import db, Solves, Users
 from ...models import Dojos, DojoModules, DojoChallenges
-from ...utils.background_stats import get_cached_stat, set_cached_stat, is_event_stale
-from ...utils.crews import aggregate_crews, member_challenges_from_crews, parse_crew_tag
+from ...utils.background_stats import get_cached_stat, set_cached_stat, stale_cache_keys, get_redis_client, get_redis_time, event_shard
+from ...utils.cache_codec import encode_stat
+from ...utils.crews import parse_crew_tag
+from ...utils.crew_store import (
+    crews_cache_key, rebuild_crew_index, add_crew_solve, get_crew_membership, set_crew_membership, crew_index_exists,
+    crew_member_ids, write_crew_membership,
+)
+from ...utils.metrics import record_cache_update
+from ...utils.scoreboard_store import (
+    zset_backend, write_scoreboard, add_scoreboard_solve, get_scoreboard_user, set_scoreboard_user, read_scoreboard_entries,
+    ranking_key, TIE_BREAK_SPAN,
+)
 from . import register_handler
 
 logger = logging.getLogger(__name__)
 
 COMMON_DURATIONS = [0, 7, 30]
+WINDOWED_DURATIONS = [duration for duration in COMMON_DURATIONS if duration]
+# Daily buckets must outlive the longest window, plus slack for a worker that was down across a day boundary.
+BUCKET_RETENTION_DAYS = max(WINDOWED_DURATIONS) + 2
+ROLL_ATTEMPTS = 5
+
+_windows_rolled_on = None
+
+
+def utc_today():
+    return datetime.datetime.utcnow().date()
+
+
+def window_start(duration, today=None):
+    # Windows are whole UTC days (today and the duration - 1 days before it), so that they roll one daily bucket at a time.
+    today = today or utc_today()
+    return datetime.datetime.combine(today - datetime.timedelta(days=duration - 1), datetime.time())
 
 
 def duration_solves_filter(duration):
     if not duration:
         return True
-    return Solves.date >= datetime.datetime.utcnow() - datetime.timedelta(days=duration)
+    return Solves.date >= window_start(duration)
 
 
 def calculate_member_challenges(model, duration, scoreboard):
@@ -48,27 +76,46 @@ def user_challenges(model, duration, user_id):
 
 
 def set_scoreboard_cache(cache_key, scoreboard, member_challenges):
-    set_cached_stat(cache_key, scoreboard)
-    set_cached_stat(cache_key.replace("stats:scoreboard:", "stats:crews:", 1),
-                    aggregate_crews(scoreboard, member_challenges))
-
-
-def update_scoreboard_cache(model, cache_key, user_id, challenge_id):
-    current_scoreboard = get_cached_stat(cache_key) or []
-    updated_scoreboard = update_scoreboard(current_scoreboard, user_id)
-    crews_key = cache_key.replace("stats:scoreboard:", "stats:crews:", 1)
-    member_challenges = member_challenges_from_crews(get_cached_stat(crews_key) or [])
-    entry = next((item for item in updated_scoreboard if item["user_id"] == user_id), None)
-    if entry and parse_crew_tag(entry.get("name")):
-        if user_id in member_challenges:
-            member_challenges[user_id].add(challenge_id)
-        else:
-            duration = int(cache_key.rsplit(":", 1)[1])
-            member_challenges[user_id] = user_challenges(model, duration, user_id)
-    set_scoreboard_cache(cache_key, updated_scoreboard, member_challenges)
+    if zset_backend():
+        write_scoreboard(cache_key, scoreboard)
+    else:
+        set_cached_stat(cache_key, scoreboard)
+    rebuild_crew_index(crews_cache_key(cache_key), scoreboard, member_challenges)
+
+
+def add_ranked_solve(cache_key, user_id, solve_id):
+    user = get_scoreboard_user(user_id)
+    if user is None:
+        user = Users.query.get(user_id)
+        if user is None:
+            return None
+        user = {"name": user.name, "email": user.email}
+    return add_scoreboard_solve(cache_key, user_id, user, solve_id)
 
 
-def update_scoreboard(scoreboard, user_id, solve_delta=1):
+def update_scoreboard_cache(model, cache_key, user_id, challenge_id, solve_id=None):
+    if solve_id is None:
+        solve_id = model.solves().filter(Solves.user_id == user_id).with_entities(func.max(Solves.id)).scalar() or 0
+    if zset_backend():
+        entry = add_ranked_solve(cache_key, user_id, solve_id)
+    else:
+        scoreboard = update_scoreboard(get_cached_stat(cache_key) or [], user_id, last_solve_id=solve_id)
+        set_cached_stat(cache_key, scoreboard)
+        entry = next((item for item in scoreboard if item["user_id"] == user_id), None)
+    if not entry:
+        return
+
+    # Only the solver's crew changes: its total and unique challenges move by this solve, and it is re-placed in the
+    # crew orders. A crew index that has not been built yet is left to the next full rebuild.
+    crews_key = crews_cache_key(cache_key)
+    membership = get_crew_membership(user_id, entry["name"])
+    if membership and crew_index_exists(crews_key):
+        duration = int(cache_key.rsplit(":", 1)[1])
+        add_crew_solve(crews_key, user_id, entry["solves"], solve_id, challenge_id, membership,
+                       lambda: user_challenges(model, duration, user_id))
+
+
+def update_scoreboard(scoreboard, user_id, solve_delta=1, last_solve_id=None):
     result = [entry.copy() for entry in scoreboard]
 
     user_entry = None
@@ -93,6 +140,8 @@ def update_scoreboard(scoreboard, user_id, solve_delta=1):
         result.pop(user_index)
 
     user_entry["solves"] += solve_delta
+    if last_solve_id is not None:
+        user_entry["last_solve_id"] = last_solve_id
 
     new_solves = user_entry["solves"]
     insert_pos = 0
@@ -140,6 +189,7 @@ def calculate_scoreboard(model, duration):
         .over(order_by=(solves.desc(), func.max(Solves.id)))
         .label("rank")
     )
+    last_solve_id = func.max(Solves.id).label("last_solve_id")
     user_entities = [Solves.user_id, Users.name, Users.email]
     query = (
         model.solves()
@@ -147,7 +197,7 @@ def calculate_scoreboard(model, duration):
         .filter(required_filter)
         .group_by(*user_entities)
         .order_by(rank)
-        .with_entities(rank, solves, *user_entities)
+        .with_entities(rank, solves, last_solve_id, *user_entities)
     )
 
     row_results = query.all()
@@ -190,37 +240,330 @@ def handle_scoreboard_update(payload, event_timestamp=None):
         logger.warning(f"Unknown model_type: {model_type}")
         return
 
+    stale = stale_cache_keys([f"{cache_prefix}:{duration}" for duration in COMMON_DURATIONS], event_timestamp) if event_timestamp else set()
+    # A failure leaves the event pending; its retry skips the caches that were already rebuilt, as they are then newer.
     for duration in COMMON_DURATIONS:
-        try:
-            cache_key = f"{cache_prefix}:{duration}"
-            if event_timestamp and is_event_stale(cache_key, event_timestamp):
-                continue
-            logger.info(f"Calculating scoreboard for {model_type} {model_id}, duration={duration}...")
-            scoreboard = calculate_scoreboard(model, duration)
-            set_scoreboard_cache(cache_key, scoreboard, calculate_member_challenges(model, duration, scoreboard))
-            logger.info(f"Successfully updated scoreboard cache {cache_key} ({len(scoreboard)} entries)")
-        except Exception as e:
-            logger.error(f"Error calculating scoreboard for {model_type} {model_id}, duration={duration}: {e}", exc_info=True)
+        cache_key = f"{cache_prefix}:{duration}"
+        if cache_key in stale:
+            continue
+        logger.info(f"Calculating scoreboard for {model_type} {model_id}, duration={duration}...")
+        scoreboard = calculate_scoreboard(model, duration)
+        set_scoreboard_cache(cache_key, scoreboard, calculate_member_challenges(model, duration, scoreboard))
+        logger.info(f"Successfully updated scoreboard cache {cache_key} ({len(scoreboard)} entries)")
+
+    write_solve_buckets(cache_prefix, calculate_solve_buckets(model).get(None, {}))
 
     if model_type == "module":
-        try:
-            logger.info(f"Calculating challenge_solves for module {model_id}...")
-            challenge_solves = calculate_challenge_solves(model)
-            cache_key = challenge_solves_cache_key(model.dojo_id, model.module_index)
-            set_cached_stat(cache_key, challenge_solves)
-            logger.info(f"Successfully updated challenge_solves cache {cache_key} ({len(challenge_solves)} challenges)")
-        except Exception as e:
-            logger.error(f"Error calculating challenge_solves for module {model_id}: {e}", exc_info=True)
+        logger.info(f"Calculating challenge_solves for module {model_id}...")
+        challenge_solves = calculate_challenge_solves(model)
+        cache_key = challenge_solves_cache_key(model.dojo_id, model.module_index)
+        set_cached_stat(cache_key, challenge_solves)
+        logger.info(f"Successfully updated challenge_solves cache {cache_key} ({len(challenge_solves)} challenges)")
+
+
+@register_handler("user_update")
+def handle_user_update(payload, event_timestamp=None):
+    user_id = payload.get("user_id")
+    if user_id is None:
+        logger.warning(f"user_update event missing user_id: {payload}")
+        return
+
+    db.session.expire_all()
+    db.session.commit()
+
+    user = Users.query.get(user_id)
+    if not user:
+        logger.info(f"User {user_id} not found, skipping user update")
+        return
+
+    old_membership = get_crew_membership(user_id)
+    membership = set_crew_membership(user_id, user.name)
+    crew_changed = old_membership != membership
+    if zset_backend():
+        set_scoreboard_user(user_id, {"name": user.name, "email": user.email})
+
+    dojo_id = payload.get("dojo_id")
+    if dojo_id is not None:
+        dojos = Dojos.query.filter_by(dojo_id=dojo_id).all()
+    else:
+        dojo_ids = (
+            DojoChallenges.query
+            .join(Solves, Solves.challenge_id == DojoChallenges.challenge_id)
+            .filter(Solves.user_id == user_id)
+            .with_entities(DojoChallenges.dojo_id)
+            .distinct()
+        )
+        dojos = Dojos.query.filter(Dojos.dojo_id.in_(dojo_ids)).all()
+
+    try:
+        for dojo in dojos:
+            boards = [(dojo, f"stats:scoreboard:dojo:{dojo.dojo_id}")]
+            boards.extend((module, f"stats:scoreboard:module:{dojo.dojo_id}:{module.module_index}") for module in dojo.modules)
+            for model, cache_prefix in boards:
+                for duration in COMMON_DURATIONS:
+                    cache_key = f"{cache_prefix}:{duration}"
+                    if zset_backend():
+                        if crew_changed:
+                            scoreboard = read_scoreboard_entries(cache_key, crew_member_ids(crews_cache_key(cache_key)) + [user_id])
+                    else:
+                        scoreboard = get_cached_stat(cache_key) or []
+                        entry = next((item for item in scoreboard if item["user_id"] == user_id), None)
+                        if entry is None:
+                            continue
+                        if entry["name"] != user.name:
+                            entry["name"] = user.name
+                            set_cached_stat(cache_key, scoreboard)
+                    # A user who joins, leaves or switches crews changes the membership of two crews at once; renames
+                    # are rare enough that those boards' crews are simply rebuilt.
+                    if crew_changed:
+                        rebuild_crew_index(crews_cache_key(cache_key), scoreboard, calculate_member_challenges(model, duration, scoreboard))
+    except Exception:
+        # The event is retried, and its retry must still see the crew change to rebuild the boards it did not get to.
+        if crew_changed:
+            write_crew_membership(user_id, old_membership)
+        raise
+
+    logger.info(f"Updated user {user_id} on the scoreboards of {len(dojos)} dojo(s) (crew changed: {crew_changed})")
+
+
+def calculate_scoreboards(dojo, durations=COMMON_DURATIONS):
+    """
+    Compute the dojo board and every module board for all `durations` with a single grouped query.
+    Returns {(module_index, duration): scoreboard}, where module_index is None for the dojo board.
+    """
+    today = utc_today()
+    window_filters = {duration: Solves.date >= window_start(duration, today) for duration in durations if duration}
+    aggregates = []
+    for duration in durations:
+        solves = func.count(Solves.id)
+        last_solve_id = func.max(Solves.id)
+        if duration:
+            solves = solves.filter(window_filters[duration])
+            last_solve_id = last_solve_id.filter(window_filters[duration])
+        aggregates.extend([solves.label(f"solves_{duration}"), last_solve_id.label(f"last_solve_id_{duration}")])
+    user_entities = [Solves.user_id, Users.name, Users.email]
+    query = (
+        dojo.solves()
+        .filter(DojoChallenges.required == True)
+        .group_by(DojoChallenges.module_index, *user_entities)
+        .with_entities(DojoChallenges.module_index, *user_entities, *aggregates)
+    )
+    if durations and all(durations):
+        query = query.filter(or_(*window_filters.values()))
+
+    totals = {}
+    for row in query.all():
+        for duration in durations:
+            solves = getattr(row, f"solves_{duration}")
+            if not solves:
+                continue
+            last_solve_id = getattr(row, f"last_solve_id_{duration}")
+            totals.setdefault((row.module_index, duration), {})[row.user_id] = [solves, last_solve_id, row.name, row.email]
+            dojo_total = totals.setdefault((None, duration), {}).setdefault(row.user_id, [0, 0, row.name, row.email])
+            dojo_total[0] += solves
+            dojo_total[1] = max(dojo_total[1], last_solve_id)
+
+    scoreboards = {(module.module_index, duration): [] for module in dojo.modules for duration in durations}
+    scoreboards.update({(None, duration): [] for duration in durations})
+    for board, users in totals.items():
+        ranked = sorted(users.items(), key=lambda item: (-item[1][0], item[1][1]))
+        scoreboards[board] = [
+            {"rank": rank, "solves": solves, "last_solve_id": last_solve_id, "user_id": user_id, "name": name, "email": email}
+            for rank, (user_id, (solves, last_solve_id, name, email)) in enumerate(ranked, start=1)
+        ]
+    return scoreboards
+
+
+def bucket_prefix(cache_prefix):
+    return cache_prefix.replace("stats:scoreboard:", "stats:buckets:", 1)
+
+
+def bucket_key(cache_prefix, day):
+    return f"{bucket_prefix(cache_prefix)}:{day.isoformat()}"
+
+
+def bucket_expiry(day):
+    return datetime.datetime.combine(day + datetime.timedelta(days=BUCKET_RETENTION_DAYS), datetime.time(), tzinfo=datetime.timezone.utc)
+
+
+def calculate_solve_buckets(model, by_module=False):
+    """
+    Count each user's required solves per UTC day over the longest window.
+    Returns {module_index: {day: {user_id: solves}}}, with the whole model's buckets under None.
+    """
+    day = func.date(Solves.date).label("day")
+    module_entities = [DojoChallenges.module_index] if by_module else []
+    query = (
+        model.solves()
+        .filter(DojoChallenges.required == True)
+        .filter(Solves.date >= window_start(max(WINDOWED_DURATIONS)))
+        .group_by(*module_entities, Solves.user_id, day)
+        .with_entities(*module_entities, Solves.user_id, day, func.count().label("solves"))
+    )
+    buckets = {}
+    for row in query.all():
+        user_buckets = buckets.setdefault(None, {}).setdefault(row.day, {})
+        user_buckets[row.user_id] = user_buckets.get(row.user_id, 0) + row.solves
+        if by_module:
+            buckets.setdefault(row.module_index, {}).setdefault(row.day, {})[row.user_id] = row.solves
+    return buckets
+
+
+def write_solve_buckets(cache_prefix, buckets, today=None):
+    today = today or utc_today()
+    r = get_redis_client()
+    pipeline = r.pipeline()
+    for days_ago in range(BUCKET_RETENTION_DAYS):
+        pipeline.delete(bucket_key(cache_prefix, today - datetime.timedelta(days=days_ago)))
+    for day, counts in buckets.items():
+        pipeline.hset(bucket_key(cache_prefix, day), mapping=counts)
+        pipeline.expireat(bucket_key(cache_prefix, day), bucket_expiry(day))
+    pipeline.set(f"{bucket_prefix(cache_prefix)}:rolled", today.isoformat())
+    pipeline.execute()
+
+
+def add_solve_bucket(cache_prefix, user_id, day):
+    pipeline = get_redis_client().pipeline()
+    pipeline.hincrby(bucket_key(cache_prefix, day), user_id, 1)
+    pipeline.expireat(bucket_key(cache_prefix, day), bucket_expiry(day))
+    pipeline.execute()
+
+
+def subtract_expired(scoreboard, expired):
+    result = []
+    for entry in scoreboard:
+        solves = entry["solves"] - expired.get(entry["user_id"], 0)
+        if solves > 0:
+            result.append({**entry, "solves": solves})
+    # The expired bucket is the oldest day in the window, so every remaining user's last solve is unchanged.
+    result.sort(key=lambda entry: (-entry["solves"], entry.get("last_solve_id", 0)))
+    for rank, entry in enumerate(result, start=1):
+        entry["rank"] = rank
+    return result
+
+
+def roll_scoreboard_windows(model, cache_prefix, today=None):
+    """
+    Subtract the daily buckets that left each window since the board was last rolled.
+    Returns False when the board has no buckets to roll from and must be recomputed instead.
+    Raises redis.WatchError if the board kept changing underneath every attempt to roll it.
+    """
+    today = today or utc_today()
+    r = get_redis_client()
+    marker = f"{bucket_prefix(cache_prefix)}:rolled"
+    board_keys = [f"{cache_prefix}:{duration}" for duration in WINDOWED_DURATIONS]
+    for attempt in range(1, ROLL_ATTEMPTS + 1):
+        with r.pipeline() as pipeline:
+            pipeline.watch(marker, *board_keys, *(ranking_key(key) for key in board_keys))
+            rolled = pipeline.get(marker)
+            if rolled is None:
+                return False
+            rolled = datetime.date.fromisoformat(rolled)
+            elapsed_days = (today - rolled).days
+            if elapsed_days <= 0:
+                return True
+            if elapsed_days > BUCKET_RETENTION_DAYS - max(WINDOWED_DURATIONS):
+                return False
+
+            expired = {}
+            for duration in WINDOWED_DURATIONS:
+                expired[duration] = {}
+                for offset in range(elapsed_days):
+                    day = rolled - datetime.timedelta(days=duration - 1 - offset)
+                    for user_id, solves in pipeline.hgetall(bucket_key(cache_prefix, day)).items():
+                        expired[duration][int(user_id)] = expired[duration].get(int(user_id), 0) + int(solves)
+            boards = {} if zset_backend() else {duration: get_cached_stat(f"{cache_prefix}:{duration}") or [] for duration in WINDOWED_DURATIONS}
+
+            pipeline.multi()
+            for duration in WINDOWED_DURATIONS:
+                cache_key = f"{cache_prefix}:{duration}"
+                if zset_backend():
+                    for user_id, solves in expired[duration].items():
+                        pipeline.zincrby(ranking_key(cache_key), -solves * TIE_BREAK_SPAN, user_id)
+                    pipeline.zremrangebyscore(ranking_key(cache_key), "-inf", f"({TIE_BREAK_SPAN}")
+                else:
+                    boards[duration] = subtract_expired(boards[duration], expired[duration])
+                    pipeline.set(cache_key, encode_stat(boards[duration]))
+                pipeline.set(f"{cache_key}:updated", str(get_redis_time(r)))
+            pipeline.set(marker, today.isoformat())
+            try:
+                pipeline.execute()
+                break
+            except redis.WatchError:
+                # A solve landed on the board while it was being rolled; roll it again from what the solve left behind.
+                if attempt == ROLL_ATTEMPTS:
+                    raise
+                logger.info(f"Scoreboard {cache_prefix} changed while rolling its windows, retrying (attempt {attempt})")
+
+    for duration in WINDOWED_DURATIONS:
+        cache_key = f"{cache_prefix}:{duration}"
+        record_cache_update(cache_key)
+        if zset_backend():
+            scoreboard = read_scoreboard_entries(cache_key, crew_member_ids(crews_cache_key(cache_key)))
+        else:
+            scoreboard = boards[duration]
+        rebuild_crew_index(crews_cache_key(cache_key), scoreboard, calculate_member_challenges(model, duration, scoreboard))
+    logger.info(f"Rolled scoreboard windows for {cache_prefix} from {rolled} to {today}")
+    return True
+
+
+def roll_all_scoreboard_windows(shards=None):
+    dojos = Dojos.query.all()
+    if shards is not None:
+        dojos = [dojo for dojo in dojos if event_shard(dojo.dojo_id) in shards]
+    failed = []
+    for dojo in dojos:
+        boards = [(dojo, "dojo", dojo.dojo_id, f"stats:scoreboard:dojo:{dojo.dojo_id}")]
+        boards.extend(
+            (module, "module", {"dojo_id": dojo.dojo_id, "module_index": module.module_index}, f"stats:scoreboard:module:{dojo.dojo_id}:{module.module_index}")
+            for module in dojo.modules
+        )
+        for model, model_type, model_id, cache_prefix in boards:
+            # One board failing must not keep the others from rolling; the failure is raised once they all had their turn.
+            try:
+                if not roll_scoreboard_windows(model, cache_prefix):
+                    logger.info(f"No solve buckets to roll for {cache_prefix}, recomputing")
+                    handle_scoreboard_update({"model_type": model_type, "model_id": model_id})
+            except Exception as e:
+                logger.error(f"Error rolling scoreboard windows for {cache_prefix}: {e}", exc_info=True)
+                failed.append(cache_prefix)
+    if failed:
+        raise RuntimeError(f"Failed to roll scoreboard windows for {len(failed)} board(s): {failed}")
 
 
-def initialize_all_scoreboards():
+def roll_due_scoreboard_windows(shards=None):
+    global _windows_rolled_on
+    today = utc_today()
+    if _windows_rolled_on == today:
+        return
+    # Only marked rolled once every board has rolled, so that a failed board is retried on the next poll.
+    roll_all_scoreboard_windows(shards)
+    _windows_rolled_on = today
+
+
+def initialize_all_scoreboards(durations=COMMON_DURATIONS):
     dojos = Dojos.query.all()
-    logger.info(f"Initializing scoreboards for {len(dojos)} dojos...")
+    logger.info(f"Initializing scoreboards for {len(dojos)} dojos (durations={durations})...")
 
     for dojo in dojos:
-        for duration in COMMON_DURATIONS:
+        try:
+            scoreboards = calculate_scoreboards(dojo, durations)
+        except Exception as e:
+            logger.error(f"Error calculating scoreboards for dojo {dojo.reference_id}: {e}", exc_info=True)
+            continue
+
+        if any(durations):
+            try:
+                buckets = calculate_solve_buckets(dojo, by_module=True)
+                write_solve_buckets(f"stats:scoreboard:dojo:{dojo.dojo_id}", buckets.pop(None, {}))
+                for module in dojo.modules:
+                    write_solve_buckets(f"stats:scoreboard:module:{dojo.dojo_id}:{module.module_index}", buckets.get(module.module_index, {}))
+            except Exception as e:
+                logger.error(f"Error initializing solve buckets for dojo {dojo.reference_id}: {e}", exc_info=True)
+
+        for duration in durations:
             try:
-                scoreboard = calculate_scoreboard(dojo, duration)
+                scoreboard = scoreboards[(None, duration)]
                 cache_key = f"stats:scoreboard:dojo:{dojo.dojo_id}:{duration}"
                 set_scoreboard_cache(cache_key, scoreboard, calculate_member_challenges(dojo, duration, scoreboard))
                 logger.info(f"Initialized scoreboard for dojo {dojo.reference_id} (id={dojo.dojo_id}), duration={duration}")
@@ -228,9 +571,9 @@ def initialize_all_scoreboards():
                 logger.error(f"Error initializing scoreboard for dojo {dojo.reference_id}, duration={duration}: {e}", exc_info=True)
 
         for module in dojo.modules:
-            for duration in COMMON_DURATIONS:
+            for duration in durations:
                 try:
-                    scoreboard = calculate_scoreboard(module, duration)
+                    scoreboard = scoreboards.get((module.module_index, duration), [])
                     cache_key = f"stats:scoreboard:module:{module.dojo_id}:{module.module_index}:{duration}"
                     set_scoreboard_cache(cache_key, scoreboard, calculate_member_challenges(module, duration, scoreboard))
                     logger.info(f"Initialized scoreboard for module {dojo.reference_id}/{module.id} (dojo_id={module.dojo_id}, module_index={module.module_index}), duration={duration}")
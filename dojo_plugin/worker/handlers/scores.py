@@ -1,8 +1,10 @@
+import bisect
 import logging
 from sqlalchemy.sql import or_
 from CTFd.models import Solves, db
 from ...models import Dojos, DojoChallenges
-from ...utils.background_stats import get_cached_stat, set_cached_stat, is_event_stale
+from ...utils.background_stats import get_cached_stat, set_cached_stat, is_event_stale, stale_cache_keys
+from ...utils.scores import rank_index_key, write_rank_index, OFFICIAL_SCORES_KEY
 from . import register_handler
 
 logger = logging.getLogger(__name__)
@@ -18,16 +20,17 @@ def module_scores_cache_key(dojo_id, module_index):
 
 def _scores_query(granularity, dojo_filter):
     solve_count = db.func.count(Solves.id).label("solve_count")
-    last_solve_date = db.func.max(Solves.date).label("last_solve_date")
-    fields = granularity + [Solves.user_id, solve_count, last_solve_date]
+    last_solve_id = db.func.max(Solves.id).label("last_solve_id")
+    fields = granularity + [Solves.user_id, solve_count, last_solve_id]
     grouping = granularity + [Solves.user_id]
 
+    # Ties go to the earlier last solve by solve id, as in the rank indexes, so that both orders agree.
     dsc_query = db.session.query(*fields).where(
         Dojos.dojo_id == DojoChallenges.dojo_id,
         DojoChallenges.challenge_id == Solves.challenge_id,
         DojoChallenges.required,
         dojo_filter
-    ).group_by(*grouping).order_by(Dojos.dojo_id, solve_count.desc(), last_solve_date)
+    ).group_by(*grouping).order_by(Dojos.dojo_id, solve_count.desc(), last_solve_id)
 
     return dsc_query
 
@@ -40,11 +43,13 @@ def calculate_dojo_scores(dojo_id):
 
     ranks = []
     solves = {}
-    for _, user_id, solve_count, _ in dsc_query:
+    last_solve_ids = {}
+    for _, user_id, solve_count, last_solve_id in dsc_query:
         ranks.append(user_id)
         solves[user_id] = solve_count
+        last_solve_ids[user_id] = last_solve_id
 
-    return {"ranks": ranks, "solves": solves}
+    return {"ranks": ranks, "solves": solves, "last_solve_ids": last_solve_ids}
 
 
 def calculate_module_scores(dojo_id, module_index):
@@ -55,11 +60,68 @@ def calculate_module_scores(dojo_id, module_index):
 
     ranks = []
     solves = {}
-    for _, _, user_id, solve_count, _ in dsc_query:
+    last_solve_ids = {}
+    for _, _, user_id, solve_count, last_solve_id in dsc_query:
         ranks.append(user_id)
         solves[user_id] = solve_count
+        last_solve_ids[user_id] = last_solve_id
+
+    return {"ranks": ranks, "solves": solves, "last_solve_ids": last_solve_ids}
+
+
+def set_scores_cache(cache_key, scores):
+    last_solve_ids = scores.pop("last_solve_ids", {})
+    set_cached_stat(cache_key, scores)
+    write_rank_index(rank_index_key(cache_key), [
+        (user_id, scores["solves"][user_id], last_solve_ids.get(user_id, 0)) for user_id in scores["ranks"]
+    ])
+
+
+def calculate_official_scores():
+    # A challenge imported into several official dojos counts once; its solves are applied by the lowest such dojo.
+    official_challenges = (
+        DojoChallenges.query
+        .join(Dojos, Dojos.dojo_id == DojoChallenges.dojo_id)
+        .filter(Dojos.official, DojoChallenges.visible())
+        .with_entities(DojoChallenges.challenge_id, db.func.min(DojoChallenges.dojo_id).label("dojo_id"))
+        .group_by(DojoChallenges.challenge_id)
+        .subquery()
+    )
+    challenge_dojos = {challenge_id: dojo_id for challenge_id, dojo_id in db.session.query(official_challenges)}
+    dojo_ids = [dojo_id for dojo_id, in Dojos.query.filter(Dojos.official).with_entities(Dojos.dojo_id)]
+    ranking = (
+        db.session.query(Solves.user_id, db.func.count(Solves.id), db.func.max(Solves.id))
+        .join(official_challenges, official_challenges.c.challenge_id == Solves.challenge_id)
+        .group_by(Solves.user_id)
+    )
+    return {
+        "max_score": len(challenge_dojos),
+        "challenge_dojos": challenge_dojos,
+        "dojo_ids": dojo_ids,
+        "entries": [(user_id, solve_count, last_solve_id) for user_id, solve_count, last_solve_id in ranking],
+    }
 
-    return {"ranks": ranks, "solves": solves}
+
+def set_official_scores_cache(official):
+    # The ranking is written before the cache that marks it as built, so readers never see a partial ranking.
+    write_rank_index(rank_index_key(OFFICIAL_SCORES_KEY), official["entries"])
+    set_cached_stat(OFFICIAL_SCORES_KEY, {key: official[key] for key in ("max_score", "challenge_dojos", "dojo_ids")})
+
+
+def is_official_scores_dojo(dojo_id, dojo=None):
+    if dojo is not None and dojo.official:
+        return True
+    # A dojo that stopped being official, or was deleted, still changes the ranking it was part of.
+    cached = get_cached_stat(OFFICIAL_SCORES_KEY)
+    return cached is not None and dojo_id in cached.get("dojo_ids", [])
+
+
+def update_official_scores(event_timestamp=None):
+    if event_timestamp and is_event_stale(OFFICIAL_SCORES_KEY, event_timestamp):
+        return
+    official = calculate_official_scores()
+    set_official_scores_cache(official)
+    logger.info(f"Updated official scores for {len(official['entries'])} users over {official['max_score']} challenges")
 
 
 def update_dojo_scores(scores, user_id):
@@ -70,17 +132,20 @@ def update_dojo_scores(scores, user_id):
     new_solve_count = old_solve_count + 1
     solves[user_id] = new_solve_count
 
-    if user_id in ranks:
-        ranks.remove(user_id)
+    # Ranks are ordered by solve count, so both positions are found by bisection; only the user's ties are scanned.
+    def sort_key(other_user_id):
+        return -solves.get(other_user_id, 0) if other_user_id != user_id else -old_solve_count
 
-    insert_pos = 0
-    for i, other_user_id in enumerate(ranks):
-        other_solves = solves.get(other_user_id, 0)
-        if other_solves >= new_solve_count:
-            insert_pos = i + 1
-        else:
-            break
+    if old_solve_count:
+        start = bisect.bisect_left(ranks, -old_solve_count, key=sort_key)
+        end = bisect.bisect_right(ranks, -old_solve_count, key=sort_key)
+        position = next((i for i in range(start, end) if ranks[i] == user_id), None)
+        if position is None and user_id in ranks:
+            position = ranks.index(user_id)
+        if position is not None:
+            del ranks[position]
 
+    insert_pos = bisect.bisect_right(ranks, -new_solve_count, key=sort_key)
     ranks.insert(insert_pos, user_id)
 
     return {"ranks": ranks, "solves": solves}
@@ -96,13 +161,17 @@ def handle_scores_update(payload, event_timestamp=None):
     db.session.commit()
 
     dojo_id = payload.get("dojo_id")
+    official_changed = dojo_id is None
 
     if dojo_id is not None:
         dojo = Dojos.query.filter_by(dojo_id=dojo_id).first()
         if not dojo:
             logger.info(f"Dojo {dojo_id} not found, skipping scores update")
+            if is_official_scores_dojo(dojo_id):
+                update_official_scores(event_timestamp)
             return
         dojos = [dojo]
+        official_changed = is_official_scores_dojo(dojo_id, dojo)
         logger.info(f"Calculating scores for single dojo: {dojo_id}")
     else:
         dojos = Dojos.query.filter(
@@ -112,27 +181,31 @@ def handle_scores_update(payload, event_timestamp=None):
 
     for dojo in dojos:
         dojo_id = dojo.dojo_id
-        try:
-            cache_key = dojo_scores_cache_key(dojo_id)
-            if not (event_timestamp and is_event_stale(cache_key, event_timestamp)):
-                dojo_data = calculate_dojo_scores(dojo_id)
-                set_cached_stat(cache_key, dojo_data)
-        except Exception as e:
-            logger.error(f"Error calculating dojo scores for dojo_id {dojo_id}: {e}", exc_info=True)
+        cache_keys = [dojo_scores_cache_key(dojo_id), *(module_scores_cache_key(dojo_id, module.module_index) for module in dojo.modules)]
+        # A failure leaves the event pending; its retry skips the caches that were already rebuilt, as they are then newer.
+        stale = stale_cache_keys(cache_keys, event_timestamp) if event_timestamp else set()
+        cache_key = dojo_scores_cache_key(dojo_id)
+        if cache_key not in stale:
+            dojo_data = calculate_dojo_scores(dojo_id)
+            set_scores_cache(cache_key, dojo_data)
 
         for module in dojo.modules:
-            module_index = module.module_index
-            try:
-                cache_key = module_scores_cache_key(dojo_id, module_index)
-                if not (event_timestamp and is_event_stale(cache_key, event_timestamp)):
-                    module_data = calculate_module_scores(dojo_id, module_index)
-                    set_cached_stat(cache_key, module_data)
-            except Exception as e:
-                logger.error(f"Error calculating module scores for dojo_id {dojo_id} module {module_index}: {e}", exc_info=True)
+            cache_key = module_scores_cache_key(dojo_id, module.module_index)
+            if cache_key not in stale:
+                module_data = calculate_module_scores(dojo_id, module.module_index)
+                set_scores_cache(cache_key, module_data)
+
+    if official_changed:
+        update_official_scores(event_timestamp)
 
     logger.info(f"Successfully updated scores cache for {len(dojos)} dojos")
 
 
+def initialize_official_scores():
+    logger.info("Initializing official scores...")
+    update_official_scores()
+
+
 def initialize_all_scores():
     logger.info("Initializing all scores...")
     handle_scores_update({})
@@ -1,23 +1,35 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import func
 
-from CTFd.models import db
+from CTFd.models import db, Solves
 from ...models import DojoChallenges
-from ...utils.background_stats import get_cached_stat, set_cached_stat, is_event_stale
+from ...utils.background_stats import (
+    get_cached_stat, set_cached_stat, is_event_stale, stale_cache_keys, get_redis_client, get_redis_time,
+)
+from ...utils.metrics import record_cache_update
+from ...utils.stats import update_dojo_stats
+from ...utils.scores import rank_index_key, add_rank_index_solve, OFFICIAL_SCORES_KEY
 from . import register_handler
-from .scoreboard import update_scoreboard_cache, update_challenge_solves, challenge_solves_cache_key, COMMON_DURATIONS
-from .dojo_stats import update_dojo_stats
+from .scoreboard import (
+    update_scoreboard_cache, update_challenge_solves, challenge_solves_cache_key, add_solve_bucket, utc_today,
+    COMMON_DURATIONS, WINDOWED_DURATIONS,
+)
 from .scores import update_dojo_scores, update_module_scores, dojo_scores_cache_key, module_scores_cache_key
 from .activity import update_activity
 
 logger = logging.getLogger(__name__)
 
 
+# Failures propagate, so that the event is retried. Each cache is marked updated as it is written, so a retry only
+# applies the solve to the caches that it did not reach the first time.
 @register_handler("challenge_solve")
 def handle_challenge_solve(payload, event_timestamp):
     user_id = payload.get("user_id")
     challenge_id = payload.get("challenge_id")
     solve_date_str = payload.get("solve_date")
+    partition_dojo_id = payload.get("dojo_id")
+    solve_id = payload.get("solve_id")
 
     if user_id is None or challenge_id is None:
         logger.warning(f"challenge_solve event missing required fields: {payload}")
@@ -32,7 +44,10 @@ def handle_challenge_solve(payload, event_timestamp):
     db.session.expire_all()
     db.session.commit()
 
-    dojo_challenges = DojoChallenges.query.filter_by(challenge_id=challenge_id).all()
+    dojo_challenges = DojoChallenges.query.filter_by(challenge_id=challenge_id)
+    if partition_dojo_id is not None:
+        dojo_challenges = dojo_challenges.filter_by(dojo_id=partition_dojo_id)
+    dojo_challenges = dojo_challenges.all()
     logger.info(f"Found {len(dojo_challenges)} dojo(s) containing challenge_id={challenge_id}")
 
     for dojo_challenge in dojo_challenges:
@@ -47,11 +62,11 @@ def handle_challenge_solve(payload, event_timestamp):
 
         if is_member and dojo_challenge.required:
             logger.info(f"Updating dojo scoreboard for dojo {dojo_ref_id}")
-            _update_dojo_scoreboard(dojo, user_id, challenge_id, event_timestamp)
+            _update_dojo_scoreboard(dojo, user_id, challenge_id, solve_id, solve_date, event_timestamp)
             logger.info(f"Updating module scoreboard for dojo {dojo_ref_id} module {module_index}")
-            _update_module_scoreboard(dojo_challenge.module, user_id, challenge_id, event_timestamp)
+            _update_module_scoreboard(dojo_challenge.module, user_id, challenge_id, solve_id, solve_date, event_timestamp)
             logger.info(f"Updating dojo stats for dojo {dojo_ref_id}")
-            _update_dojo_stats(dojo_ref_id, challenge_name, event_timestamp)
+            _update_dojo_stats(dojo, user_id, challenge_id, challenge_name, solve_date, event_timestamp)
             logger.info(f"Updating challenge solves for dojo {dojo_ref_id} module {module_index}")
             _update_challenge_solves(dojo_id, module_index, challenge_id, event_timestamp)
         else:
@@ -59,52 +74,69 @@ def handle_challenge_solve(payload, event_timestamp):
 
         if is_public_or_official and dojo_challenge.required:
             logger.info(f"Updating scores for dojo {dojo_ref_id}")
-            _update_scores(dojo_id, module_index, user_id, event_timestamp)
+            _update_scores(dojo_id, module_index, user_id, challenge_id, solve_id, event_timestamp)
         else:
             logger.info(f"Dojo {dojo_ref_id} is not public or official, or challenge {challenge_name} is optional; skipping scores update")
 
-    logger.info(f"Updating activity for user {user_id}")
-    _update_user_activity(user_id, solve_date, event_timestamp)
+    _update_official_scores(user_id, challenge_id, solve_id, partition_dojo_id, event_timestamp)
+
+    if partition_dojo_id is None:
+        logger.info(f"Updating activity for user {user_id}")
+        _update_user_activity(user_id, solve_date, event_timestamp)
     logger.info(f"Completed challenge_solve for user_id={user_id}, challenge_id={challenge_id}")
 
 
-def _update_dojo_scoreboard(dojo, user_id, challenge_id, event_timestamp):
+def _update_dojo_scoreboard(dojo, user_id, challenge_id, solve_id, solve_date, event_timestamp):
     cache_prefix = f"stats:scoreboard:dojo:{dojo.dojo_id}"
+    stale = stale_cache_keys([f"{cache_prefix}:{duration}" for duration in COMMON_DURATIONS], event_timestamp)
     for duration in COMMON_DURATIONS:
-        try:
-            cache_key = f"{cache_prefix}:{duration}"
-            if is_event_stale(cache_key, event_timestamp):
-                continue
-            update_scoreboard_cache(dojo, cache_key, user_id, challenge_id)
-        except Exception as e:
-            logger.error(f"Error updating dojo scoreboard for dojo {dojo.dojo_id}, duration={duration}: {e}", exc_info=True)
+        cache_key = f"{cache_prefix}:{duration}"
+        if cache_key in stale:
+            continue
+        update_scoreboard_cache(dojo, cache_key, user_id, challenge_id, solve_id)
+        if duration == max(WINDOWED_DURATIONS):
+            add_solve_bucket(cache_prefix, user_id, solve_date.date() if solve_date else utc_today())
 
 
-def _update_module_scoreboard(module, user_id, challenge_id, event_timestamp):
+def _update_module_scoreboard(module, user_id, challenge_id, solve_id, solve_date, event_timestamp):
     cache_prefix = f"stats:scoreboard:module:{module.dojo_id}:{module.module_index}"
+    stale = stale_cache_keys([f"{cache_prefix}:{duration}" for duration in COMMON_DURATIONS], event_timestamp)
     for duration in COMMON_DURATIONS:
-        try:
-            cache_key = f"{cache_prefix}:{duration}"
-            if is_event_stale(cache_key, event_timestamp):
-                continue
-            update_scoreboard_cache(module, cache_key, user_id, challenge_id)
-        except Exception as e:
-            logger.error(f"Error updating module scoreboard for dojo {module.dojo_id} module {module.module_index}, duration={duration}: {e}", exc_info=True)
+        cache_key = f"{cache_prefix}:{duration}"
+        if cache_key in stale:
+            continue
+        update_scoreboard_cache(module, cache_key, user_id, challenge_id, solve_id)
+        if duration == max(WINDOWED_DURATIONS):
+            add_solve_bucket(cache_prefix, user_id, solve_date.date() if solve_date else utc_today())
 
 
-def _update_dojo_stats(dojo_ref_id, challenge_name, event_timestamp):
-    cache_key = f"stats:dojo:{dojo_ref_id}"
+def _update_dojo_stats(dojo, user_id, challenge_id, challenge_name, solve_date, event_timestamp):
+    cache_key = f"stats:dojo:{dojo.reference_id}"
     if is_event_stale(cache_key, event_timestamp):
         return
     current_stats = get_cached_stat(cache_key)
-    if not current_stats:
-        logger.info(f"No cached stats for dojo {dojo_ref_id}, skipping incremental update")
+    if not current_stats or 'daily' not in current_stats:
+        logger.info(f"No cached stats for dojo {dojo.reference_id}, skipping incremental update")
+        return
+    solve_date = solve_date or datetime.utcnow()
+    day_start = datetime.combine(solve_date.date(), datetime.min.time())
+    # The stats only count solves that dojo.solves() counts, which also says whether this is the user's first.
+    counted, user_solves, user_day_solves = (
+        dojo.solves()
+        .filter(Solves.user_id == user_id)
+        .with_entities(
+            func.count(Solves.id).filter(Solves.challenge_id == challenge_id),
+            func.count(Solves.id),
+            func.count(Solves.id).filter(Solves.date >= day_start, Solves.date < day_start + timedelta(days=1)),
+        )
+        .first()
+    )
+    if not counted:
+        logger.info(f"Solve by user {user_id} is not counted in dojo {dojo.reference_id} stats, skipping incremental update")
         return
-    try:
-        updated_stats = update_dojo_stats(current_stats, challenge_name)
-        set_cached_stat(cache_key, updated_stats)
-    except Exception as e:
-        logger.error(f"Error updating dojo stats for {dojo_ref_id}: {e}", exc_info=True)
+    updated_stats = update_dojo_stats(current_stats, challenge_name, solve_date,
+                                      new_user=user_solves == 1, new_day_user=user_day_solves == 1)
+    set_cached_stat(cache_key, updated_stats)
 
 
 def _update_challenge_solves(dojo_id, module_index, challenge_id, event_timestamp):
@@ -115,42 +147,60 @@ def _update_challenge_solves(dojo_id, module_index, challenge_id, event_timestam
     if not current:
         logger.info(f"No cached challenge_solves for dojo {dojo_id} module {module_index}, skipping incremental update")
         return
-    try:
-        updated = update_challenge_solves(current, challenge_id)
-        set_cached_stat(cache_key, updated)
-    except Exception as e:
-        logger.error(f"Error updating challenge_solves for dojo {dojo_id} module {module_index}: {e}", exc_info=True)
+    updated = update_challenge_solves(current, challenge_id)
+    set_cached_stat(cache_key, updated)
+
+
+def _lookup_solve_id(user_id, challenge_id, solve_id):
+    if solve_id is None:
+        solve_id = Solves.query.filter_by(user_id=user_id, challenge_id=challenge_id).with_entities(Solves.id).scalar() or 0
+    return solve_id
+
+
+def _update_scores(dojo_id, module_index, user_id, challenge_id, solve_id, event_timestamp):
+    solve_id = _lookup_solve_id(user_id, challenge_id, solve_id)
 
+    stale = stale_cache_keys([dojo_scores_cache_key(dojo_id), module_scores_cache_key(dojo_id, module_index)], event_timestamp)
 
-def _update_scores(dojo_id, module_index, user_id, event_timestamp):
     logger.info(f"Updating dojo scores for dojo_id={dojo_id}, user_id={user_id}")
-    try:
-        cache_key = dojo_scores_cache_key(dojo_id)
-        if not is_event_stale(cache_key, event_timestamp):
-            current_scores = get_cached_stat(cache_key) or {"ranks": [], "solves": {}}
-            updated_scores = update_dojo_scores(current_scores, user_id)
-            set_cached_stat(cache_key, updated_scores)
-    except Exception as e:
-        logger.error(f"Error updating dojo scores: {e}", exc_info=True)
+    cache_key = dojo_scores_cache_key(dojo_id)
+    if cache_key not in stale:
+        current_scores = get_cached_stat(cache_key) or {"ranks": [], "solves": {}}
+        updated_scores = update_dojo_scores(current_scores, user_id)
+        set_cached_stat(cache_key, updated_scores)
+        add_rank_index_solve(rank_index_key(cache_key), user_id, solve_id)
 
     logger.info(f"Updating module scores for dojo_id={dojo_id}, module_index={module_index}, user_id={user_id}")
-    try:
-        cache_key = module_scores_cache_key(dojo_id, module_index)
-        if not is_event_stale(cache_key, event_timestamp):
-            current_scores = get_cached_stat(cache_key) or {"ranks": [], "solves": {}}
-            updated_scores = update_module_scores(current_scores, user_id)
-            set_cached_stat(cache_key, updated_scores)
-    except Exception as e:
-        logger.error(f"Error updating module scores: {e}", exc_info=True)
+    cache_key = module_scores_cache_key(dojo_id, module_index)
+    if cache_key not in stale:
+        current_scores = get_cached_stat(cache_key) or {"ranks": [], "solves": {}}
+        updated_scores = update_module_scores(current_scores, user_id)
+        set_cached_stat(cache_key, updated_scores)
+        add_rank_index_solve(rank_index_key(cache_key), user_id, solve_id)
+
+
+def _update_official_scores(user_id, challenge_id, solve_id, partition_dojo_id, event_timestamp):
+    if is_event_stale(OFFICIAL_SCORES_KEY, event_timestamp):
+        return
+    official = get_cached_stat(OFFICIAL_SCORES_KEY)
+    if not official:
+        logger.info("No cached official scores, skipping incremental update")
+        return
+    owner_dojo_id = official["challenge_dojos"].get(str(challenge_id))
+    # Sharded solves arrive once per dojo; only the dojo that owns the challenge in the ranking applies it.
+    if owner_dojo_id is None or partition_dojo_id not in (None, owner_dojo_id):
+        return
+    solve_id = _lookup_solve_id(user_id, challenge_id, solve_id)
+    add_rank_index_solve(rank_index_key(OFFICIAL_SCORES_KEY), user_id, solve_id)
+    r = get_redis_client()
+    r.set(f"{OFFICIAL_SCORES_KEY}:updated", str(get_redis_time(r)))
+    record_cache_update(OFFICIAL_SCORES_KEY)
 
 
 def _update_user_activity(user_id, solve_date, event_timestamp):
     cache_key = f"stats:activity:{user_id}"
     if is_event_stale(cache_key, event_timestamp):
         return
-    current_activity = get_cached_stat(cache_key) or {'solve_timestamps': [], 'total_solves': 0}
-    try:
-        updated_activity = update_activity(current_activity, solve_date)
-        set_cached_stat(cache_key, updated_activity)
-    except Exception as e:
-        logger.error(f"Error updating activity for user_id {user_id}: {e}", exc_info=True)
+    current_activity = get_cached_stat(cache_key) or {}
+    updated_activity = update_activity(current_activity, solve_date)
+    set_cached_stat(cache_key, updated_activity)
@@ -0,0 +1,56 @@
+import logging
+
+import redis
+from CTFd.models import db, Users
+
+from ...api.v1.docker import start_challenge_with_retries
+from ...models import DojoChallenges
+from ...utils.background_stats import get_redis_client
+from ...utils.request_logging import set_trace_id
+from ...utils.start_jobs import update_start_job
+
+logger = logging.getLogger(__name__)
+
+# Held for the whole start, like the lock a synchronous start takes, so that the user cannot start two at once.
+START_JOB_LOCK_SECONDS = 300
+
+
+def handle_start_job(request):
+    job_id = request["job_id"]
+    r = get_redis_client()
+    try:
+        set_trace_id(request.get("trace_id", "NONE"), request["user_id"])
+        user = Users.query.get(request["user_id"])
+        as_user = Users.query.get(request["as_user_id"]) if request.get("as_user_id") else None
+        dojo_challenge = DojoChallenges.query.get((request["dojo_id"], request["module_index"], request["challenge_index"]))
+        if not user or not dojo_challenge:
+            update_start_job(job_id, r, status="failed", phase="failed", error="Invalid challenge")
+            return False
+
+        def progress(phase, attempt):
+            update_start_job(job_id, r, phase=phase, attempt=attempt)
+
+        try:
+            # Waits out the lock of the request that queued the job.
+            with r.lock(f"user.{user.id}.docker.lock", blocking_timeout=30, timeout=START_JOB_LOCK_SECONDS, raise_on_release_error=False):
+                result = start_challenge_with_retries(
+                    user,
+                    dojo_challenge,
+                    request["practice"],
+                    as_user=as_user,
+                    home=request["home"],
+                    debug=request["debug"],
+                    progress=progress,
+                )
+        except redis.exceptions.LockError:
+            update_start_job(job_id, r, status="failed", phase="failed", error="Already starting a challenge; try again in 20 seconds.")
+            return False
+
+        if result["success"]:
+            update_start_job(job_id, r, status="succeeded", phase="done")
+        else:
+            update_start_job(job_id, r, status="failed", phase="failed", error=result["error"], debug=result.get("debug"))
+        return result["success"]
+    finally:
+        set_trace_id("NONE")
+        db.session.remove()
@@ -1,4 +1,5 @@
 import logging
+import os
 import signal
 
 logger = logging.getLogger(__name__)
@@ -19,9 +20,18 @@ signal.signal(signal.SIGINT, signal_handler)
 
 logger.info("Starting image pull worker...")
 
-from ..utils.image_pulls import consume_image_pull_events
+from ..utils.background_stats import get_redis_client
+from ..utils.image_pulls import consume_image_pull_events, CONSUMER_GROUP, IMAGE_PULL_STREAM_NAME
+from ..utils.metrics import serve_metrics, StreamCollector
 from ..worker.handlers.image_pulls import handle_image_pull_event
 
+metrics_port = int(os.environ.get("IMAGE_PULL_METRICS_PORT", "9201"))
+if metrics_port:
+    try:
+        serve_metrics(metrics_port, StreamCollector(get_redis_client(), CONSUMER_GROUP, [IMAGE_PULL_STREAM_NAME]))
+    except Exception as e:
+        logger.error(f"Error starting metrics server: {e}", exc_info=True)
+
 try:
     consume_image_pull_events(
         handler=handle_image_pull_event,
@@ -0,0 +1,58 @@
+import logging
+import os
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(handler)
+
+shutdown_requested = threading.Event()
+
+def signal_handler(signum, frame):
+    logger.info(f"Received signal {signum}, shutting down gracefully...")
+    shutdown_requested.set()
+
+signal.signal(signal.SIGTERM, signal_handler)
+signal.signal(signal.SIGINT, signal_handler)
+
+logger.info("Starting start worker...")
+
+from flask import current_app
+
+from ..utils.background_stats import get_redis_client
+from ..utils.metrics import serve_metrics, StreamCollector
+from ..utils.start_jobs import (
+    consume_start_jobs, fail_running_start_jobs, CONSUMER_GROUP, START_JOB_STREAM_NAME, START_WORKER_CONCURRENCY,
+)
+from ..worker.handlers.start_jobs import handle_start_job
+
+metrics_port = int(os.environ.get("START_WORKER_METRICS_PORT", "9203"))
+if metrics_port:
+    try:
+        serve_metrics(metrics_port, StreamCollector(get_redis_client(), CONSUMER_GROUP, [START_JOB_STREAM_NAME]))
+    except Exception as e:
+        logger.error(f"Error starting metrics server: {e}", exc_info=True)
+
+app = current_app._get_current_object()
+
+
+def run_consumer(index):
+    with app.app_context():
+        try:
+            consume_start_jobs(handler=handle_start_job, consumer_name=f"start-worker-{os.getpid()}-{index}")
+        except Exception as e:
+            logger.error(f"Start worker thread {index} crashed: {e}", exc_info=True)
+            shutdown_requested.set()
+
+
+for index in range(START_WORKER_CONCURRENCY):
+    threading.Thread(target=run_consumer, args=(index,), name=f"start-worker-{index}", daemon=True).start()
+
+shutdown_requested.wait()
+# The consumer threads die with the process, so their jobs are failed rather than left running; their messages are
+# acknowledged by the next worker that claims them.
+fail_running_start_jobs("The start worker restarted; try again")
+logger.info("Start worker stopped")
@@ -0,0 +1,100 @@
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(handler)
+
+shutdown_requested = False
+
+def signal_handler(signum, frame):
+    global shutdown_requested
+    logger.info(f"Received signal {signum}, shutting down gracefully...")
+    shutdown_requested = True
+
+signal.signal(signal.SIGTERM, signal_handler)
+signal.signal(signal.SIGINT, signal_handler)
+
+logger.info("Starting workspace pool worker...")
+
+from ..api.v1.docker import workspace_attributes
+from ..config import WORKSPACE_NODES
+from ..utils import node_docker_client
+from ..utils.active_containers import ACTIVE_CONTAINERS_RECONCILE_SECONDS, reconcile_active_containers
+from ..utils.background_stats import get_redis_client
+from ..utils.metrics import serve_metrics, WorkspacePoolCollector, WORKSPACE_POOL_IDLE
+from ..utils.workspace_pool import (
+    POOL_COUNTERS_KEY,
+    WORKSPACE_POOL_INTERVAL,
+    WORKSPACE_POOL_SIZE,
+    WORKSPACE_POOL_SWEEP_SECONDS,
+    demanded_pool_keys,
+    expire_pool,
+    fill_pool,
+    parse_pool_key,
+    sweep_pool_homes,
+)
+
+r = get_redis_client()
+
+metrics_port = int(os.environ.get("WORKSPACE_POOL_METRICS_PORT", "9202"))
+if metrics_port:
+    try:
+        serve_metrics(metrics_port, WorkspacePoolCollector(r, POOL_COUNTERS_KEY))
+    except Exception as e:
+        logger.error(f"Error starting metrics server: {e}", exc_info=True)
+
+if not WORKSPACE_POOL_SIZE:
+    logger.info("WORKSPACE_POOL_SIZE is 0; the workspace pool is disabled")
+
+reconciled_at = 0
+swept_at = 0
+
+while not shutdown_requested:
+    if time.monotonic() - reconciled_at >= ACTIVE_CONTAINERS_RECONCILE_SECONDS:
+        try:
+            added, removed = reconcile_active_containers({node_id: node_docker_client(node_id) for node_id in WORKSPACE_NODES or [-1]}, r)
+            if added or removed:
+                logger.info(f"Reconciled active containers: {added} added, {removed} removed")
+        except Exception as e:
+            logger.error(f"Error reconciling active containers: {e}", exc_info=True)
+        reconciled_at = time.monotonic()
+
+    # Expired workspaces are removed even with the pool disabled, so that turning it off drains it.
+    for node_id in WORKSPACE_NODES or [-1]:
+        try:
+            expire_pool(node_docker_client(node_id), r)
+        except Exception as e:
+            logger.error(f"Error expiring pooled workspaces on node {node_id}: {e}", exc_info=True)
+
+    # Each sweep runs a helper container per node, so it is skipped with the pool disabled; the homes of workspaces
+    # left from before it was disabled are unmounted on the next sweep after it is enabled, or when the node reboots.
+    if WORKSPACE_POOL_SIZE and time.monotonic() - swept_at >= WORKSPACE_POOL_SWEEP_SECONDS:
+        for node_id in WORKSPACE_NODES or [-1]:
+            try:
+                sweep_pool_homes(node_docker_client(node_id))
+            except Exception as e:
+                logger.error(f"Error sweeping pooled workspace homes on node {node_id}: {e}", exc_info=True)
+        swept_at = time.monotonic()
+
+    if WORKSPACE_POOL_SIZE:
+        try:
+            keys = demanded_pool_keys(r)
+        except Exception as e:
+            logger.error(f"Error reading workspace pool demand: {e}", exc_info=True)
+            keys = []
+        for key in keys:
+            node_id, image, privileged = parse_pool_key(key)
+            try:
+                docker_client = node_docker_client(node_id)
+                idle = fill_pool(docker_client, key, workspace_attributes(docker_client, image, privileged))
+                WORKSPACE_POOL_IDLE.labels(key).set(idle)
+            except Exception as e:
+                logger.error(f"Error filling workspace pool {key}: {e}", exc_info=True)
+    time.sleep(WORKSPACE_POOL_INTERVAL)
+
+logger.info("Workspace pool worker stopped")
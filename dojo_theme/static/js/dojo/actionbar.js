@@ -369,17 +369,7 @@ function actionStartChallenge(event, privileged) {
             "practice": privileged,
         };
 
-        return CTFd.fetch('/pwncollege_api/v1/docker', {
-            method: 'POST',
-            credentials: 'same-origin',
-            headers: {
-                'Accept': 'application/json',
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(params)
-        }).then(function (response) {
-            return response.json();
-        }).then(function (result) {
+        return startChallengeContainer(params).then(function (result) {
             if (result.success == false) {
                 if (result.debug) {
                     console.error("Challenge start failed:", result.debug);
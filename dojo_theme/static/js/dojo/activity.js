@@ -89,11 +89,12 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
     }
 
-    function countDailySolves(timestamps) {
+    function countDailySolves(hourlySolveCounts) {
+        // Solves are counted per UTC hour, e.g. "2024-05-01T13", which is placed on the viewer's local day.
         const counts = {};
-        timestamps.forEach(ts => {
-            const dateStr = getLocalISODate(new Date(ts));
-            counts[dateStr] = (counts[dateStr] || 0) + 1;
+        Object.entries(hourlySolveCounts).forEach(([hour, count]) => {
+            const dateStr = getLocalISODate(new Date(`${hour}:00:00Z`));
+            counts[dateStr] = (counts[dateStr] || 0) + count;
         });
         return counts;
     }
@@ -121,7 +122,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     .then(response => response.json())
     .then(result => {
         if(result.success) {
-            const dailySolveCount = countDailySolves(result.data.solve_timestamps || []);
+            const dailySolveCount = countDailySolves(result.data.solve_counts || {});
             const max = Math.max(...Object.values(dailySolveCount), 1);
             updateGrid(dailySolveCount, max);
             const streakText = getStreak(dailySolveCount);
@@ -215,25 +215,8 @@ function startChallenge(event) {
         }
     }, 500);
 
-    CTFd.fetch('/pwncollege_api/v1/docker', {
-        method: 'POST',
-        credentials: 'same-origin',
-        headers: {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify(params)
-    }).then(function (response) {
-        if (response.status === 403) {
-            // User is not logged in or CTF is paused.
-            window.location =
-                CTFd.config.urlRoot +
-                "/login?next=" +
-                CTFd.config.urlRoot +
-                window.location.pathname +
-                window.location.hash;
-        }
-        return response.json();
+    startChallengeContainer(params, function (job) {
+        result_message.text(job.message);
     }).then(function (result) {
         var result_notification = item.find('#result-notification');
         var result_message = item.find('#result-message');
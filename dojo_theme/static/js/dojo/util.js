@@ -28,4 +28,81 @@ document.addEventListener("DOMContentLoaded", function () {
         const storedTheme = localStorage.getItem('theme');
         document.body.classList.add(`theme-${storedTheme}`);
     }
-});
\ No newline at end of file
+});
+function followStartJob(job, onProgress) {
+    // Follows a queued challenge start through its phases, resolving to the same result a synchronous start returns.
+    return new Promise(function (resolve) {
+        function update(job) {
+            if (onProgress) {
+                onProgress(job);
+            }
+            if (job.status === "succeeded") {
+                resolve({"success": true});
+            } else if (job.status === "failed") {
+                resolve({"success": false, "error": job.error, "debug": job.debug});
+            } else {
+                return false;
+            }
+            return true;
+        }
+
+        function poll() {
+            CTFd.fetch(`/pwncollege_api/v1/docker/jobs/${job.id}`, {
+                method: "GET",
+                credentials: "same-origin"
+            }).then(function (response) {
+                return response.json();
+            }).then(function (result) {
+                if (!result.success) {
+                    resolve(result);
+                } else if (!update(result.job)) {
+                    setTimeout(poll, 1000);
+                }
+            }).catch(function () {
+                setTimeout(poll, 2000);
+            });
+        }
+
+        if (update(job)) {
+            return;
+        }
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        const source = new EventSource(`${CTFd.config.urlRoot}/pwncollege_api/v1/docker/jobs/${job.id}/stream`);
+        source.onmessage = function (event) {
+            if (update(JSON.parse(event.data))) {
+                source.close();
+            }
+        };
+        source.onerror = function () {
+            source.close();
+            poll();
+        };
+    });
+}
+
+function startChallengeContainer(params, onProgress) {
+    // Queues the start and follows it; older servers, or a server that could not queue it, start it synchronously.
+    return CTFd.fetch("/pwncollege_api/v1/docker", {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        },
+        body: JSON.stringify(Object.assign({}, params, {"async": true}))
+    }).then(function (response) {
+        if (response.status === 403) {
+            // User is not logged in or CTF is paused.
+            window.location =
+                CTFd.config.urlRoot +
+                "/login?next=" +
+                encodeURIComponent(CTFd.config.urlRoot + window.location.pathname + window.location.search + window.location.hash);
+        }
+        return response.json();
+    }).then(function (result) {
+        return result.success && result.job ? followStartJob(result.job, onProgress) : result;
+    });
+}
@@ -831,6 +831,34 @@ def test_dojo_stats_includes_visible_challenges(stats_test_dojo, stats_test_user
     assert stats['visible_challenges'] >= 0, "visible_challenges should be non-negative"
     assert stats['challenges'] >= stats['visible_challenges'], "total challenges should be >= visible challenges"
 
+def test_dojo_stats_day_rollover():
+    result = dojo_run("dojo", "flask", input="""
+from datetime import datetime, timedelta
+from dojo_plugin.models import Dojos
+from dojo_plugin.utils.stats import calculate_dojo_stats, roll_dojo_stats, update_dojo_stats, utc_today
+
+today = utc_today()
+day = lambda days_ago: (today - timedelta(days=days_ago)).isoformat()
+stats = {"users": 2, "solves": 9, "recent_solves": [], "daily": {day(0): [2, 1], day(7): [1, 1], day(90): [6, 2]}}
+
+rolled = roll_dojo_stats(stats, today)
+assert rolled["chart_data"]["solves"] == [2, 1, 0, 0], rolled
+assert day(90) not in rolled["daily"], rolled
+assert roll_dojo_stats(rolled, today + timedelta(days=7))["chart_data"]["solves"] == [0, 2, 0, 0]
+
+updated = update_dojo_stats(rolled, "Apple", datetime.utcnow(), new_user=True, new_day_user=True)
+assert updated["chart_data"]["solves"][0] == 3 and updated["chart_data"]["users"][0] == 2, updated
+assert updated["solves"] == 10 and updated["users"] == 3, updated
+assert updated["recent_solves"][0]["challenge_name"] == "Apple"
+
+for dojo in Dojos.query.limit(5):
+    stats = calculate_dojo_stats(dojo)
+    assert stats["solves"] == dojo.solves().count(), dojo.reference_id
+    assert stats["chart_data"]["solves"][0] == stats["daily"].get(today.isoformat(), [0, 0])[0]
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"dojo stats rollover test failed: {result.stdout}"
+
 def test_scoreboard_cache_cold_start_all_durations(example_dojo):
     found_any = False
     for duration in [0, 7, 30]:
@@ -1035,7 +1063,7 @@ def test_activity_update_on_solve(stats_test_dojo, stats_test_user):
     assert updated, "Activity cache should be updated after solve"
 
     activity = json.loads(cached_data)
-    assert 'solve_timestamps' in activity, "Activity should have solve_timestamps"
+    assert 'solve_counts' in activity, "Activity should have solve_counts"
     assert 'total_solves' in activity, "Activity should have total_solves"
     assert activity['total_solves'] >= 1, f"Expected at least 1 solve, got {activity['total_solves']}"
 
@@ -1067,7 +1095,7 @@ def test_activity_api_returns_cached_data(stats_test_dojo, stats_test_user):
     data = response.json()
     assert data['success'] is True, "API should return success"
     assert 'data' in data, "API should return data"
-    assert 'solve_timestamps' in data['data'], "API data should have solve_timestamps"
+    assert 'solve_counts' in data['data'], "API data should have solve_counts"
     assert 'total_solves' in data['data'], "API data should have total_solves"
 
 def test_activity_cache_structure(stats_test_dojo, stats_test_user):
@@ -1096,13 +1124,14 @@ def test_activity_cache_structure(stats_test_dojo, stats_test_user):
 
     activity = json.loads(cached_data)
 
-    assert isinstance(activity['solve_timestamps'], list), "solve_timestamps should be a list"
+    assert isinstance(activity['solve_counts'], dict), "solve_counts should be a dict"
     assert isinstance(activity['total_solves'], int), "total_solves should be an int"
 
-    assert len(activity['solve_timestamps']) >= 1, "There should be at least 1 solve timestamp"
+    assert len(activity['solve_counts']) >= 1, "There should be at least 1 solve bucket"
+    assert sum(activity['solve_counts'].values()) == activity['total_solves'], "Buckets should add up to total_solves"
     today = time.strftime('%Y-%m-%d')
-    has_today = any(ts.startswith(today) for ts in activity['solve_timestamps'])
-    assert has_today, f"Today's date ({today}) should be in solve_timestamps"
+    has_today = any(bucket.startswith(today) for bucket in activity['solve_counts'])
+    assert has_today, f"Today's date ({today}) should be in solve_counts"
 
 def test_activity_multiple_solves_same_day(stats_test_dojo, stats_test_user):
     user_name, user_session = stats_test_user
@@ -1138,7 +1167,7 @@ def test_activity_multiple_solves_same_day(stats_test_dojo, stats_test_user):
     today = time.strftime('%Y-%m-%d')
 
     assert activity['total_solves'] >= 2, f"Expected at least 2 total solves, got {activity['total_solves']}"
-    today_count = sum(1 for ts in activity['solve_timestamps'] if ts.startswith(today))
+    today_count = sum(count for bucket, count in activity['solve_counts'].items() if bucket.startswith(today))
     assert today_count >= 2, f"Expected at least 2 solves today, got {today_count}"
 
 def test_activity_fallback_on_cache_miss(stats_test_dojo, stats_test_user):
@@ -1166,7 +1195,7 @@ def test_activity_fallback_on_cache_miss(stats_test_dojo, stats_test_user):
 
     data = response.json()
     assert data['success'] is True, "API should return success on fallback"
-    assert 'solve_timestamps' in data['data'], "Fallback should compute solve_timestamps"
+    assert 'solve_counts' in data['data'], "Fallback should compute solve_counts"
     assert data['data']['total_solves'] >= 1, "Fallback should find existing solves"
 
 def test_activity_api_user_not_found(stats_test_user):
@@ -1190,6 +1219,28 @@ def test_hacker_page_loads_with_activity(stats_test_dojo, stats_test_user):
     assert response.status_code == 200, "Hacker page should load successfully with activity"
     assert 'activity-tracker' in response.text, "Hacker page should contain activity tracker"
 
+def test_activity_buckets_and_retention():
+    result = dojo_run("dojo", "flask", input="""
+from datetime import datetime, timedelta
+from CTFd.models import Solves
+from dojo_plugin.worker.handlers.activity import (
+    ACTIVITY_RETENTION_DAYS, activity_bucket, calculate_activity, iter_user_activity, update_activity,
+)
+
+now = datetime.utcnow()
+expired = now - timedelta(days=ACTIVITY_RETENTION_DAYS + 1)
+legacy = {"solve_timestamps": [expired.isoformat() + "Z", now.isoformat() + "Z", now.isoformat() + "Z"], "total_solves": 3}
+activity = update_activity(legacy, now)
+assert activity == {"solve_counts": {activity_bucket(now): 3}, "total_solves": 3}, activity
+
+user_ids = [user_id for user_id, in Solves.query.with_entities(Solves.user_id).distinct().limit(20)]
+batch = dict(iter_user_activity(user_ids))
+for user_id in user_ids:
+    assert batch.get(user_id, {"solve_counts": {}, "total_solves": 0}) == calculate_activity(user_id), user_id
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"activity buckets test failed: {result.stdout}"
+
 def test_should_daily_restart():
     result = dojo_run("dojo", "flask", input="""
 import time
@@ -1243,6 +1294,55 @@ print("OK")
 """, check=True)
     assert "OK" in result.stdout, f"is_event_stale test failed: {result.stdout}"
 
+def test_l1_cache_and_multi_key_staleness():
+    result = dojo_run("dojo", "flask", input="""
+from dojo_plugin.utils.background_stats import (
+    get_cached_stat, get_cached_stats, set_cached_stat, invalidate_cached_stat, stale_cache_keys, get_cache_updated_at,
+)
+
+keys = ["stats:test:l1:a", "stats:test:l1:b"]
+set_cached_stat(keys[0], {"value": 1})
+first = get_cached_stat(keys[0])
+assert get_cached_stat(keys[0]) is first, "unchanged stat should come from the L1 cache"
+
+set_cached_stat(keys[0], {"value": 2})
+assert get_cached_stat(keys[0]) == {"value": 2}, "updated stat should be downloaded again"
+assert get_cached_stats(keys) == {keys[0]: {"value": 2}, keys[1]: None}
+
+updated_at = get_cache_updated_at(keys[0])
+assert stale_cache_keys(keys, updated_at - 1) == {keys[0]}
+assert stale_cache_keys(keys, updated_at + 1) == set()
+
+for key in keys:
+    invalidate_cached_stat(key)
+assert get_cached_stat(keys[0]) is None
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"L1 cache test failed: {result.stdout}"
+
+def test_cache_codecs_mixed_values():
+    result = dojo_run("dojo", "flask", input="""
+from dojo_plugin.utils.background_stats import get_cached_stats, get_redis_client, invalidate_cached_stat
+from dojo_plugin.utils.cache_codec import CACHE_CODECS, encode_stat, decode_stat
+
+data = {"ranks": [3, 1, 2], "solves": {1: 5, "2": 7}, "board": [{"user_id": i, "name": f"user{i}"} for i in range(2000)]}
+expected = {**data, "solves": {"1": 5, "2": 7}}
+for codec in CACHE_CODECS:
+    assert decode_stat(encode_stat(data, codec)) == expected, codec
+
+r = get_redis_client()
+keys = [f"stats:test:codec:{codec}" for codec in CACHE_CODECS]
+for key, codec in zip(keys, CACHE_CODECS):
+    r.set(key, encode_stat(data, codec))
+    r.set(f"{key}:updated", "1")
+assert get_cached_stats(keys) == {key: expected for key in keys}
+
+for key in keys:
+    invalidate_cached_stat(key)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"cache codec test failed: {result.stdout}"
+
 def test_dojo_specific_scores_update_only_updates_target_dojo():
     result = dojo_run("dojo", "flask", input="""
 from unittest.mock import patch, MagicMock
@@ -1260,7 +1360,7 @@ mock_dojo1.modules = []
 
 with patch('dojo_plugin.worker.handlers.scores.Dojos') as MockDojos:
     with patch('dojo_plugin.worker.handlers.scores.calculate_dojo_scores', side_effect=mock_calculate):
-        with patch('dojo_plugin.worker.handlers.scores.set_cached_stat'):
+        with patch('dojo_plugin.worker.handlers.scores.set_cached_stat'), patch('dojo_plugin.worker.handlers.scores.update_official_scores'):
             MockDojos.query.filter_by.return_value.first.return_value = mock_dojo1
 
             handle_scores_update({"dojo_id": "target-dojo-123"})
@@ -1302,7 +1402,7 @@ with patch('dojo_plugin.worker.handlers.scores.Dojos') as MockDojos:
     MockDojos.query.filter.return_value.all.return_value = [mock_dojo1, mock_dojo2]
 
     with patch('dojo_plugin.worker.handlers.scores.calculate_dojo_scores') as mock_calc:
-        with patch('dojo_plugin.worker.handlers.scores.set_cached_stat'):
+        with patch('dojo_plugin.worker.handlers.scores.set_cached_stat'), patch('dojo_plugin.worker.handlers.scores.update_official_scores'):
             mock_calc.return_value = {"ranks": [], "solves": {}}
 
             handle_scores_update({})
@@ -1366,3 +1466,770 @@ assert updated2["789"] == 1, "Should add new challenge with count 1"
 print("OK")
 """, check=True)
     assert "OK" in result.stdout, f"challenge_solves string keys test failed: {result.stdout}"
+
+def test_group_stat_messages_coalesces_recomputes():
+    result = dojo_run("dojo", "flask", input="""
+import json
+from dojo_plugin.utils import background_stats
+from dojo_plugin.utils.background_stats import group_stat_messages
+
+def message(message_id, event_type, payload):
+    return (message_id, {"data": json.dumps({"type": event_type, "payload": payload})})
+
+groups = group_stat_messages([
+    message("1000-0", "scoreboard_update", {"model_type": "dojo", "model_id": 1}),
+    message("1001-0", "challenge_solve", {"user_id": 1, "challenge_id": 2}),
+    ("1001-1", {"data": "not json"}),
+    message("1002-0", "challenge_solve", {"user_id": 1, "challenge_id": 2}),
+    message("1003-0", "scoreboard_update", {"model_id": 1, "model_type": "dojo"}),
+    message("1004-0", "dojo_stats_update", {"dojo_id": 1}),
+])
+
+# Invalid events are not grouped; they stay pending, with their error, until they are dead-lettered.
+assert isinstance(groups, list), groups
+assert "1001-1" in background_stats._last_errors
+background_stats._last_errors.pop("1001-1")
+assert [group["type"] for group in groups] == ["challenge_solve", "challenge_solve", "scoreboard_update", "dojo_stats_update"], groups
+assert groups[2]["message_ids"] == ["1000-0", "1003-0"], groups[2]
+assert groups[2]["timestamp"] == 1.003, groups[2]
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"group_stat_messages test failed: {result.stdout}"
+
+def test_reclaim_pending_stat_events_retries_and_dead_letters():
+    result = dojo_run("dojo", "flask", input="""
+import json
+from unittest.mock import MagicMock
+from dojo_plugin.utils.background_stats import reclaim_pending_stat_events, retry_backoff_ms, MAX_EVENT_ATTEMPTS, DEAD_LETTER_STREAM_NAME
+
+data = {"data": json.dumps({"type": "dojo_stats_update", "payload": {"dojo_id": 1}})}
+r = MagicMock()
+r.xpending_range.return_value = [
+    {"message_id": "1-0", "times_delivered": 1, "time_since_delivered": retry_backoff_ms(1)},
+    {"message_id": "2-0", "times_delivered": 2, "time_since_delivered": retry_backoff_ms(1)},
+    {"message_id": "3-0", "times_delivered": MAX_EVENT_ATTEMPTS, "time_since_delivered": retry_backoff_ms(1)},
+]
+r.xclaim.return_value = [("1-0", data), ("3-0", data)]
+processed = []
+def process_messages(r, messages, handler, stream_name=None):
+    processed.extend(message_id for message_id, _ in messages)
+    return len(messages), len(messages)
+
+reclaim_pending_stat_events(r, process_messages, handler=None)
+
+assert r.xclaim.call_args[0][4] == ["1-0", "3-0"], r.xclaim.call_args
+assert processed == ["1-0"], processed
+pipeline = r.pipeline.return_value
+assert pipeline.xadd.call_args[0][0] == DEAD_LETTER_STREAM_NAME
+assert pipeline.xadd.call_args[0][1]["original_id"] == "3-0"
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"reclaim_pending_stat_events test failed: {result.stdout}"
+
+def test_failed_handler_is_retried_then_dead_lettered():
+    result = dojo_run("dojo", "flask", input="""
+import json
+from unittest.mock import patch
+from dojo_plugin.models import Dojos
+from dojo_plugin.utils import background_stats
+from dojo_plugin.utils.background_stats import (
+    get_redis_client, process_stat_messages, reclaim_pending_stat_events, CONSUMER_GROUP, CONSUMER_NAME,
+    DEAD_LETTER_STREAM_NAME, MAX_EVENT_ATTEMPTS,
+)
+from dojo_plugin.worker.handlers import handle_stat_event
+
+r = get_redis_client()
+stream = "stat:events:test-failed-handler"
+r.delete(stream)
+r.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
+dojo_id = Dojos.query.first().dojo_id
+message_id = r.xadd(stream, {"data": json.dumps({"type": "dojo_stats_update", "payload": {"dojo_id": dojo_id}})})
+
+calls = []
+def failing_stats(dojo):
+    calls.append(dojo.dojo_id)
+    raise RuntimeError("database unavailable")
+
+stats_patches = [
+    patch("dojo_plugin.worker.handlers.dojo_stats.calculate_dojo_stats", failing_stats),
+    patch("dojo_plugin.worker.handlers.dojo_stats.is_event_stale", return_value=False),
+]
+retry_patches = [patch.object(background_stats, "PENDING_IDLE_MS", 0), patch.object(background_stats, "retry_backoff_ms", lambda times_delivered: 0)]
+with stats_patches[0], stats_patches[1], retry_patches[0], retry_patches[1]:
+    messages = r.xreadgroup(CONSUMER_GROUP, CONSUMER_NAME, {stream: ">"}, count=10)[0][1]
+    process_stat_messages(r, messages, handle_stat_event, stream_name=stream)
+    assert r.xpending(stream, CONSUMER_GROUP)["pending"] == 1, "a failed event is left pending"
+
+    for _ in range(MAX_EVENT_ATTEMPTS - 1):
+        reclaim_pending_stat_events(r, process_stat_messages, handle_stat_event, stream_name=stream)
+    assert len(calls) == MAX_EVENT_ATTEMPTS, calls
+    assert r.xpending(stream, CONSUMER_GROUP)["pending"] == 1
+
+    reclaim_pending_stat_events(r, process_stat_messages, handle_stat_event, stream_name=stream)
+    assert len(calls) == MAX_EVENT_ATTEMPTS, "a dead-lettered event is not handled again"
+    assert r.xpending(stream, CONSUMER_GROUP)["pending"] == 0
+
+dead = [(dead_id, entry) for dead_id, entry in r.xrevrange(DEAD_LETTER_STREAM_NAME, count=10) if entry["original_id"] == message_id]
+assert len(dead) == 1, dead
+dead_id, entry = dead[0]
+assert entry["stream"] == stream and entry["attempts"] == str(MAX_EVENT_ATTEMPTS), entry
+assert "RuntimeError: database unavailable" in entry["error"], entry
+r.xdel(DEAD_LETTER_STREAM_NAME, dead_id)
+r.delete(stream)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"failed handler retry test failed: {result.stdout}"
+
+def test_admin_replays_dead_letter(admin_session):
+    event = json.dumps({"type": "dojo_stats_update", "payload": {"dojo_id": 0}})
+    dead_id = redis_xadd("stat:events:dead", "*", "data", event, "original_id", "1-0", "attempts", "5", "error", "test", "failed_at", "0")
+    assert dead_id
+
+    response = admin_session.get(f"{DOJO_URL}/admin/stats")
+    assert response.status_code == 200
+    assert dead_id in response.text
+
+    response = admin_session.post(f"{DOJO_URL}/admin/stats", data={
+        "nonce": admin_session.headers["CSRF-Token"], "action": "replay", "dead_id": dead_id,
+    })
+    assert response.status_code == 200
+    assert dead_id not in response.text
+
+def test_stat_event_sharding():
+    result = dojo_run("dojo", "flask", input="""
+from unittest.mock import patch
+import dojo_plugin.utils.background_stats as background_stats
+
+with patch.object(background_stats, "STATS_SHARDS", 4):
+    assert background_stats.parse_shard_list("0-1,3") == [0, 1, 3]
+    assert background_stats.parse_shard_list("") is None
+    assert background_stats.stat_stream_names([1, 2]) == ["stat:events:1", "stat:events:2"]
+    assert background_stats.event_shard(None) == 0
+    assert background_stats.event_shard(12345) == background_stats.event_shard(12345)
+    assert len({background_stats.event_shard(dojo_id) for dojo_id in range(100)}) == 4
+    try:
+        background_stats.parse_shard_list("4")
+        assert False, "shard 4 should be out of range"
+    except ValueError:
+        pass
+
+with patch.object(background_stats, "STATS_SHARDS", 1):
+    assert background_stats.stat_stream_names() == ["stat:events"]
+    assert background_stats.shard_stream_name(background_stats.event_shard(12345)) == "stat:events"
+
+# A recompute of every dojo's scores is split by dojo, so that each shard only writes the dojos it owns.
+from dojo_plugin.models import Dojos
+import dojo_plugin.utils.events as events
+published = []
+with patch.object(events, "STATS_SHARDS", 4), patch.object(events, "publish_stat_event", lambda *args, **kwargs: published.append((args, kwargs))):
+    events.publish_scores_event()
+public_dojo_ids = {dojo.dojo_id for dojo in Dojos.query.all() if dojo.is_public_or_official}
+assert {kwargs["partition_key"] for _, kwargs in published} == public_dojo_ids, published
+assert all(args == ("scores_update", {"dojo_id": kwargs["partition_key"]}) for args, kwargs in published), published
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"stat event sharding test failed: {result.stdout}"
+
+def test_cold_start_checkpoint_rejection():
+    result = dojo_run("dojo", "flask", input="""
+import time
+from unittest.mock import patch, MagicMock
+import dojo_plugin.worker.cold_start as cold_start
+
+r = MagicMock()
+r.exists.return_value = 1
+checkpoint = {"schema_version": cold_start.STATS_SCHEMA_VERSION, "solve_id": 10, "award_id": 2, "full_rebuild_at": time.time()}
+with patch.object(cold_start, "get_redis_client", return_value=r):
+    assert cold_start.checkpoint_rejection(checkpoint) is None
+    assert cold_start.checkpoint_rejection(None) == "no checkpoint"
+    assert "schema version" in cold_start.checkpoint_rejection({**checkpoint, "schema_version": -1})
+    assert "older than" in cold_start.checkpoint_rejection({**checkpoint, "full_rebuild_at": 0})
+    r.exists.return_value = 0
+    assert "missing cache keys" in cold_start.checkpoint_rejection(checkpoint)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"checkpoint rejection test failed: {result.stdout}"
+
+def test_cold_start_steps_and_warmup_gate():
+    result = dojo_run("dojo", "flask", input="""
+import threading, time
+from unittest.mock import patch
+from flask import current_app
+import dojo_plugin.worker.cold_start as cold_start
+
+order = []
+lock = threading.Lock()
+def step(name, delay=0.0):
+    def run():
+        time.sleep(delay)
+        with lock:
+            order.append(name)
+    return run
+def fail():
+    raise RuntimeError("boom")
+
+steps = {
+    "slow": (step("slow", 0.5), ()),
+    "fast": (step("fast"), ()),
+    "after_slow": (step("after_slow"), ("slow",)),
+    "broken": (fail, ()),
+    "after_broken": (step("after_broken"), ("broken",)),
+}
+start = time.time()
+timings, failed = cold_start.run_steps(current_app._get_current_object(), steps, concurrency=2)
+assert failed == {"broken", "after_broken"}, failed
+assert order.index("fast") < order.index("slow") < order.index("after_slow"), order
+assert "after_broken" not in order
+assert time.time() - start < 1.0
+
+handled = []
+gate = cold_start.WarmupGate(lambda *event: handled.append(event), ["scores", "belts"])
+gate.handle("containers_stats_update", {}, 1.0)
+gate.handle("scores_update", {"dojo_id": 1}, 2.0)
+gate.handle("scores_update", {"dojo_id": 1}, 3.0)
+assert handled == [("containers_stats_update", {}, 1.0)], handled
+gate.step_done("scores", True)
+gate.drain()
+assert handled[1:] == [("scores_update", {"dojo_id": 1}, None)], handled
+
+# A failed step stays cold until a retry succeeds.
+gate.step_done("belts", False)
+assert not gate.is_warm("belts_update")
+attempts = []
+def flaky():
+    attempts.append(1)
+    if len(attempts) == 1:
+        raise RuntimeError("boom")
+cold_start.COLD_START_RETRY_SECONDS = 0
+gate.warm(current_app._get_current_object(), {"belts": (flaky, ()), "after_belts": (step("after_belts"), ("belts",))})
+assert len(attempts) == 2 and "after_belts" in order, (attempts, order)
+assert gate.is_warm("belts_update")
+
+# A deferred recompute that fails goes back on the stream rather than being dropped.
+republished = []
+def failing_handler(*event):
+    raise RuntimeError("boom")
+gate = cold_start.WarmupGate(failing_handler, ["scores"])
+gate.handle("scores_update", {"dojo_id": 1}, 1.0)
+gate.step_done("scores", True)
+with patch.object(cold_start, "publish_stat_event", lambda *args, **kwargs: republished.append((args, kwargs)) or "1-0"):
+    gate.drain()
+assert republished == [(("scores_update", {"dojo_id": 1}), {"partition_key": 1})], republished
+assert not gate.deferred
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"cold start scheduler test failed: {result.stdout}"
+
+def test_sorted_set_scoreboard_store():
+    result = dojo_run("dojo", "flask", input="""
+from dojo_plugin.utils import scoreboard_store as store
+
+cache_key = "stats:scoreboard:test:zset:0"
+store.get_redis_client().delete(store.ranking_key(cache_key))
+store.write_scoreboard(cache_key, [
+    {"rank": 1, "solves": 3, "last_solve_id": 30, "user_id": 901, "name": "alice", "email": "a@example.com"},
+    {"rank": 2, "solves": 3, "last_solve_id": 40, "user_id": 902, "name": "bob", "email": "b@example.com"},
+    {"rank": 3, "solves": 1, "last_solve_id": 10, "user_id": 903, "name": "carol", "email": "c@example.com"},
+])
+entries, total = store.read_scoreboard_page(cache_key, 0, 2)
+assert total == 3
+assert [(e["rank"], e["user_id"], e["solves"]) for e in entries] == [(1, 901, 3), (2, 902, 3)], entries
+
+entry = store.add_scoreboard_solve(cache_key, 903, {"name": "carol", "email": "c@example.com"}, 50)
+assert (entry["rank"], entry["solves"]) == (3, 2), entry
+entry = store.add_scoreboard_solve(cache_key, 903, {"name": "carol", "email": "c@example.com"}, 60)
+assert (entry["rank"], entry["solves"]) == (3, 3), entry
+entry = store.add_scoreboard_solve(cache_key, 902, {"name": "bob", "email": "b@example.com"}, 70)
+assert (entry["rank"], entry["solves"]) == (1, 4), entry
+
+me = store.read_scoreboard_entry(cache_key, 901)
+assert (me["rank"], me["name"], me["solves"]) == (2, "alice", 3), me
+assert store.read_scoreboard_entry(cache_key, 999) is None
+assert [e["user_id"] for e in store.read_scoreboard(cache_key)] == [902, 901, 903]
+store.get_redis_client().delete(store.ranking_key(cache_key), f"{cache_key}:updated")
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"sorted set scoreboard test failed: {result.stdout}"
+
+def test_single_pass_scoreboards_match_per_board(stats_test_dojo, stats_test_user):
+    user_name, user_session = stats_test_user
+    start_challenge(stats_test_dojo, "hello", "apple", session=user_session)
+    solve_challenge(stats_test_dojo, "hello", "apple", session=user_session, user=user_name)
+    result = dojo_run("dojo", "flask", input=f"""
+from dojo_plugin.models import Dojos
+from dojo_plugin.worker.handlers.scoreboard import calculate_scoreboard, calculate_scoreboards, COMMON_DURATIONS
+
+dojo = Dojos.from_id("{stats_test_dojo}").first()
+scoreboards = calculate_scoreboards(dojo, COMMON_DURATIONS)
+for duration in COMMON_DURATIONS:
+    assert scoreboards[(None, duration)] == calculate_scoreboard(dojo, duration), duration
+    for module in dojo.modules:
+        assert scoreboards[(module.module_index, duration)] == calculate_scoreboard(module, duration), (module.id, duration)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"single pass scoreboard test failed: {result.stdout}"
+
+def test_rolling_window_scoreboards():
+    result = dojo_run("dojo", "flask", input="""
+import datetime, json
+from unittest.mock import patch
+from dojo_plugin.utils.background_stats import get_redis_client
+import dojo_plugin.worker.handlers.scoreboard as scoreboard
+
+r = get_redis_client()
+prefix = "stats:scoreboard:test:rolling"
+today = datetime.date(2026, 1, 10)
+rolled = today - datetime.timedelta(days=1)
+r.set(prefix + ":7", json.dumps([
+    {"rank": 1, "solves": 3, "last_solve_id": 50, "user_id": 901, "name": "alice", "email": "a@example.com"},
+    {"rank": 2, "solves": 2, "last_solve_id": 40, "user_id": 902, "name": "bob", "email": "b@example.com"},
+]))
+r.set(prefix + ":30", json.dumps([
+    {"rank": 1, "solves": 3, "last_solve_id": 40, "user_id": 902, "name": "bob", "email": "b@example.com"},
+    {"rank": 2, "solves": 3, "last_solve_id": 50, "user_id": 901, "name": "alice", "email": "a@example.com"},
+    {"rank": 3, "solves": 1, "last_solve_id": 10, "user_id": 903, "name": "carol", "email": "c@example.com"},
+]))
+r.hset(scoreboard.bucket_key(prefix, rolled - datetime.timedelta(days=6)), mapping={901: 2})
+r.hset(scoreboard.bucket_key(prefix, rolled - datetime.timedelta(days=29)), mapping={903: 1, 902: 1})
+r.set(scoreboard.bucket_prefix(prefix) + ":rolled", rolled.isoformat())
+
+with patch.object(scoreboard, "zset_backend", return_value=False):
+    assert scoreboard.roll_scoreboard_windows(None, prefix, today=today)
+    assert scoreboard.roll_scoreboard_windows(None, prefix, today=today)
+
+board_7 = json.loads(r.get(prefix + ":7"))
+board_30 = json.loads(r.get(prefix + ":30"))
+assert [(e["rank"], e["user_id"], e["solves"]) for e in board_7] == [(1, 902, 2), (2, 901, 1)], board_7
+assert [(e["rank"], e["user_id"], e["solves"]) for e in board_30] == [(1, 901, 3), (2, 902, 2)], board_30
+assert r.get(scoreboard.bucket_prefix(prefix) + ":rolled") == today.isoformat()
+
+r.set(scoreboard.bucket_prefix(prefix) + ":rolled", (today - datetime.timedelta(days=10)).isoformat())
+assert not scoreboard.roll_scoreboard_windows(None, prefix, today=today)
+r.delete(*r.keys("stats:*:test:rolling*"))
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"rolling window scoreboard test failed: {result.stdout}"
+
+def test_scoreboard_window_roll_retries_until_every_board_rolls():
+    result = dojo_run("dojo", "flask", input="""
+import datetime, json
+import redis
+from unittest.mock import patch
+from dojo_plugin.utils.background_stats import get_redis_client
+import dojo_plugin.worker.handlers.scoreboard as scoreboard
+
+r = get_redis_client()
+prefix = "stats:scoreboard:test:rolling-conflict"
+today = datetime.date(2026, 1, 10)
+rolled = today - datetime.timedelta(days=1)
+entry = {"rank": 1, "solves": 2, "last_solve_id": 50, "user_id": 901, "name": "alice", "email": "a@example.com"}
+r.set(prefix + ":7", json.dumps([entry]))
+r.set(prefix + ":30", json.dumps([entry]))
+r.hset(scoreboard.bucket_key(prefix, rolled - datetime.timedelta(days=6)), mapping={901: 1})
+r.set(scoreboard.bucket_prefix(prefix) + ":rolled", rolled.isoformat())
+
+# A solve lands on the board while its first roll is in flight, so that roll is retried from the board the solve left.
+subtract_expired = scoreboard.subtract_expired
+calls = []
+def concurrent_solve(board, expired):
+    calls.append(len(calls))
+    if len(calls) == 1:
+        r.set(prefix + ":7", json.dumps([{**entry, "solves": 3, "last_solve_id": 60}]))
+    return subtract_expired(board, expired)
+
+with patch.object(scoreboard, "zset_backend", return_value=False), patch.object(scoreboard, "subtract_expired", concurrent_solve):
+    assert scoreboard.roll_scoreboard_windows(None, prefix, today=today)
+assert len(calls) == 2 * len(scoreboard.WINDOWED_DURATIONS), calls
+assert [(e["user_id"], e["solves"]) for e in json.loads(r.get(prefix + ":7"))] == [(901, 2)]
+assert r.get(scoreboard.bucket_prefix(prefix) + ":rolled") == today.isoformat()
+r.delete(*r.keys("stats:*:test:rolling-conflict*"))
+
+# The day is only marked rolled once every board rolled, and a failing board does not stop the others.
+attempted = []
+def flaky_roll(model, cache_prefix, today=None):
+    attempted.append(cache_prefix)
+    if len(attempted) == 1:
+        raise redis.WatchError("board kept changing")
+    return True
+
+scoreboard._windows_rolled_on = None
+with patch.object(scoreboard, "roll_scoreboard_windows", flaky_roll):
+    try:
+        scoreboard.roll_due_scoreboard_windows()
+        assert False, "a board that failed to roll is reported"
+    except RuntimeError:
+        pass
+    boards = len(attempted)
+    assert boards > 1, attempted
+    assert scoreboard._windows_rolled_on is None
+
+    scoreboard.roll_due_scoreboard_windows()
+    assert len(attempted) == 2 * boards
+    assert scoreboard._windows_rolled_on == scoreboard.utc_today()
+    scoreboard.roll_due_scoreboard_windows()
+    assert len(attempted) == 2 * boards
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"scoreboard window roll retry test failed: {result.stdout}"
+
+def test_dojo_scoreboard_solves_roll_out_of_window():
+    result = dojo_run("dojo", "flask", input="""
+import datetime, json
+from types import SimpleNamespace
+from unittest.mock import patch
+from dojo_plugin.utils.background_stats import get_redis_client
+import dojo_plugin.worker.handlers.scoreboard as scoreboard
+import dojo_plugin.worker.handlers.solve as solve
+
+r = get_redis_client()
+dojo = SimpleNamespace(dojo_id=987654)
+prefix = f"stats:scoreboard:dojo:{dojo.dojo_id}"
+solve_day = datetime.date(2026, 1, 3)
+entry = {"rank": 1, "solves": 1, "last_solve_id": 50, "user_id": 901, "name": "alice", "email": "a@example.com"}
+r.set(prefix + ":7", json.dumps([entry]))
+r.set(prefix + ":30", json.dumps([entry]))
+
+# An incremental solve must leave a bucket behind for the dojo board, as it does for module boards.
+with patch.object(solve, "update_scoreboard_cache"), patch.object(solve, "stale_cache_keys", return_value=set()):
+    solve._update_dojo_scoreboard(dojo, 901, 1, 50, datetime.datetime(2026, 1, 3, 12), 0)
+assert r.hget(scoreboard.bucket_key(prefix, solve_day), 901) == "1"
+
+# The day the solve leaves the 7-day window, but not the 30-day one.
+today = solve_day + datetime.timedelta(days=7)
+r.set(scoreboard.bucket_prefix(prefix) + ":rolled", (today - datetime.timedelta(days=1)).isoformat())
+with patch.object(scoreboard, "zset_backend", return_value=False):
+    assert scoreboard.roll_scoreboard_windows(None, prefix, today=today)
+
+assert json.loads(r.get(prefix + ":7")) == [], r.get(prefix + ":7")
+assert [(e["user_id"], e["solves"]) for e in json.loads(r.get(prefix + ":30"))] == [(901, 1)]
+r.delete(*r.keys(prefix + "*"), *r.keys(scoreboard.bucket_prefix(prefix) + "*"))
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"dojo scoreboard rolling test failed: {result.stdout}"
+
+def test_stat_event_coalescing_and_debounce():
+    result = dojo_run("dojo", "flask", input="""
+import json
+from unittest.mock import MagicMock
+from flask import current_app
+from dojo_plugin.utils.events import queue_stat_event, publish_queued_events
+from dojo_plugin.utils.background_stats import EventDebouncer, get_event_counters
+
+published = []
+def publish_test_event(*args):
+    published.append(args)
+
+before = get_event_counters().get("collapsed:request", 0)
+with current_app.test_request_context():
+    queue_stat_event(publish_test_event, "module", {"dojo_id": 1, "module_index": 0})
+    queue_stat_event(publish_test_event, "module", {"module_index": 0, "dojo_id": 1})
+    queue_stat_event(publish_test_event, "dojo", 1)
+    publish_queued_events()
+assert published == [("module", {"dojo_id": 1, "module_index": 0}), ("dojo", 1)], published
+assert get_event_counters().get("collapsed:request", 0) == before + 1
+
+def message(event_type, payload):
+    return {"data": json.dumps({"type": event_type, "payload": payload})}
+
+handled = []
+r = MagicMock()
+debouncer = EventDebouncer(60_000)
+immediate = debouncer.hold("stat:events", [
+    ("1-0", message("scoreboard_update", {"model_type": "dojo", "model_id": 1})),
+    ("2-0", message("challenge_solve", {"user_id": 1, "challenge_id": 1})),
+    ("3-0", message("scoreboard_update", {"model_type": "dojo", "model_id": 1})),
+    ("4-0", message("scoreboard_update", {"model_type": "dojo", "model_id": 2})),
+])
+assert [message_id for message_id, _ in immediate] == ["2-0"], immediate
+assert debouncer.flush(r, lambda *event: handled.append(event)) == (0, 0)
+assert debouncer.next_deadline_ms() > 0
+assert debouncer.flush(r, lambda *event: handled.append(event), force=True) == (3, 2)
+assert handled == [
+    ("scoreboard_update", {"model_type": "dojo", "model_id": 1}, None),
+    ("scoreboard_update", {"model_type": "dojo", "model_id": 2}, None),
+], handled
+assert r.xackdel.call_args_list[0][0][2:] == ("1-0", "3-0"), r.xackdel.call_args_list
+assert debouncer.next_deadline_ms() is None
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"stat event coalescing test failed: {result.stdout}"
+
+
+def test_worker_metrics():
+    result = dojo_run("dojo", "flask", input="""
+import json
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+from dojo_plugin.utils.background_stats import process_stat_messages, set_cached_stat, get_redis_client, CONSUMER_GROUP
+from dojo_plugin.utils.metrics import CacheAgeCollector, StreamCollector, cache_metric_label
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def message(event_type, payload):
+    return {"data": json.dumps({"type": event_type, "payload": payload})}
+
+def handler(event_type, payload, event_timestamp):
+    if payload.get("fail"):
+        raise RuntimeError("boom")
+
+before_success = sample("dojo_stat_events_total", type="metrics_test", outcome="success")
+before_failure = sample("dojo_stat_events_total", type="metrics_test", outcome="failure")
+before_calls = sample("dojo_stat_event_processing_seconds_count", type="metrics_test")
+process_stat_messages(MagicMock(), [
+    ("1-0", message("metrics_test", {})),
+    ("2-0", message("metrics_test", {"fail": True})),
+    ("3-0", message("metrics_test", {})),
+], handler)
+assert sample("dojo_stat_events_total", type="metrics_test", outcome="success") == before_success + 2
+assert sample("dojo_stat_events_total", type="metrics_test", outcome="failure") == before_failure + 1
+assert sample("dojo_stat_event_processing_seconds_count", type="metrics_test") == before_calls + 2
+
+assert cache_metric_label("stats:activity:42") == "stats:activity:*"
+assert cache_metric_label("stats:scoreboard:module:1:2:7") == "stats:scoreboard:module:*"
+assert cache_metric_label("stats:scoreboard:dojo:1:7") == "stats:scoreboard:dojo:1:7"
+set_cached_stat("stats:activity:metrics-test", {})
+ages = {sample.labels["cache"]: sample.value for family in CacheAgeCollector().collect() for sample in family.samples}
+assert 0 <= ages["stats:activity:*"] < 60, ages
+
+r = get_redis_client()
+stream = "stat:events:metrics-test"
+r.delete(stream)
+r.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
+for i in range(3):
+    r.xadd(stream, {"data": "{}"})
+r.xreadgroup(CONSUMER_GROUP, "metrics-test", {stream: ">"}, count=1)
+families = {family.name: family for family in StreamCollector(r, CONSUMER_GROUP, [stream]).collect()}
+values = {name: [sample.value for sample in family.samples] for name, family in families.items()}
+assert values["dojo_stream_length"] == [3], values
+assert values["dojo_stream_pending"] == [1], values
+assert values["dojo_stream_lag"] == [2], values
+assert values["dojo_stream_metrics_up"] == [1], values
+r.delete(stream)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"worker metrics test failed: {result.stdout}"
+
+
+def test_scores_rank_index():
+    result = dojo_run("dojo", "flask", input="""
+import random
+from dojo_plugin.utils.background_stats import get_redis_client
+from dojo_plugin.utils.scores import write_rank_index, add_rank_index_solve, get_rank_and_solves, get_top_ranked, get_ranked_around
+from dojo_plugin.worker.handlers.scores import update_dojo_scores
+
+scores = {"ranks": [], "solves": {}}
+solve_order = []
+for _ in range(300):
+    user_id = random.randint(1, 40)
+    scores = update_dojo_scores(scores, user_id)
+    solve_order.append(user_id)
+last_solve = {user_id: index for index, user_id in enumerate(solve_order)}
+expected = sorted(scores["solves"], key=lambda user_id: (-scores["solves"][user_id], last_solve[user_id]))
+assert scores["ranks"] == expected, (scores["ranks"], expected)
+
+key = "stats:ranks:test-rank-index"
+write_rank_index(key, [(user_id, scores["solves"][user_id], last_solve[user_id]) for user_id in scores["ranks"]])
+for user_id in scores["ranks"]:
+    assert get_rank_and_solves([key], user_id)[key] == (scores["ranks"].index(user_id) + 1, scores["solves"][user_id], len(scores["ranks"]))
+assert get_rank_and_solves([key], 999)[key] == (None, None, len(scores["ranks"]))
+assert [entry["user_id"] for entry in get_top_ranked(key, 5)] == scores["ranks"][:5]
+
+middle = scores["ranks"][10]
+around = get_ranked_around(key, middle, 2)
+assert [entry["user_id"] for entry in around] == scores["ranks"][8:13], around
+assert [entry["rank"] for entry in around] == [9, 10, 11, 12, 13], around
+
+last = scores["ranks"][-1]
+add_rank_index_solve(key, last, 10_000)
+scores = update_dojo_scores(scores, last)
+assert get_rank_and_solves([key], last)[key][:2] == (scores["ranks"].index(last) + 1, scores["solves"][last])
+get_redis_client().delete(key)
+
+# The script is registered once per client rather than on every solve.
+from dojo_plugin.utils.scores import rank_index_solve_script
+assert rank_index_solve_script(get_redis_client()) is rank_index_solve_script(get_redis_client())
+
+# The rankings break ties by last solve id, like the rank indexes, rather than by last solve date.
+from dojo_plugin.models import Dojos
+from dojo_plugin.worker.handlers.scores import _scores_query
+query = str(_scores_query([Dojos.dojo_id], Dojos.dojo_id == 1))
+assert query.rstrip().endswith("ORDER BY dojos.dojo_id, solve_count DESC, last_solve_id"), query
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"scores rank index test failed: {result.stdout}"
+
+
+def test_official_score_ranking():
+    result = dojo_run("dojo", "flask", input="""
+from CTFd.models import Users, Solves
+from dojo_plugin.api.v1.score import official_score_from_database
+from dojo_plugin.utils.scores import get_official_score
+from dojo_plugin.worker.handlers.scores import update_official_scores
+
+update_official_scores()
+user_ids = [user_id for user_id, in Solves.query.with_entities(Solves.user_id).distinct().limit(50)]
+for user in Users.query.filter(Users.id.in_(user_ids)):
+    official = get_official_score(user.id)
+    assert official is not None, "official ranking was not built"
+    assert official[:4] == official_score_from_database(user), (user.id, official, official_score_from_database(user))
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"official score ranking test failed: {result.stdout}"
+
+
+def test_profile_query_budget():
+    result = dojo_run("dojo", "flask", input="""
+from flask import current_app
+from sqlalchemy import event
+from CTFd.models import db, Users, Solves
+from dojo_plugin.pages.users import profile_dojos, load_profile_data, view_hacker
+
+user_id, = (
+    Solves.query.with_entities(Solves.user_id)
+    .group_by(Solves.user_id)
+    .order_by(db.func.count(Solves.id).desc())
+    .first()
+)
+user = Users.query.get(user_id)
+
+statements = []
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+with current_app.test_request_context("/hacker/"):
+    db.session.expire_all()
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    try:
+        dojos = profile_dojos()
+        profile = load_profile_data(user, dojos)
+        data_statements = len(statements)
+        view_hacker(user, bypass_hidden=True)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_statement)
+
+# dojos, modules, challenges, challenge visibilities and solves, however many dojos and modules there are
+assert data_statements <= 5, (data_statements, statements)
+# The full view loads the same data again, plus the user's fields and what the base template needs.
+assert len(statements) - data_statements <= data_statements + 25, statements[data_statements:]
+
+for dojo in dojos:
+    for module in dojo.modules:
+        solves = module.solves(user=user, ignore_visibility=True, ignore_admins=False).all()
+        expected = {solve.challenge_id: solve.date.strftime("%Y-%m-%d %H:%M:%S") for solve in solves}
+        assert profile["user_solves"][dojo.id].get(module.id, {}) == expected, (dojo.id, module.id)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"profile query budget test failed: {result.stdout}"
+
+
+def test_completion_index():
+    result = dojo_run("dojo", "flask", input="""
+from CTFd.models import db, Users, Solves
+from dojo_plugin.models import Dojos
+from dojo_plugin.utils.background_stats import get_redis_client
+from dojo_plugin.utils.completions import (
+    get_completion_counts, count_required_solves, completed_dojos, record_solve, invalidate_dojo, forget_user, completions_key,
+)
+
+user_id, = Solves.query.with_entities(Solves.user_id).group_by(Solves.user_id).order_by(db.func.count(Solves.id).desc()).first()
+user = Users.query.get(user_id)
+dojos = Dojos.query.options(db.undefer(Dojos.challenges_count), db.undefer(Dojos.required_challenges_count)).all()
+dojo_ids = [dojo.dojo_id for dojo in dojos]
+expected = count_required_solves(user, dojo_ids)
+
+forget_user(user_id)
+assert get_completion_counts(user, dojo_ids) == expected
+assert get_redis_client().exists(completions_key(user_id))
+assert get_completion_counts(user, dojo_ids) == expected
+assert set(completed_dojos(user, dojos)) == {dojo for dojo in dojos if dojo.challenges_count and dojo.completed(user)}
+
+dojo_id = dojo_ids[0]
+record_solve(user_id, {dojo_id: 2})
+assert get_completion_counts(user, [dojo_id])[dojo_id] == expected[dojo_id] + 2
+invalidate_dojo(dojo_id)
+assert get_completion_counts(user, [dojo_id])[dojo_id] == expected[dojo_id]
+
+forget_user(user_id)
+record_solve(user_id, {dojo_id: 1})
+assert get_completion_counts(user, [dojo_id])[dojo_id] == expected[dojo_id]
+forget_user(user_id)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"completion index test failed: {result.stdout}"
+
+
+def test_completion_index_keeps_solves_recorded_while_counting():
+    result = dojo_run("dojo", "flask", input="""
+from unittest.mock import patch
+from CTFd.models import db, Users, Solves
+from dojo_plugin.models import Dojos
+import dojo_plugin.utils.completions as completions
+
+user_id, = Solves.query.with_entities(Solves.user_id).group_by(Solves.user_id).order_by(db.func.count(Solves.id).desc()).first()
+user = Users.query.get(user_id)
+dojo_id = Dojos.query.first().dojo_id
+expected = completions.count_required_solves(user, [dojo_id])[dojo_id]
+count_required_solves = completions.count_required_solves
+
+def count_then_solve(user, dojo_ids):
+    # A solve commits after the count is taken but before it is indexed.
+    counts = count_required_solves(user, dojo_ids)
+    completions.record_solve(user.id, {dojo_id: 1})
+    return counts
+
+completions.forget_user(user_id)
+with patch.object(completions, "count_required_solves", count_then_solve):
+    assert completions.get_completion_counts(user, [dojo_id])[dojo_id] == expected
+assert completions.get_completion_counts(user, [dojo_id])[dojo_id] == expected + 1, "the interleaved solve was lost"
+assert not any(field.startswith("pending:") for field in completions.get_redis_client().hkeys(completions.completions_key(user_id)))
+completions.forget_user(user_id)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"completion index race test failed: {result.stdout}"
+
+
+def test_incremental_awards_match_full_recompute():
+    result = dojo_run("dojo", "flask", input="""
+from CTFd.models import Users
+from dojo_plugin.worker.handlers.awards import (
+    calculate_belts, calculate_emojis, apply_user_belts, apply_user_emojis, as_cached, diff_awards,
+)
+
+full_belts = calculate_belts()
+full_emojis = calculate_emojis()
+belts = as_cached(full_belts)
+emojis = as_cached(full_emojis)
+user_ids = sorted(set(full_belts["users"]) | set(full_emojis["emojis"]))[:20]
+
+for user_id in user_ids:
+    apply_user_belts(belts, user_id, {"dates": {}, "users": {}})
+    apply_user_emojis(emojis, user_id, {"emojis": {}})
+    assert str(user_id) not in belts["users"] and str(user_id) not in emojis["emojis"]
+for user_id in reversed(user_ids):
+    user = Users.query.get(user_id)
+    apply_user_belts(belts, user_id, calculate_belts(user))
+    apply_user_emojis(emojis, user_id, calculate_emojis(user, emojis["dojos"]))
+
+assert not diff_awards("belts", belts, full_belts), (belts, full_belts)
+assert not diff_awards("emojis", emojis, full_emojis), (emojis, full_emojis)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"incremental awards test failed: {result.stdout}"
+
+def test_per_user_award_update_failure_propagates():
+    result = dojo_run("dojo", "flask", input="""
+from unittest.mock import patch
+import dojo_plugin.worker.handlers.awards as awards
+
+# A failed per-user update must fail the event, so that it is retried rather than acknowledged.
+for handler, update in ((awards.handle_belts_update, "update_user_belts"), (awards.handle_emojis_update, "update_user_emojis")):
+    with patch.object(awards, update, side_effect=RuntimeError("database unavailable")):
+        try:
+            handler({"user_id": 1})
+            assert False, f"{handler.__name__} swallowed the failure"
+        except RuntimeError:
+            pass
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"per-user award failure test failed: {result.stdout}"
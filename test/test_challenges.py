@@ -2,6 +2,7 @@ import subprocess
 import pytest
 import json
 import re
+import time
 from urllib.parse import quote, urlencode
 
 from selenium.webdriver.common.by import By
@@ -175,6 +176,11 @@ def test_workspace_flag_permission():
         assert False, f"Expected permission denied, but got no error: {(e.stdout, e.stderr)}"
 
 
+def test_workspace_challenge_ownership():
+    result = workspace_run("stat -c '%U:%G %a' /challenge/apple", user="admin")
+    assert result.stdout.strip() == "root:root 4755", f"Expected a root-owned setuid challenge, but got: {result.stdout}"
+
+
 def test_workspace_challenge():
     result = workspace_run("/challenge/apple", user="admin")
     match = re.search("pwn.college{(\\S+)}", result.stdout)
@@ -314,3 +320,241 @@ def test_privileged_challenge(random_user_name, random_user_session, privileged_
         workspace_run("unshare true", user=random_user_name)
     except subprocess.CalledProcessError as e:
         assert False, f"Expected unshare to succeed, but got: {(e.stdout, e.stderr)}"
+
+
+def test_workspace_pool_with_fake_docker():
+    result = dojo_run("dojo", "flask", input="""
+import itertools
+from unittest.mock import patch
+from dojo_plugin.utils.background_stats import get_redis_client
+from dojo_plugin.utils import workspace_pool
+from dojo_plugin.utils.workspace_pool import (
+    POOL_CLAIM_PREFIX, POOL_COUNTERS_KEY, POOL_DEMAND_KEY, claim_pool_container, demanded_pool_keys, expire_pool,
+    fill_pool, pool_key, sweep_pool_homes, with_claimed_labels,
+)
+
+ids = itertools.count()
+
+class FakeContainer:
+    def __init__(self, client, name, labels, **attributes):
+        self.client, self.name, self.id = client, name, f"fake-pool-{next(ids)}"
+        self.attrs = {"Config": {"Labels": dict(labels)}, "Created": "2020-01-01T00:00:00.000000000Z"}
+        self.attributes = attributes
+    labels = property(lambda self: self.attrs["Config"]["Labels"])
+    def start(self): pass
+    def rename(self, name): self.name = name
+    def remove(self, force=False): self.client.containers.running.remove(self)
+
+class FakeHelper:
+    def __init__(self, status): self.status = status
+    def wait(self): return {"StatusCode": self.status}
+    def remove(self, force=False): pass
+
+class FakeContainers:
+    def __init__(self, client): self.client, self.running, self.helpers, self.helper_status = client, [], [], 0
+    def create(self, name, labels, **attributes):
+        container = FakeContainer(self.client, name, labels, **attributes)
+        self.running.append(container)
+        return container
+    def run(self, image, command, mounts, privileged=False, detach=False):
+        self.helpers.append((command, mounts))
+        return FakeHelper(self.helper_status)
+    def list(self, filters, all=False, ignore_removed=False):
+        label, _, value = filters["label"].partition("=")
+        return [c for c in self.running if label in c.labels and (not value or c.labels[label] == value)]
+
+class FakeDocker:
+    def __init__(self): self.containers = FakeContainers(self)
+
+r = get_redis_client()
+r.delete(POOL_COUNTERS_KEY, POOL_DEMAND_KEY)
+docker_client = FakeDocker()
+key = pool_key(0, "pwncollege/challenge-simple", False)
+attributes = {"image": "pwncollege/challenge-simple", "environment": {"HOME": "/home/hacker"}, "mounts": [], "network": None}
+home = {"Target": "/home/hacker", "Source": "1", "Type": "volume", "VolumeOptions": {"NoCopy": True}}
+
+with patch.object(workspace_pool, "WORKSPACE_POOL_SIZE", 2):
+    assert claim_pool_container(docker_client, key, name="user_1", labels={"dojo.user_id": "1"}, r=r) is None
+    assert demanded_pool_keys(r) == [key]
+    assert fill_pool(docker_client, key, attributes, now=1000) == 2
+    assert fill_pool(docker_client, key, attributes, now=1000) == 2
+    assert len(docker_client.containers.running) == 2
+    assert all(c.attributes["environment"]["DOJO_INIT_POOLED"] == "1" for c in docker_client.containers.running)
+    homes = [c.attributes["mounts"][-1]["Source"] for c in docker_client.containers.running]
+    assert docker_client.containers.helpers == [(["mkdir", "-p", *homes], docker_client.containers.helpers[0][1])], "one helper makes the homes of a fill"
+    assert all(c.attributes["mounts"][-1]["Target"] == "/home/hacker" for c in docker_client.containers.running)
+
+    container = claim_pool_container(docker_client, key, name="user_1", labels={"dojo.user_id": "1", "dojo.challenge_id": "apple"}, home=home, r=r, now=1001)
+    assert container.name == "user_1"
+    assert with_claimed_labels(container, r).labels["dojo.challenge_id"] == "apple"
+    assert container.attrs["Created"].startswith("1970-01-01T00:16:41"), "the session starts at the claim"
+    command, mounts = docker_client.containers.helpers[-1]
+    assert command == ["mount", "--bind", "/mnt/home", "/mnt/pool"], command
+    assert mounts[0] == {**home, "Target": "/mnt/home"} and mounts[1]["Source"] == container.attributes["mounts"][-1]["Source"], mounts
+
+    assert fill_pool(docker_client, key, attributes, now=1002) == 2
+    assert len(docker_client.containers.running) == 3
+
+    with patch.object(workspace_pool, "WORKSPACE_POOL_TTL", 10):
+        assert expire_pool(docker_client, r, now=1011) == 1, "only the idle workspace from the first fill has expired"
+    assert container in docker_client.containers.running, "claimed workspaces never expire"
+
+    # A workspace whose home cannot be mounted is removed, and the start falls back to a cold one.
+    docker_client.containers.helper_status = 1
+    assert claim_pool_container(docker_client, key, name="user_2", labels={"dojo.user_id": "2"}, home=home, r=r, now=1012) is None
+    assert len(docker_client.containers.running) == 2
+    docker_client.containers.helper_status = 0
+
+    sweep_pool_homes(docker_client)
+    command, mounts = docker_client.containers.helpers[-1]
+    live = {c.labels["dojo.pool_home"] for c in docker_client.containers.running}
+    assert set(command[4:]) == live and len(live) == 2, "the homes of the remaining workspaces are kept"
+
+    # Privileged workspaces run in a VM, so their pools are not given homes.
+    privileged_key = pool_key(0, "pwncollege/challenge-simple", True)
+    helpers = len(docker_client.containers.helpers)
+    fill_pool(docker_client, privileged_key, attributes, now=1003)
+    assert len(docker_client.containers.helpers) == helpers
+    assert all(not c.attributes["mounts"] for c in docker_client.containers.running if c.labels["dojo.pool"] == privileged_key)
+
+assert r.hgetall(POOL_COUNTERS_KEY) == {"miss": "2", "hit": "1", "expired": "1"}
+for c in docker_client.containers.running:
+    r.delete(f"{POOL_CLAIM_PREFIX}{c.id}")
+r.delete(POOL_COUNTERS_KEY, POOL_DEMAND_KEY)
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"Workspace pool test failed: {result.stdout}"
+
+
+def test_shared_docker_clients_reconnect():
+    result = dojo_run("dojo", "flask", input="""
+from unittest.mock import patch
+import docker.errors
+from dojo_plugin.utils import docker_clients
+from dojo_plugin.utils.docker_clients import reset_docker_client, shared_docker_client
+
+class FakeClient:
+    def __init__(self): self.healthy, self.closed = True, False
+    def ping(self):
+        if not self.healthy:
+            raise docker.errors.APIError("daemon went away")
+        return True
+    def close(self): self.closed = True
+
+connects = []
+def connect():
+    connects.append(FakeClient())
+    return connects[-1]
+
+first = shared_docker_client("test", connect)
+assert shared_docker_client("test", connect) is first and len(connects) == 1
+
+with patch.object(docker_clients, "DOCKER_CLIENT_HEALTH_SECONDS", 0):
+    assert shared_docker_client("test", connect) is first, "a healthy client is kept"
+    first.healthy = False
+    second = shared_docker_client("test", connect)
+assert second is not first and first.closed, "a client that fails its health check is replaced"
+
+reset_docker_client("test")
+assert second.closed and shared_docker_client("test", connect) is connects[-1] and len(connects) == 3
+reset_docker_client("test")
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"Shared docker client test failed: {result.stdout}"
+
+
+def test_active_container_index_reconciles():
+    result = dojo_run("dojo", "flask", input="""
+import time
+from types import SimpleNamespace
+import redis
+from flask import current_app
+from dojo_plugin.utils.active_containers import (
+    clear_active_container, get_active_container, reconcile_active_containers, set_active_container,
+)
+
+def labels(user_id, challenge):
+    return {"dojo.user_id": str(user_id), "dojo.dojo_id": "example", "dojo.module_id": "hello", "dojo.challenge_id": challenge, "dojo.mode": "standard"}
+
+class FakeContainers:
+    def __init__(self, running): self.running = running
+    def list(self, filters, sparse=False, ignore_removed=False):
+        if filters["label"] != "dojo.user_id":
+            return []
+        return [SimpleNamespace(id=container_id, attrs={"Labels": container_labels, "Created": 1})
+                for container_id, container_labels in self.running.items()]
+
+# A database of its own, which the workspace pool worker does not reconcile.
+r = redis.from_url(current_app.config["REDIS_URL"], db=15, decode_responses=True)
+r.flushdb()
+user_ids = [1, 2, 3]
+
+set_active_container(user_ids[0], SimpleNamespace(id="kept", labels=labels(user_ids[0], "apple")), 0, r)
+set_active_container(user_ids[1], SimpleNamespace(id="exited", labels=labels(user_ids[1], "apple")), 0, r)
+assert get_active_container(SimpleNamespace(id=user_ids[0]), r)["challenge"] == "apple"
+
+time.sleep(0.01)
+node = SimpleNamespace(containers=FakeContainers({"kept": labels(user_ids[0], "apple"), "unindexed": labels(user_ids[2], "banana")}))
+assert reconcile_active_containers({0: node}, r) == (1, 1)
+assert get_active_container(SimpleNamespace(id=user_ids[0]), r)["container_id"] == "kept"
+assert get_active_container(SimpleNamespace(id=user_ids[1]), r) is None, "exited containers are dropped"
+assert get_active_container(SimpleNamespace(id=user_ids[2]), r)["challenge"] == "banana", "unindexed containers are added"
+
+clear_active_container(user_ids[0], r)
+assert get_active_container(SimpleNamespace(id=user_ids[0]), r) is None
+r.flushdb()
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"Active container index test failed: {result.stdout}"
+
+
+def test_async_start_challenge(random_user_name, random_user_session, admin_session, example_dojo):
+    response = random_user_session.post(f"{DOJO_URL}/pwncollege_api/v1/docker", json={"dojo": example_dojo, "module": "hello", "challenge": "apple", "async": True})
+    assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
+    assert response.json()["success"], f"Failed to queue challenge start: {response.json()}"
+    job_id = response.json()["job"]["id"]
+
+    response = admin_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker/jobs/{job_id}")
+    assert response.status_code == 404, "Expected other users not to see the start job"
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        job = random_user_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker/jobs/{job_id}").json()["job"]
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(1)
+    assert job["status"] == "succeeded", f"Expected the start job to succeed, but got: {job}"
+    assert job["phase"] == "done" and job["attempt"] >= 1, f"Expected the job to report its phases, but got: {job}"
+
+    result = workspace_run("cat /challenge/apple >/dev/null && echo started", user=random_user_name)
+    assert result.stdout.strip() == "started", f"Expected the challenge to be running, but got: {(result.stdout, result.stderr)}"
+
+
+def test_interrupted_start_job_is_not_active():
+    result = dojo_run("dojo", "flask", input="""
+import json, time, uuid
+from dojo_plugin.utils.background_stats import get_redis_client
+from dojo_plugin.utils.start_jobs import (
+    START_JOB_USER_PREFIX, START_JOB_STALE_SECONDS, active_start_job, get_start_job, start_job_heartbeat_key, start_job_key,
+)
+
+r = get_redis_client()
+user_id = -int(time.time())
+job_id = uuid.uuid4().hex
+job = {"id": job_id, "user_id": user_id, "status": "running", "phase": "readying", "attempt": 1, "error": None,
+       "created_at": time.time(), "updated_at": time.time()}
+r.set(start_job_key(job_id), json.dumps(job), ex=60)
+r.set(f"{START_JOB_USER_PREFIX}{user_id}", job_id, ex=60)
+
+r.set(start_job_heartbeat_key(job_id), "test", ex=START_JOB_STALE_SECONDS)
+assert get_start_job(job_id, r)["status"] == "running"
+assert active_start_job(user_id, r)["id"] == job_id
+
+# The worker died: its heartbeat expired without the job finishing.
+r.delete(start_job_heartbeat_key(job_id))
+assert get_start_job(job_id, r)["status"] == "failed"
+assert active_start_job(user_id, r) is None, "a dead job must not block new starts"
+r.delete(start_job_key(job_id), f"{START_JOB_USER_PREFIX}{user_id}")
+print("OK")
+""", check=True)
+    assert "OK" in result.stdout, f"Interrupted start job test failed: {result.stdout}"
@@ -259,6 +259,74 @@ def test_crew_parse_and_aggregation_unit():
     assert "CREW-UNIT-OK" in flask_exec(CREW_PARSE_UNIT)
 
 
+CREW_INDEX_UNIT = r"""
+import random
+from CTFd.plugins.dojo_plugin.utils.background_stats import get_redis_client
+from CTFd.plugins.dojo_plugin.utils.crews import aggregate_crews, parse_crew_tag
+from CTFd.plugins.dojo_plugin.utils.crew_store import (
+    rebuild_crew_index, add_crew_solve, read_crew_page, read_crew_rank, crew_index_exists, crew_order_key, CREW_MODES,
+)
+
+users = {user_id: f"user{user_id}" + (f" [{random.choice(['Red', 'red', 'Blue', 'Gr|een'])}]" if user_id % 3 else "") for user_id in range(1, 30)}
+challenges = {user_id: set() for user_id in users}
+last_solve = {}
+
+def board():
+    solved = [user_id for user_id in users if challenges[user_id]]
+    solved.sort(key=lambda user_id: (-len(challenges[user_id]), last_solve[user_id]))
+    return [{"user_id": user_id, "name": users[user_id], "solves": len(challenges[user_id]), "last_solve_id": last_solve[user_id], "rank": rank}
+            for rank, user_id in enumerate(solved, 1)]
+
+def expected(mode):
+    crews = aggregate_crews(board(), challenges)
+    order = sorted(crews, key=lambda crew: crew["rank" if mode == "cumulative" else "unique_rank"])
+    return [(crew["key"], crew["score"], crew["unique"], len(crew["members"])) for crew in order]
+
+def indexed(crews_key, mode):
+    crews, total = read_crew_page(crews_key, mode, 0, 0)
+    assert total == len(crews)
+    assert [crew["rank"] for crew in crews] == list(range(1, total + 1))
+    return [(crew["key"], crew["score"], crew["unique"], len(crew["member_ids"])) for crew in crews]
+
+incremental_key = "stats:crews:test-index:incremental"
+rebuilt_key = "stats:crews:test-index:rebuilt"
+r = get_redis_client()
+for crews_key in (incremental_key, rebuilt_key):
+    r.delete(crews_key, f"{crews_key}:updated", *(crew_order_key(crews_key, mode) for mode in CREW_MODES))
+    assert not crew_index_exists(crews_key)
+rebuild_crew_index(incremental_key, [], {})
+assert crew_index_exists(incremental_key)
+
+for solve_id in range(1, 150):
+    user_id = random.choice(list(users))
+    challenge_id = random.randint(1, 12)
+    if challenge_id in challenges[user_id]:
+        continue
+    challenges[user_id].add(challenge_id)
+    last_solve[user_id] = solve_id
+    entry = next(entry for entry in board() if entry["user_id"] == user_id)
+    parsed = parse_crew_tag(users[user_id])
+    if parsed:
+        add_crew_solve(incremental_key, user_id, entry["solves"], solve_id, challenge_id, {"key": parsed["key"], "tag": parsed["tag"]},
+                       lambda: set(challenges[user_id]))
+
+rebuild_crew_index(rebuilt_key, board(), challenges)
+for mode in CREW_MODES:
+    assert indexed(incremental_key, mode) == expected(mode), (mode, indexed(incremental_key, mode), expected(mode))
+    assert indexed(rebuilt_key, mode) == expected(mode), mode
+    for rank, (crew_key, *_) in enumerate(expected(mode), 1):
+        assert read_crew_rank(incremental_key, mode, crew_key)["rank"] == rank
+
+for crews_key in (incremental_key, rebuilt_key):
+    r.delete(crews_key, f"{crews_key}:updated", *(crew_order_key(crews_key, mode) for mode in CREW_MODES))
+print("CREW-INDEX-OK")
+"""
+
+
+def test_crew_index_matches_aggregation():
+    assert "CREW-INDEX-OK" in flask_exec(CREW_INDEX_UNIT)
+
+
 @pytest.mark.timeout(300)
 def test_crew_scoreboard_api(crew_dojo):
     tag = "".join(random.choices(string.ascii_uppercase, k=8))
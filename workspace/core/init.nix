@@ -30,6 +30,16 @@ let
       mkdir -p /bin && ln -sfT /run/dojo/bin/sh /bin/sh
     fi
 
+    if [ -n "$DOJO_INIT_POOLED" ]; then
+      # Pooled workspaces wait, for as long as it takes, to be claimed; the claim mounts the user's home over
+      # /home/hacker and then sends the user's auth token and address. The workspace's command, which limits its
+      # session, only runs after init, so the session starts at the claim.
+      echo "DOJO_INIT_POOLED"
+      read DOJO_AUTH_TOKEN DOJO_USER_IPV4
+      echo "$DOJO_USER_IPV4 dojo-user" >> /etc/hosts
+      cd /home/hacker
+    fi
+
     home_directory="/home/hacker"
     home_mount_options="$(findmnt -nro OPTIONS -- "$home_directory")"
     if [ -n "$home_mount_options" ] && ! printf '%s' "$home_mount_options" | grep -Fqw 'nosuid'; then
@@ -97,6 +107,11 @@ let
       export PATH="/run/challenge/bin:/run/dojo/bin:$PATH"
     fi
 
+    if [[ -z "$DOJO_AUTH_TOKEN" && -r /run/dojo/var/auth_token ]]; then
+      # Workspaces from the pool get their auth token after they start, so it is not in their environment.
+      export DOJO_AUTH_TOKEN="$(< /run/dojo/var/auth_token)"
+    fi
+
     if [[ -z "$LANG" ]]; then
       export LANG="C.UTF-8"
     fi